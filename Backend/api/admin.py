@@ -1,5 +1,5 @@
 from django.contrib import admin 
-from .models import Author,Story,Tag,Comment,Library,LibraryStory,Like,Follower,Notification
+from .models import Author,Story,Tag,Comment,Library,LibraryStory,Like,Follower,Notification,NotificationJob,RevokedToken
 from django.contrib.auth.admin import UserAdmin
 
 # Register your models here.
@@ -12,6 +12,8 @@ admin.site.register(LibraryStory)
 admin.site.register(Like)
 admin.site.register(Follower)
 admin.site.register(Notification)
+admin.site.register(NotificationJob)
+admin.site.register(RevokedToken)
 
 
 
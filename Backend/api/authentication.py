@@ -0,0 +1,157 @@
+"""
+JWT authentication without a user query.
+
+Tokens issued by `BlogRefreshToken` carry `username` and `is_staff` next to the
+user id. For safe (read) methods `ClaimsJWTAuthentication` turns them into a
+`ClaimsUser`: id, pk and username are read from the token, the Author row is
+only fetched when a view touches anything else (email, bio, is_staff, a model
+comparison...). Views and permissions compare ids (`obj.author_id ==
+request.user.pk`) so the common read paths never load it. Writes, admin checks
+and tokens from before the extra claims get the regular user lookup, which
+rejects deleted and inactive users.
+
+The claims are re-read from the user on every refresh, so a read can run on a
+deleted or deactivated account for at most ACCESS_TOKEN_LIFETIME.
+
+Refresh tokens are single use: rotation and logout revoke them in the blacklist
+of api/revocation.py, which every refresh checks.
+
+EventSource can't send an Authorization header, so a browser opens the
+notification stream with a stream ticket instead of the access token: a signed
+user id that only the stream endpoint accepts and that expires after
+NOTIFICATION_STREAM_TICKET_MAX_AGE seconds, so a URL that ends up in a log
+is of no use for anything else, or for long.
+"""
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core import signing
+from django.utils.functional import SimpleLazyObject
+from rest_framework.exceptions import AuthenticationFailed
+from rest_framework.permissions import SAFE_METHODS
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import TokenError
+from rest_framework_simplejwt.serializers import (
+    TokenBlacklistSerializer, TokenObtainPairSerializer, TokenRefreshSerializer,
+)
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.tokens import RefreshToken
+
+from . import revocation
+
+CLAIMS = ('username',)
+STREAM_TICKET_MAX_AGE = getattr(settings, 'NOTIFICATION_STREAM_TICKET_MAX_AGE', 30)
+_STREAM_TICKET_SALT = 'api.notification-stream'
+
+
+class BlogRefreshToken(RefreshToken):
+    @classmethod
+    def for_user(cls, user):
+        token = super().for_user(user)
+        token.set_user_claims(user)
+        return token
+
+    def set_user_claims(self, user):
+        # copied into every access token made from this refresh token;
+        # is_staff is informational, permissions read it from the user row
+        self['username'] = user.username
+        self['is_staff'] = user.is_staff
+
+    def verify(self, *args, **kwargs):
+        super().verify(*args, **kwargs)
+        if revocation.is_revoked(self[api_settings.JTI_CLAIM]):
+            raise TokenError('Token is blacklisted')
+
+    def blacklist(self):
+        # called by the refresh serializer on rotation: a token revoked meanwhile
+        # (replayed, or refreshed twice at once) must not yield a second pair
+        if not revocation.revoke(self[api_settings.JTI_CLAIM], self['exp']):
+            raise TokenError('Token is blacklisted')
+
+
+class BlogTokenObtainPairSerializer(TokenObtainPairSerializer):
+    token_class = BlogRefreshToken
+
+
+class BlogTokenRefreshSerializer(TokenRefreshSerializer):
+    token_class = BlogRefreshToken
+
+    def validate(self, attrs):
+        refresh = self.token_class(attrs['refresh'])
+        # deleted or deactivated users cannot refresh, renamed or demoted ones get current claims
+        refresh.set_user_claims(_load_user(refresh[api_settings.USER_ID_CLAIM]))
+        data = {'access': str(refresh.access_token)}
+        if api_settings.ROTATE_REFRESH_TOKENS:
+            if api_settings.BLACKLIST_AFTER_ROTATION:
+                refresh.blacklist()
+            refresh.set_jti()
+            refresh.set_exp()
+            refresh.set_iat()
+            data['refresh'] = str(refresh)
+        return data
+
+
+class BlogTokenBlacklistSerializer(TokenBlacklistSerializer):
+    token_class = BlogRefreshToken
+
+
+def _load_user(user_id):
+    try:
+        user = get_user_model().objects.get(**{api_settings.USER_ID_FIELD: user_id})
+    except get_user_model().DoesNotExist:
+        raise AuthenticationFailed('User not found', code='user_not_found')
+    if not user.is_active:
+        raise AuthenticationFailed('User is inactive', code='user_inactive')
+    return user
+
+
+def stream_ticket(user_id):
+    """A ticket that opens the notification stream of `user_id` for STREAM_TICKET_MAX_AGE seconds."""
+    return signing.dumps(user_id, salt=_STREAM_TICKET_SALT)
+
+
+def stream_ticket_user(ticket):
+    """The active user of a stream ticket, AuthenticationFailed if it is forged or expired."""
+    try:
+        user_id = signing.loads(ticket, salt=_STREAM_TICKET_SALT, max_age=STREAM_TICKET_MAX_AGE)
+    except signing.BadSignature:
+        raise AuthenticationFailed('Invalid or expired stream ticket', code='invalid_stream_ticket')
+    return _load_user(user_id)
+
+
+class ClaimsUser(SimpleLazyObject):
+    """The request user of a JWT request, answers from the token claims until something else is needed."""
+
+    def __init__(self, token):
+        user_id = token[api_settings.USER_ID_CLAIM]
+        super().__init__(lambda: _load_user(user_id))
+        # LazyObject forwards attribute writes to the wrapped user, so set ours directly
+        self.__dict__['_claims'] = {'id': user_id, **{name: token[name] for name in CLAIMS}}
+
+    id = property(lambda self: self._claims['id'])
+    pk = property(lambda self: self._claims['id'])
+    username = property(lambda self: self._claims['username'])
+    is_authenticated = property(lambda self: True)
+    is_anonymous = property(lambda self: False)
+
+    def __bool__(self):
+        # `request.user and ...` in permission checks must not load the row
+        return True
+
+    def __str__(self):
+        return self._claims['username']
+
+
+class ClaimsJWTAuthentication(JWTAuthentication):
+    # set per request by authenticate(), direct get_user() callers get the checked user
+    trust_claims = False
+
+    def authenticate(self, request):
+        # writes load the user, so a deleted or deactivated account cannot change anything
+        self.trust_claims = request.method in SAFE_METHODS
+        return super().authenticate(request)
+
+    def get_user(self, validated_token):
+        if (self.trust_claims and api_settings.USER_ID_CLAIM in validated_token
+                and all(name in validated_token for name in CLAIMS)):
+            return ClaimsUser(validated_token)
+        return super().get_user(validated_token)
@@ -0,0 +1,191 @@
+"""
+Pub/sub of notification events to the streaming endpoint.
+
+Publishers (signal handlers, api/inbox.py, api/jobs.py) call `publish_after_commit`
+from ordinary sync code; each open `/api/notifications/stream/` connection holds
+a subscription whose events are awaited on the event loop, so an idle connection
+costs a queue and no thread. The broker class is NOTIFICATION_BROKER. The default
+`PostgresBroker` publishes with NOTIFY, so the notifications inserted by the job
+worker (`process_notification_jobs`) reach the streams of every web process; the
+`InProcessBroker` only reaches connections served by the publishing process and
+is meant for tests and single-process development.
+"""
+import asyncio
+import json
+import logging
+import select
+import threading
+from functools import lru_cache
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections, transaction
+from django.utils.module_loading import import_string
+
+logger = logging.getLogger(__name__)
+
+SUBSCRIBER_QUEUE_SIZE = getattr(settings, 'NOTIFICATION_STREAM_QUEUE_SIZE', 100)
+# seconds between checks of the listening connection (and of stop())
+LISTEN_POLL_INTERVAL = 5
+LISTEN_RETRY_DELAY = 5
+
+
+class BaseBroker:
+    def publish(self, user_id, event):
+        """Deliver `event` (a JSON-serializable dict) to the subscriptions of `user_id`. Thread-safe."""
+        raise NotImplementedError
+
+    def subscribe(self, user_id):
+        """Return a Subscription of `user_id`, must be called from the event loop that reads it."""
+        raise NotImplementedError
+
+    def unsubscribe(self, subscription):
+        raise NotImplementedError
+
+
+class Subscription:
+    def __init__(self, user_id, loop, maxsize=SUBSCRIBER_QUEUE_SIZE):
+        self.user_id = user_id
+        self.loop = loop
+        self.queue = asyncio.Queue(maxsize=maxsize)
+
+    def offer(self, event):
+        # runs on the subscription's loop
+        try:
+            self.queue.put_nowait(event)
+        except asyncio.QueueFull:
+            # a stalled client loses events rather than growing memory, it can reload the list
+            logger.warning('notification stream of user %s is full, dropping an event', self.user_id)
+
+    async def get(self, timeout=None):
+        """Next event, or None after `timeout` seconds without one."""
+        try:
+            return await asyncio.wait_for(self.queue.get(), timeout)
+        except asyncio.TimeoutError:
+            return None
+
+
+class InProcessBroker(BaseBroker):
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._subscriptions = {}
+
+    def publish(self, user_id, event):
+        with self._lock:
+            subscriptions = list(self._subscriptions.get(user_id, ()))
+        for subscription in subscriptions:
+            try:
+                subscription.loop.call_soon_threadsafe(subscription.offer, event)
+            except RuntimeError:
+                # the loop is closed, the connection is going away
+                self.unsubscribe(subscription)
+
+    def subscribe(self, user_id):
+        subscription = Subscription(user_id, asyncio.get_running_loop())
+        with self._lock:
+            self._subscriptions.setdefault(user_id, set()).add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            subscriptions = self._subscriptions.get(subscription.user_id)
+            if subscriptions is not None:
+                subscriptions.discard(subscription)
+                if not subscriptions:
+                    del self._subscriptions[subscription.user_id]
+
+
+class PostgresBroker(InProcessBroker):
+    """
+    LISTEN/NOTIFY on the default database. `publish` is a NOTIFY on CHANNEL; every
+    process with open streams keeps one listening connection in a thread and hands
+    what arrives to its local subscriptions. Events sent while a listener
+    reconnects are lost, clients catch up from the notification list.
+    """
+    CHANNEL = 'api_notifications'
+
+    def __init__(self, using=DEFAULT_DB_ALIAS):
+        super().__init__()
+        self.using = using
+        self.listening = threading.Event()
+        self._stopping = threading.Event()
+        self._listener = None
+
+    def publish(self, user_id, event):
+        # NOTIFY is transactional: publish_after_commit calls this after the commit
+        with connections[self.using].cursor() as cursor:
+            cursor.execute('SELECT pg_notify(%s, %s)',
+                           [self.CHANNEL, json.dumps({'user': user_id, 'event': event})])
+
+    def subscribe(self, user_id):
+        with self._lock:
+            if self._listener is None:
+                self._listener = threading.Thread(target=self._listen, name='notification-listener', daemon=True)
+                self._listener.start()
+        return super().subscribe(user_id)
+
+    def stop(self):
+        """Stop listening and close the connection (tests, shutdown)."""
+        self._stopping.set()
+        if self._listener is not None:
+            self._listener.join()
+
+    def _listen(self):
+        while not self._stopping.is_set():
+            try:
+                self._listen_until_stopped()
+            except Exception:
+                self.listening.clear()
+                logger.exception('notification listener lost its connection, reconnecting')
+                self._stopping.wait(LISTEN_RETRY_DELAY)
+
+    def _listen_until_stopped(self):
+        wrapper = connections[self.using]
+        # a connection of our own, Django's are per thread and in transactions
+        connection = wrapper.get_new_connection(wrapper.get_connection_params())
+        try:
+            connection.autocommit = True
+            with connection.cursor() as cursor:
+                cursor.execute(f'LISTEN {self.CHANNEL}')
+            self.listening.set()
+            while not self._stopping.is_set():
+                if not select.select([connection], [], [], LISTEN_POLL_INTERVAL)[0]:
+                    continue
+                connection.poll()
+                while connection.notifies:
+                    message = json.loads(connection.notifies.pop(0).payload)
+                    InProcessBroker.publish(self, message['user'], message['event'])
+        finally:
+            self.listening.clear()
+            connection.close()
+
+
+@lru_cache(maxsize=None)
+def get_broker():
+    return import_string(getattr(settings, 'NOTIFICATION_BROKER', 'api.broker.PostgresBroker'))()
+
+
+def publish_after_commit(events):
+    """Publish `(user_id, event)` pairs once the current transaction commits."""
+    events = list(events)
+    if not events:
+        return
+
+    def publish():
+        broker = get_broker()
+        for user_id, event in events:
+            broker.publish(user_id, event)
+
+    transaction.on_commit(publish)
+
+
+def notification_event(notification_id, notif_type, sender_id, story_id=None, comment_id=None,
+                       created_at=None, actor_count=1):
+    return {
+        'id': notification_id,
+        'notif_type': notif_type,
+        'sender': sender_id,
+        'story': story_id,
+        'comment': comment_id,
+        'created_at': created_at.isoformat() if created_at else None,
+        'actor_count': actor_count,
+    }
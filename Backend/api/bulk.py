@@ -0,0 +1,130 @@
+"""
+Bulk writes for likes, follows and library entries.
+
+A request carries a list of ids: they are validated with one query, new rows are
+inserted with one INSERT ... ON CONFLICT DO NOTHING RETURNING against the
+unique_together constraints and removed rows with one DELETE ... RETURNING. Only
+the returned ids, the rows this request actually changed, move the counters, so
+concurrent requests for the same rows count them once. Raw statements send no
+model signals, so the counters, notifications, timelines and caches that the
+handlers in api/signals.py maintain are updated here, once per request.
+"""
+from django.conf import settings
+from django.db import connection, transaction
+from django.utils import timezone
+
+from . import feed, inbox
+from .cache import invalidate
+from .counters import adjust_counter
+from .models import Author, Follower, Like, LibraryStory, Story, TimelineEntry
+from .profiles import invalidate_authors
+
+BULK_MAX_IDS = getattr(settings, 'API_BULK_MAX_IDS', 500)
+
+
+def parse_ids(data, key):
+    """Distinct integer ids of `data[key]`, raises ValueError on bad input."""
+    ids = data.get(key)
+    if not isinstance(ids, list) or not ids:
+        raise ValueError(f'{key} must be a non-empty list of ids')
+    if len(ids) > BULK_MAX_IDS:
+        raise ValueError(f'at most {BULK_MAX_IDS} ids per request')
+    try:
+        return list(dict.fromkeys(int(pk) for pk in ids))
+    except (TypeError, ValueError):
+        raise ValueError(f'{key} must be a list of integer ids')
+
+
+def _check_missing(requested, found, label):
+    missing = sorted(set(requested) - set(found))
+    if missing:
+        raise ValueError(f'unknown {label} ids: {missing}')
+
+
+def _insert_returning(model, owner_column, owner_id, target_column, target_ids, time_column):
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f'INSERT INTO {model._meta.db_table} ({owner_column}, {target_column}, {time_column}) '
+            f'SELECT %s, target, %s FROM unnest(%s::bigint[]) AS target '
+            f'ON CONFLICT ({owner_column}, {target_column}) DO NOTHING RETURNING {target_column}',
+            [owner_id, timezone.now(), target_ids],
+        )
+        return [row[0] for row in cursor.fetchall()]
+
+
+def _delete_returning(model, owner_column, owner_id, target_column, target_ids):
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f'DELETE FROM {model._meta.db_table} WHERE {owner_column} = %s AND {target_column} = ANY(%s) '
+            f'RETURNING {target_column}',
+            [owner_id, target_ids],
+        )
+        return [row[0] for row in cursor.fetchall()]
+
+
+def _invalidate_stories(story_ids):
+    if story_ids:
+        # list pages show the like counters too
+        invalidate(*(f'story:{pk}' for pk in story_ids), *(f'story-counts:{pk}' for pk in story_ids), 'stories')
+
+
+def like_stories(user_id, story_ids):
+    """Like every story of `story_ids`, returns the number of new likes."""
+    with transaction.atomic():
+        authors = dict(Story.objects.filter(pk__in=story_ids).values_list('pk', 'author_id'))
+        _check_missing(story_ids, authors, 'story')
+        new = _insert_returning(Like, 'user_id', user_id, 'story_id', story_ids, 'created_at')
+        adjust_counter(Story, new, 'like_count', 1)
+        inbox.notify_many(user_id, 'like', [(authors[pk], pk, None) for pk in new if authors[pk] != user_id])
+        _invalidate_stories(new)
+    return len(new)
+
+
+def unlike_stories(user_id, story_ids):
+    """Remove the user's likes of `story_ids`, returns the number removed."""
+    with transaction.atomic():
+        removed = _delete_returning(Like, 'user_id', user_id, 'story_id', story_ids)
+        adjust_counter(Story, removed, 'like_count', -1)
+        _invalidate_stories(removed)
+    return len(removed)
+
+
+def follow_authors(user_id, author_ids):
+    """Follow every author of `author_ids`, returns the number of new follows."""
+    if user_id in author_ids:
+        raise ValueError('you cannot follow yourself')
+    with transaction.atomic():
+        _check_missing(author_ids, Author.objects.filter(pk__in=author_ids).values_list('pk', flat=True), 'user')
+        new = _insert_returning(Follower, 'follower_id', user_id, 'followed_id', author_ids, 'followed_at')
+        adjust_counter(Author, new, 'follower_count', 1)
+        adjust_counter(Author, user_id, 'following_count', len(new))
+        feed.backfill_timelines(user_id, new)
+        if new:
+            invalidate_authors(user_id, *new)
+    return len(new)
+
+
+def unfollow_authors(user_id, author_ids):
+    """Stop following `author_ids`, returns the number of follows removed."""
+    with transaction.atomic():
+        removed = _delete_returning(Follower, 'follower_id', user_id, 'followed_id', author_ids)
+        adjust_counter(Author, removed, 'follower_count', -1)
+        adjust_counter(Author, user_id, 'following_count', -len(removed))
+        TimelineEntry.objects.filter(user_id=user_id, author_id__in=removed).delete()
+        if removed:
+            invalidate_authors(user_id, *removed)
+    return len(removed)
+
+
+def add_to_library(library_id, story_ids):
+    """Add `story_ids` to the library, returns the number of stories added."""
+    with transaction.atomic():
+        _check_missing(story_ids, Story.objects.filter(pk__in=story_ids).values_list('pk', flat=True), 'story')
+        new = _insert_returning(LibraryStory, 'library_id', library_id, 'story_id', story_ids, 'added_at')
+    return len(new)
+
+
+def remove_from_library(library_id, story_ids):
+    """Remove `story_ids` from the library, returns the number removed."""
+    deleted, _ = LibraryStory.objects.filter(library_id=library_id, story_id__in=story_ids).delete()
+    return deleted
@@ -0,0 +1,125 @@
+"""
+Versioned response cache for public reads.
+
+Each cached resource belongs to a scope (`story:<id>`, `story-counts:<id>`,
+`stories`, `tags`, `author:<id>`) whose version number lives in the cache. Signal handlers in
+api/signals.py bump the version when the underlying rows change, so stale
+entries are never read again and simply expire. The version is also the ETag:
+a conditional GET is answered with 304 from the cache alone, without touching
+the database or the serializers.
+
+The versions are bumped by whichever process made the change (a web process or
+the job worker), so every process must read the same cache. With the per-process
+LocMemCache, the default, the response cache is only used with DEBUG on;
+otherwise it stays off (responses are built on every request) and `manage.py
+check` says so, until CACHE_BACKEND names a shared backend.
+"""
+import hashlib
+import time
+
+from django.conf import settings
+from django.core import checks
+from django.core.cache import cache
+from django.db import transaction
+from django.utils.http import http_date, parse_http_date_safe
+from rest_framework import status
+from rest_framework.response import Response
+
+CACHE_TIMEOUT = getattr(settings, 'API_CACHE_TIMEOUT', 300)
+
+
+def _is_process_local():
+    return settings.CACHES['default']['BACKEND'].endswith('.LocMemCache')
+
+
+ENABLED = settings.DEBUG or not _is_process_local()
+
+
+@checks.register(checks.Tags.caches)
+def check_shared_cache(app_configs, **kwargs):
+    if ENABLED:
+        return []
+    return [checks.Warning(
+        'The API response cache is disabled: the default cache is a per-process LocMemCache.',
+        hint='Set CACHE_BACKEND/CACHE_LOCATION to a cache shared by all processes (e.g. Redis).',
+        id='api.W001',
+    )]
+
+
+def _version_key(scope):
+    return f'api:version:{scope}'
+
+
+def get_version(scope):
+    """
+    Current version of `scope`. A missing (evicted) version restarts from the clock
+    so it never matches an entry cached under an earlier version.
+    """
+    version = cache.get(_version_key(scope))
+    if version is None:
+        version = time.time_ns()
+        cache.add(_version_key(scope), version, None)
+        version = cache.get(_version_key(scope), version)
+    return version
+
+
+def bump_version(*scopes):
+    for scope in scopes:
+        try:
+            cache.incr(_version_key(scope))
+        except ValueError:
+            # not cached, the next read starts a fresh version
+            pass
+
+
+def invalidate(*scopes):
+    # after commit, or a read racing the transaction could cache the old rows under the new version
+    transaction.on_commit(lambda: bump_version(*scopes))
+
+
+def is_cacheable(request):
+    return ENABLED and request.method in ('GET', 'HEAD') and not request.user.is_authenticated
+
+
+def cached_response(request, scope, build):
+    """
+    Serve `build()` (serialized data) through the cache under the current version
+    of `scope`, with ETag/Last-Modified validators and 304 on a conditional GET.
+    """
+    if not ENABLED:
+        return Response(build())
+    version = get_version(scope)
+    path_digest = hashlib.md5(request.build_absolute_uri().encode()).hexdigest()
+    etag = f'"{version}-{path_digest}"'
+
+    if etag in _if_none_match(request):
+        return _not_modified(etag)
+
+    key = f'api:response:{scope}:{version}:{path_digest}'
+    entry = cache.get(key)
+    if entry is None:
+        entry = {'data': build(), 'last_modified': int(time.time())}
+        cache.set(key, entry, CACHE_TIMEOUT)
+    elif 'HTTP_IF_NONE_MATCH' not in request.META:
+        since = parse_http_date_safe(request.META.get('HTTP_IF_MODIFIED_SINCE', ''))
+        if since is not None and since >= entry['last_modified']:
+            return _not_modified(etag, entry['last_modified'])
+
+    response = Response(entry['data'])
+    response['ETag'] = etag
+    response['Last-Modified'] = http_date(entry['last_modified'])
+    response['Cache-Control'] = 'public, no-cache'
+    return response
+
+
+def _if_none_match(request):
+    header = request.META.get('HTTP_IF_NONE_MATCH', '')
+    return {tag.strip().removeprefix('W/') for tag in header.split(',') if tag.strip()}
+
+
+def _not_modified(etag, last_modified=None):
+    response = Response(status=status.HTTP_304_NOT_MODIFIED)
+    response['ETag'] = etag
+    if last_modified is not None:
+        response['Last-Modified'] = http_date(last_modified)
+    return response
@@ -0,0 +1,76 @@
+from django.db import connection
+from django.db.models import Count, F, IntegerField, OuterRef, Subquery
+from django.db.models.functions import Coalesce, Greatest
+
+from .models import Author, Comment, Follower, Like, Notification, Story, StoryTag, Tag
+
+
+def _shifted(field, delta):
+    # never let a drifted counter go negative, recount_counters fixes the drift
+    if delta >= 0:
+        return F(field) + delta
+    return Greatest(F(field) + delta, 0)
+
+
+def adjust_counter(model, pks, field, delta=1):
+    """
+    Atomically add `delta` to a counter column with a single UPDATE, `pks` is a pk
+    or a list of pks.
+    """
+    if not isinstance(pks, (list, tuple, set, frozenset)):
+        pks = [pks]
+    if not pks or not delta:
+        return 0
+    return model.objects.filter(pk__in=pks).update(**{field: _shifted(field, delta)})
+
+
+def adjust_counter_returning(model, pk, field, delta):
+    """`adjust_counter` for one row, returns the new value (None if the row is gone)."""
+    column = model._meta.get_field(field).column
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f'UPDATE {model._meta.db_table} SET {column} = GREATEST({column} + %s, 0) '
+            f'WHERE {model._meta.pk.column} = %s RETURNING {column}',
+            [delta, pk],
+        )
+        row = cursor.fetchone()
+    return row[0] if row else None
+
+
+def _count_of(model, fk_name, **filters):
+    subquery = (
+        model.objects.filter(**{fk_name: OuterRef('pk')}, **filters)
+        .order_by()
+        .values(fk_name)
+        .annotate(total=Count('pk'))
+        .values('total')
+    )
+    return Coalesce(Subquery(subquery, output_field=IntegerField()), 0)
+
+
+def recount_story_counters(queryset=None):
+    """Recompute like/comment counters from the source tables in one UPDATE."""
+    if queryset is None:
+        queryset = Story.objects.all()
+    return queryset.update(
+        like_count=_count_of(Like, 'story'),
+        comment_count=_count_of(Comment, 'story'),
+    )
+
+
+def recount_author_counters(queryset=None):
+    """Recompute follower/following and unread notification counters in one UPDATE."""
+    if queryset is None:
+        queryset = Author.objects.all()
+    return queryset.update(
+        follower_count=_count_of(Follower, 'followed'),
+        following_count=_count_of(Follower, 'follower'),
+        unread_notification_count=_count_of(Notification, 'recipient', is_read=False),
+    )
+
+
+def recount_tag_counters(queryset=None):
+    """Recompute the published story counters of the tags in one UPDATE."""
+    if queryset is None:
+        queryset = Tag.objects.all()
+    return queryset.update(story_count=_count_of(StoryTag, 'tag', story__status='published'))
@@ -0,0 +1,98 @@
+"""
+Home feed with hybrid fan-out.
+
+Stories of authors with at most FEED_FANOUT_THRESHOLD followers are copied into
+each follower's TimelineEntry rows when they are published (fan-out on write,
+see api/jobs.py). Stories of bigger authors are read from Story at request time
+for the handful of them a user follows (fan-out on read). The keyset paginator
+merges both sources, so a feed page costs the same whatever the number of
+followed authors. A story moved back to draft or archived leaves the timelines.
+"""
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import F, Window
+from django.db.models.functions import RowNumber
+
+from .models import Author, Follower, Story, TimelineEntry
+
+FEED_FANOUT_THRESHOLD = getattr(settings, 'FEED_FANOUT_THRESHOLD', 10000)
+FEED_FOLLOW_BACKFILL_SIZE = getattr(settings, 'FEED_FOLLOW_BACKFILL_SIZE', 20)
+_READ_FANOUT_AUTHORS_KEY = 'feed:read-fanout-authors'
+
+
+def read_fanout_author_ids():
+    """Ids of the authors above the fan-out threshold, cached for a minute."""
+    return cache.get_or_set(
+        _READ_FANOUT_AUTHORS_KEY,
+        lambda: list(
+            Author.objects.filter(follower_count__gt=FEED_FANOUT_THRESHOLD).values_list('pk', flat=True)
+        ),
+        60,
+    )
+
+
+def is_read_fanout_author(author_id):
+    return Author.objects.filter(pk=author_id, follower_count__gt=FEED_FANOUT_THRESHOLD).exists()
+
+
+def feed_sources(user_id):
+    """
+    Querysets of `{'published_at', 'story_id'}` rows that make up the user's feed,
+    ready for KeysetPagination.paginate_querysets.
+    """
+    sources = [TimelineEntry.objects.filter(user_id=user_id).values('published_at', 'story_id')]
+    big_authors = read_fanout_author_ids()
+    if big_authors:
+        followed = list(
+            Follower.objects.filter(follower_id=user_id, followed_id__in=big_authors)
+            .values_list('followed_id', flat=True)
+        )
+        if followed:
+            sources.append(
+                Story.objects.filter(author_id__in=followed, status='published')
+                .values('published_at', story_id=F('id'))
+            )
+    return sources
+
+
+def backfill_timeline(user_id, author_id):
+    """Copy the latest stories of a newly followed author into the follower's timeline."""
+    if author_id in read_fanout_author_ids():
+        return
+    stories = (
+        Story.objects.filter(author_id=author_id, status='published')
+        .order_by('-published_at', '-id')
+        .values_list('id', 'published_at')[:FEED_FOLLOW_BACKFILL_SIZE]
+    )
+    TimelineEntry.objects.bulk_create([
+        TimelineEntry(user_id=user_id, story_id=story_id, author_id=author_id, published_at=published_at)
+        for story_id, published_at in stories
+    ], ignore_conflicts=True)
+
+
+def backfill_timelines(user_id, author_ids):
+    """`backfill_timeline` for several newly followed authors, with one query for all their stories."""
+    big_authors = set(read_fanout_author_ids())
+    author_ids = [author_id for author_id in author_ids if author_id not in big_authors]
+    if not author_ids:
+        return
+    stories = (
+        Story.objects.filter(author_id__in=author_ids, status='published')
+        .annotate(position=Window(RowNumber(), partition_by=F('author_id'),
+                                  order_by=[F('published_at').desc(), F('id').desc()]))
+        .filter(position__lte=FEED_FOLLOW_BACKFILL_SIZE)
+        .values_list('id', 'author_id', 'published_at')
+    )
+    TimelineEntry.objects.bulk_create([
+        TimelineEntry(user_id=user_id, story_id=story_id, author_id=author_id, published_at=published_at)
+        for story_id, author_id, published_at in stories
+    ], ignore_conflicts=True)
+
+
+def drop_from_timeline(user_id, author_id):
+    TimelineEntry.objects.filter(user_id=user_id, author_id=author_id).delete()
+
+
+def drop_story(story_id):
+    """Remove a story that is no longer published from every timeline (story FK index)."""
+    TimelineEntry.objects.filter(story_id=story_id).delete()
@@ -0,0 +1,254 @@
+"""
+Responsive derivatives of uploaded images (story covers, profile pictures).
+
+Saving a new image only resets the `<field>_variants` column and queues an
+`image_derivatives` job (api/jobs.py), so the upload request never decodes the
+picture. The job worker renders WebP and JPEG copies at IMAGE_DERIVATIVE_WIDTHS
+in a process pool (one task per width, Pillow work is CPU bound), without EXIF,
+ICC or other metadata, and stores them under the hash of their bytes: the same
+file always has the same name, so it can be cached forever. The serializers
+turn the variants into `srcset` strings.
+
+The copies of a replaced or cleared image are deleted by the same job once no
+row refers to them any more (identical uploads share their copies): a GIN
+index answers the check, and an advisory lock per file name keeps it from
+racing a render that reuses the same file. The pool is
+started with `spawn`, so the workers do not inherit the job worker's database
+connection, and they open local files themselves instead of receiving the bytes.
+"""
+import hashlib
+import io
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
+
+import django
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import connection, transaction
+from django.db.models import Q
+from PIL import ExifTags, Image, ImageOps
+
+from . import jobs
+from .cache import invalidate
+from .models import Author, Story
+from .profiles import invalidate_authors
+
+WIDTHS = tuple(getattr(settings, 'IMAGE_DERIVATIVE_WIDTHS', (320, 640, 1280)))
+FORMATS = ('webp', 'jpeg')
+QUALITY = getattr(settings, 'IMAGE_DERIVATIVE_QUALITY', 80)
+WORKERS = getattr(settings, 'IMAGE_PIPELINE_WORKERS', None)
+
+# job params name the image by (model key, pk, field)
+IMAGE_FIELDS = {
+    'story': (Story, 'cover_image'),
+    'author': (Author, 'profile_image'),
+}
+
+
+def _open(source):
+    # a local path, or the bytes of a file from a remote storage
+    return Image.open(source if isinstance(source, str) else io.BytesIO(source))
+
+
+def render_width(source, width, formats=FORMATS, quality=QUALITY):
+    """
+    Scale the image in `source` (path or bytes) down to `width` (never up) and encode
+    it in every format. Runs in a pool process, returns `[(format, width, bytes)]`.
+    """
+    with _open(source) as original:
+        image = ImageOps.exif_transpose(original)
+        if image.width > width:
+            image = image.resize((width, max(round(image.height * width / image.width), 1)),
+                                 Image.Resampling.LANCZOS)
+        has_alpha = image.mode in ('RGBA', 'LA') or (image.mode == 'P' and 'transparency' in image.info)
+        rendered = []
+        for image_format in formats:
+            frame = image.convert('RGBA' if has_alpha and image_format == 'webp' else 'RGB')
+            # the encoders copy exif/icc_profile from info unless it is empty
+            frame.info = {}
+            output = io.BytesIO()
+            if image_format == 'jpeg':
+                frame.save(output, 'JPEG', quality=quality, optimize=True, progressive=True)
+            else:
+                frame.save(output, 'WEBP', quality=quality, method=4)
+            rendered.append((image_format, image.width, output.getvalue()))
+    return rendered
+
+
+def target_widths(original_width):
+    """The configured widths below the original, or just the original width when it is smaller than all."""
+    widths = [width for width in WIDTHS if width < original_width]
+    return widths or [min(original_width, min(WIDTHS))]
+
+
+@lru_cache(maxsize=None)
+def _pool():
+    # spawned workers set Django up to unpickle render_width, they share no connection or lock
+    return ProcessPoolExecutor(max_workers=WORKERS, mp_context=multiprocessing.get_context('spawn'),
+                               initializer=django.setup)
+
+
+def shutdown_pool():
+    """Stop the render workers, if any were started."""
+    if _pool.cache_info().currsize:
+        _pool().shutdown()
+        _pool.cache_clear()
+
+
+def _derived_name(upload_to, image_format, data):
+    # the name ContentAddressedStorage (api/storage.py) would pick, so a repeat render is not rewritten
+    digest = hashlib.sha256(data).hexdigest()
+    return f'{upload_to}derived/{digest}.{"jpg" if image_format == "jpeg" else image_format}'
+
+
+def _store(name, data):
+    if not default_storage.exists(name):
+        name = default_storage.save(name, ContentFile(data))
+    return name
+
+
+def _lock_names(names):
+    """
+    Transaction-level advisory locks on derivative file names, taken in one order.
+    Storing a file and recording it in a row, and checking a file is unused and
+    deleting it, hold the lock of the name, so a delete never removes a file that
+    a concurrent render of the same bytes has just reused.
+    """
+    with connection.cursor() as cursor:
+        cursor.execute(
+            'SELECT pg_advisory_xact_lock(key) FROM '
+            '(SELECT DISTINCT hashtextextended(name, 0) AS key FROM unnest(%s::text[]) AS name ORDER BY key) AS keys',
+            [list(names)],
+        )
+
+
+def _invalidate(model_key, pk):
+    if model_key == 'story':
+        invalidate(f'story:{pk}', 'stories')
+    else:
+        # author cards are embedded in the story lists
+        invalidate('stories')
+        invalidate_authors(pk)
+
+
+def _model_key(instance, field_name):
+    return next(key for key, (model, name) in IMAGE_FIELDS.items()
+                if isinstance(instance, model) and name == field_name)
+
+
+def queue_derivatives(instance, field_name):
+    """
+    Forget the variants of the previous image and queue the new one (if any) for
+    rendering, and the previous copies for deletion.
+    """
+    model_key = _model_key(instance, field_name)
+    rows = type(instance).objects.filter(pk=instance.pk)
+    # read from the row, the job may have written them after this instance was loaded
+    previous = rows.values_list(f'{field_name}_variants', flat=True).first() or []
+    rows.update(**{f'{field_name}_variants': []})
+    setattr(instance, f'{field_name}_variants', [])
+    image_name = getattr(instance, field_name).name or ''
+    discard = [variant['name'] for variant in previous]
+    if image_name or discard:
+        jobs.enqueue_image_derivatives(model_key, instance.pk, field_name, image_name, discard)
+    _invalidate(model_key, instance.pk)
+
+
+def queue_discard(instance, field_name):
+    """Queue the deletion of the copies of a deleted row's image."""
+    variants = instance.__dict__.get(f'{field_name}_variants') or []
+    if variants:
+        jobs.enqueue_image_derivatives(_model_key(instance, field_name), instance.pk, field_name, '',
+                                       [variant['name'] for variant in variants])
+
+
+def referencing_rows(model, field_name, names):
+    """Rows of `model` whose variants use one of the files `names`, on the GIN index of the column."""
+    column = f'{field_name}_variants'
+    condition = Q()
+    for name in names:
+        condition |= Q(**{f'{column}__contains': [{'name': name}]})
+    return model.objects.filter(condition)
+
+
+def discard_unreferenced(model, field_name, names):
+    """Delete the derivative files among `names` that no row of `model` refers to any more."""
+    if not names:
+        return 0
+    column = f'{field_name}_variants'
+    with transaction.atomic():
+        _lock_names(names)
+        referenced = {
+            variant['name']
+            for variants in referencing_rows(model, field_name, names).values_list(column, flat=True)
+            for variant in variants
+        }
+        unreferenced = set(names) - referenced
+        for name in unreferenced:
+            default_storage.delete(name)
+    return len(unreferenced)
+
+
+def build_derivatives(params):
+    """
+    Render and store the derivatives of the image named in the job `params`, then
+    delete the copies of the previous image (`discard`) nobody uses any more.
+    Returns the number of files, 0 when the image was replaced meanwhile.
+    """
+    model, field_name = IMAGE_FIELDS[params['model']]
+    rendered = _render(model, field_name, params['pk'], params['name']) if params['name'] else []
+    discard_unreferenced(model, field_name, params.get('discard', []))
+    if rendered:
+        _invalidate(params['model'], params['pk'])
+    return len(rendered)
+
+
+def _render(model, field_name, pk, image_name):
+    field = model._meta.get_field(field_name)
+    if not model.objects.filter(pk=pk, **{field_name: image_name}).exists():
+        return []
+
+    try:
+        # the pool workers read a local file themselves, only remote files are sent as bytes
+        source = default_storage.path(image_name)
+    except NotImplementedError:
+        with default_storage.open(image_name, 'rb') as original:
+            source = original.read()
+    with _open(source) as probe:
+        # header only, no decode; rotated photos are displayed with their height as width
+        original_width, original_height = probe.size
+        if probe.getexif().get(ExifTags.Base.Orientation) in (5, 6, 7, 8):
+            original_width = original_height
+
+    futures = [_pool().submit(render_width, source, width) for width in target_widths(original_width)]
+    outputs = [
+        (_derived_name(field.upload_to, image_format, output), image_format, width, output)
+        for future in futures
+        for image_format, width, output in future.result()
+    ]
+    with transaction.atomic():
+        # held until the row refers to the files, see _lock_names()
+        _lock_names(name for name, *_ in outputs)
+        variants = [
+            {'name': _store(name, output), 'width': width, 'format': image_format}
+            for name, image_format, width, output in outputs
+        ]
+        # guarded on the name: a newer upload keeps its own (pending) variants
+        if not model.objects.filter(pk=pk, **{field_name: image_name}).update(
+            **{f'{field_name}_variants': variants}
+        ):
+            discard_unreferenced(model, field_name, [variant['name'] for variant in variants])
+            return []
+    return variants
+
+
+def srcset(variants, image_format, url=None):
+    """`srcset` attribute of one format: 'url 320w, url 640w'."""
+    url = url or default_storage.url
+    return ', '.join(
+        f"{url(variant['name'])} {variant['width']}w"
+        for variant in sorted(variants, key=lambda variant: variant['width'])
+        if variant['format'] == image_format
+    )
@@ -0,0 +1,328 @@
+"""
+Notification inbox upkeep.
+
+`Author.unread_notification_count` is the unread badge: the signal handlers in
+api/signals.py move it by one for single rows and the bulk paths below (and the
+fan-out in api/jobs.py) move it by the number of rows they touched, in the same
+transaction. Marking read works in id-ordered batches: a request marks the first
+batch itself and leaves the rest of a large inbox to a `mark_read` NotificationJob.
+Old read notifications are collapsed into one row per (recipient, type, story)
+carrying the number of actors, and expired rows are deleted in batches; both
+are single set-based statements that send no signals.
+
+Likes and comments are coalesced as they happen: within a time bucket of
+NOTIFICATION_COALESCE_WINDOW seconds an upsert bumps the single unread row of
+(recipient, story, type) instead of inserting one row per event. `actor_count`
+counts distinct people: the actors of a coalesced or collapsed row are kept in
+NotificationActor and the count only moves when one joins the set.
+"""
+from collections import Counter
+from datetime import datetime, timezone as dt_timezone
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import Q
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from . import jobs
+from .broker import notification_event, publish_after_commit
+from .counters import adjust_counter
+from .models import Author, Notification, NotificationActor
+
+MARK_READ_BATCH_SIZE = getattr(settings, 'NOTIFICATION_MARK_READ_BATCH_SIZE', 1000)
+COMPACT_AFTER_DAYS = getattr(settings, 'NOTIFICATION_COMPACT_AFTER_DAYS', 30)
+RETENTION_DAYS = getattr(settings, 'NOTIFICATION_RETENTION_DAYS', 365)
+COALESCE_WINDOW = getattr(settings, 'NOTIFICATION_COALESCE_WINDOW', 0)
+COALESCE_TYPES = ('like', 'comment')
+RECENT_ACTORS = 3
+
+# the conflict target and predicate match the notif_coalesce_bucket_uniq constraint;
+# only unread rows collect events, so the badge moves exactly when a row is inserted.
+# The sender joins the row's actor set in the same statement, `new_actor` tells
+# whether they weren't in it yet (a new row counts its sender already)
+_COALESCE_SQL = f'''
+    WITH upserted AS (
+        INSERT INTO {Notification._meta.db_table}
+            (recipient_id, sender_id, notif_type, story_id, comment_id, created_at,
+             is_read, actor_count, bucket, recent_actor_ids)
+        VALUES {{values}}
+        ON CONFLICT (recipient_id, story_id, notif_type, bucket) WHERE bucket IS NOT NULL AND NOT is_read
+        DO UPDATE SET
+            sender_id = EXCLUDED.sender_id,
+            comment_id = EXCLUDED.comment_id,
+            created_at = EXCLUDED.created_at,
+            recent_actor_ids = (
+                EXCLUDED.sender_id || array_remove({Notification._meta.db_table}.recent_actor_ids, EXCLUDED.sender_id)
+            )[1:{RECENT_ACTORS}]
+        RETURNING id, (xmax = 0) AS inserted, actor_count, recipient_id, story_id, comment_id
+    ), joined AS (
+        INSERT INTO {NotificationActor._meta.db_table} (notification_id, actor_id)
+        SELECT id, %s FROM upserted
+        ON CONFLICT DO NOTHING
+        RETURNING notification_id
+    )
+    SELECT upserted.*, joined.notification_id IS NOT NULL AND NOT inserted AS new_actor
+    FROM upserted LEFT JOIN joined ON joined.notification_id = upserted.id
+'''
+_COALESCE_ROW = '(%s, %s, %s, %s, %s, %s, false, 1, %s, ARRAY[%s]::bigint[])'
+
+
+def _bucket(moment):
+    seconds = int(moment.timestamp())
+    return datetime.fromtimestamp(seconds - seconds % COALESCE_WINDOW, tz=dt_timezone.utc)
+
+
+def _count_new_actors(cursor, notification_ids):
+    # the upsert can't modify its row twice, so the count moves in a second statement
+    if not notification_ids:
+        return {}
+    cursor.execute(
+        f'UPDATE {Notification._meta.db_table} SET actor_count = actor_count + 1 '
+        f'WHERE id = ANY(%s) RETURNING id, actor_count',
+        [notification_ids],
+    )
+    return dict(cursor.fetchall())
+
+
+def _bump_unread(recipient_ids):
+    # one UPDATE per distinct increment rather than per recipient
+    by_delta = {}
+    for recipient_id, delta in Counter(recipient_ids).items():
+        by_delta.setdefault(delta, []).append(recipient_id)
+    for delta, recipients in by_delta.items():
+        adjust_counter(Author, recipients, 'unread_notification_count', delta)
+
+
+def notify(recipient_id, sender_id, notif_type, story_id, comment_id=None):
+    """
+    Record a like/comment notification, coalesced into the unread row of the current
+    time bucket when NOTIFICATION_COALESCE_WINDOW is set. Returns the notification id.
+    """
+    return notify_many(sender_id, notif_type, [(recipient_id, story_id, comment_id)])[0]
+
+
+def notify_many(sender_id, notif_type, targets):
+    """
+    Record one notification per `(recipient_id, story_id, comment_id)` of `targets`
+    with a single statement: a multi-row upsert when coalescing, else bulk_create.
+    Keeps the unread badges and feeds the stream (no signals are sent). Returns the ids.
+    """
+    # one row per key, an upsert can't touch the same row twice
+    targets = list(dict.fromkeys(targets))
+    if not targets:
+        return []
+    now = timezone.now()
+    with transaction.atomic():
+        if COALESCE_WINDOW and notif_type in COALESCE_TYPES:
+            bucket = _bucket(now)
+            params = []
+            for recipient_id, story_id, comment_id in targets:
+                params += [recipient_id, sender_id, notif_type, story_id, comment_id, now, bucket, sender_id]
+            with connection.cursor() as cursor:
+                cursor.execute(_COALESCE_SQL.format(values=', '.join([_COALESCE_ROW] * len(targets))),
+                               [*params, sender_id])
+                rows = cursor.fetchall()
+                actor_counts = _count_new_actors(
+                    cursor, [notification_id for notification_id, *_, new_actor in rows if new_actor],
+                )
+            inserted_for = [recipient_id for _, inserted, _, recipient_id, _, _, _ in rows if inserted]
+            notifications = [
+                (notification_id, recipient_id, story_id, comment_id,
+                 actor_counts.get(notification_id, actor_count))
+                for notification_id, _, actor_count, recipient_id, story_id, comment_id, _ in rows
+            ]
+        else:
+            created = Notification.objects.bulk_create([
+                Notification(recipient_id=recipient_id, sender_id=sender_id, notif_type=notif_type,
+                             story_id=story_id, comment_id=comment_id)
+                for recipient_id, story_id, comment_id in targets
+            ])
+            inserted_for = [notification.recipient_id for notification in created]
+            notifications = [
+                (notification.pk, notification.recipient_id, notification.story_id, notification.comment_id, 1)
+                for notification in created
+            ]
+        _bump_unread(inserted_for)
+        publish_after_commit(
+            (recipient_id, notification_event(
+                notification_id, notif_type, sender_id, story_id, comment_id, now, actor_count,
+            ))
+            for notification_id, recipient_id, story_id, comment_id, actor_count in notifications
+        )
+    return [notification[0] for notification in notifications]
+
+
+def parse_selection(data):
+    """
+    Validate a mark-read selection: `ids` (list of ids), `ranges` (list of
+    `[first_id, last_id]`), `up_to` (ISO timestamp, inclusive) and `type`. Ids and
+    ranges add up, `up_to` and `type` narrow the result, nothing at all selects
+    every notification.
+    Returns JSON-serializable params, raises ValueError on bad input.
+    """
+    params = {}
+    ids = data.get('ids')
+    if ids is not None:
+        if not isinstance(ids, list):
+            raise ValueError('ids must be a list of notification ids')
+        params['ids'] = [int(pk) for pk in ids]
+    ranges = data.get('ranges')
+    if ranges is not None:
+        if not isinstance(ranges, list) or not all(isinstance(r, list) and len(r) == 2 for r in ranges):
+            raise ValueError('ranges must be a list of [first_id, last_id] pairs')
+        params['ranges'] = [[int(first), int(last)] for first, last in ranges]
+    up_to = data.get('up_to')
+    if up_to is not None:
+        if parse_datetime(str(up_to)) is None:
+            raise ValueError('up_to must be an ISO 8601 timestamp')
+        params['up_to'] = str(up_to)
+    notif_type = data.get('type')
+    if notif_type:
+        params['type'] = str(notif_type)
+    return params
+
+
+def _selection_filter(params):
+    selection = Q()
+    if 'ids' in params or 'ranges' in params:
+        by_id = Q(pk__in=params.get('ids', []))
+        for first, last in params.get('ranges', []):
+            by_id |= Q(pk__range=(first, last))
+        selection &= by_id
+    if 'up_to' in params:
+        selection &= Q(created_at__lte=parse_datetime(params['up_to']))
+    if 'type' in params:
+        selection &= Q(notif_type=params['type'])
+    return selection
+
+
+def mark_read_batch(user_id, params, after_id=0, batch_size=None):
+    """
+    Mark the next batch of selected unread notifications (ids above `after_id`) as
+    read. Returns `(updated, last_id)`, `last_id` is None once nothing is left.
+    """
+    batch_size = batch_size or MARK_READ_BATCH_SIZE
+    with transaction.atomic():
+        ids = list(
+            Notification.objects.filter(_selection_filter(params), recipient_id=user_id,
+                                        is_read=False, pk__gt=after_id)
+            .order_by('pk')
+            .values_list('pk', flat=True)[:batch_size]
+        )
+        if not ids:
+            return 0, None
+        updated = Notification.objects.filter(pk__in=ids, is_read=False).update(is_read=True)
+        adjust_counter(Author, user_id, 'unread_notification_count', -updated)
+    return updated, ids[-1]
+
+
+def mark_read(user_id, params, batch_size=None):
+    """
+    Mark the selection read: the first batch right away, the rest (if any) by a
+    background job. Returns `(updated, job)`, `job` is None when all is done.
+    """
+    batch_size = batch_size or MARK_READ_BATCH_SIZE
+    updated, last_id = mark_read_batch(user_id, params, batch_size=batch_size)
+    if last_id is None or updated < batch_size:
+        return updated, None
+    return updated, jobs.enqueue_mark_read(user_id, params, cursor=last_id)
+
+
+def set_read(notification, is_read):
+    """
+    Set the read flag of one notification with a conditional UPDATE: the badge moves
+    only when this call changed the row, so concurrent requests move it once.
+    """
+    changed = Notification.objects.filter(pk=notification.pk, is_read=not is_read).update(is_read=is_read)
+    if changed:
+        adjust_counter(Author, notification.recipient_id, 'unread_notification_count', -1 if is_read else 1)
+    notification.is_read = is_read
+    getattr(notification, '_loaded_values', {})['is_read'] = is_read
+    return changed
+
+
+def unread_count(user_id):
+    return Author.objects.filter(pk=user_id).values_list('unread_notification_count', flat=True).first() or 0
+
+
+_NOTIFICATIONS = Notification._meta.db_table
+
+_ACTORS = NotificationActor._meta.db_table
+
+# one statement per range of recipients: group the old read rows, give the newest
+# row of each group the union of the group's actors (their NotificationActor rows
+# and senders) and delete the others with their actor rows. No signals, the rows
+# are read so no badge moves
+_COMPACT_SQL = f'''
+    WITH members AS (
+        SELECT id, sender_id,
+            max(id) OVER (PARTITION BY recipient_id, notif_type, story_id) AS keep_id,
+            count(*) OVER (PARTITION BY recipient_id, notif_type, story_id) AS size
+        FROM {_NOTIFICATIONS}
+        WHERE recipient_id BETWEEN %(first)s AND %(last)s AND is_read AND created_at < %(cutoff)s
+    ), merged AS (
+        SELECT id, sender_id, keep_id FROM members WHERE size > 1
+    ), actor_sets AS (
+        SELECT merged.keep_id, {_ACTORS}.actor_id
+        FROM merged JOIN {_ACTORS} ON {_ACTORS}.notification_id = merged.id
+        UNION
+        SELECT keep_id, sender_id FROM merged
+    ), joined AS (
+        INSERT INTO {_ACTORS} (notification_id, actor_id)
+        SELECT keep_id, actor_id FROM actor_sets
+        ON CONFLICT DO NOTHING
+    ), kept AS (
+        UPDATE {_NOTIFICATIONS} SET actor_count = totals.actors
+        FROM (SELECT keep_id, count(*) AS actors FROM actor_sets GROUP BY keep_id) totals
+        WHERE {_NOTIFICATIONS}.id = totals.keep_id
+    ), dropped_actors AS (
+        DELETE FROM {_ACTORS} USING merged
+        WHERE {_ACTORS}.notification_id = merged.id AND merged.id <> merged.keep_id
+    )
+    DELETE FROM {_NOTIFICATIONS} USING merged
+    WHERE {_NOTIFICATIONS}.id = merged.id AND merged.id <> merged.keep_id AND {_NOTIFICATIONS}.is_read
+'''
+
+# one batch of expired rows deleted and the badges of their unread ones moved in one statement
+_DELETE_EXPIRED_SQL = f'''
+    WITH doomed AS (
+        SELECT id FROM {_NOTIFICATIONS} WHERE created_at < %(cutoff)s ORDER BY id LIMIT %(limit)s
+    ), doomed_actors AS (
+        DELETE FROM {_ACTORS} USING doomed WHERE {_ACTORS}.notification_id = doomed.id
+    ), deleted AS (
+        DELETE FROM {_NOTIFICATIONS} USING doomed WHERE {_NOTIFICATIONS}.id = doomed.id
+        RETURNING {_NOTIFICATIONS}.recipient_id, {_NOTIFICATIONS}.is_read
+    ), unread AS (
+        SELECT recipient_id, count(*) AS total FROM deleted WHERE NOT is_read GROUP BY recipient_id
+    ), badges AS (
+        UPDATE {Author._meta.db_table}
+        SET unread_notification_count = GREATEST(unread_notification_count - unread.total, 0)
+        FROM unread WHERE {Author._meta.db_table}.id = unread.recipient_id
+    )
+    SELECT count(*) FROM deleted
+'''
+
+
+def compact_read_notifications(first_recipient_id, last_recipient_id, cutoff):
+    """
+    Collapse the read notifications older than `cutoff` of a range of recipients
+    into the newest row of each (recipient, type, story), whose `actor_count`
+    becomes the number of distinct people behind them. Returns the number of rows removed.
+    """
+    with connection.cursor() as cursor:
+        cursor.execute(_COMPACT_SQL, {'first': first_recipient_id, 'last': last_recipient_id, 'cutoff': cutoff})
+        return cursor.rowcount
+
+
+def delete_expired(cutoff, batch_size=None):
+    """Delete notifications created before `cutoff` in id-ordered batches, returns the count."""
+    batch_size = batch_size or MARK_READ_BATCH_SIZE
+    total = 0
+    while True:
+        with connection.cursor() as cursor:
+            cursor.execute(_DELETE_EXPIRED_SQL, {'cutoff': cutoff, 'limit': batch_size})
+            deleted = cursor.fetchone()[0]
+        if not deleted:
+            return total
+        total += deleted
@@ -0,0 +1,176 @@
+"""
+Outbox for notification fan-out.
+
+Publishing a story only inserts NotificationJob rows (in the same transaction as
+the story save), one for the notifications and one for the follower timelines. `manage.py process_notification_jobs` claims pending jobs and
+fans out in chunks: every chunk inserts its notifications and advances the job
+cursor in one transaction, so a crashed or retried job resumes right after the
+last follower it notified and nobody gets the notification twice. The same
+queue marks large inboxes read in batches (`mark_read` jobs, see api/inbox.py)
+and renders the resized copies of uploaded images (`image_derivatives`, see api/images.py).
+"""
+import logging
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from . import feed, images, inbox
+from .models import Author, Follower, NotificationJob, TimelineEntry
+
+logger = logging.getLogger(__name__)
+
+FANOUT_BATCH_SIZE = getattr(settings, 'NOTIFICATION_FANOUT_BATCH_SIZE', 1000)
+JOB_LEASE = timedelta(seconds=getattr(settings, 'NOTIFICATION_JOB_LEASE_SECONDS', 300))
+JOB_MAX_ATTEMPTS = getattr(settings, 'NOTIFICATION_JOB_MAX_ATTEMPTS', 5)
+
+
+def enqueue_story_publish(story):
+    return NotificationJob.objects.create(job_type='story_publish', story=story)
+
+
+def enqueue_timeline_fanout(story):
+    return NotificationJob.objects.create(job_type='timeline_fanout', story=story)
+
+
+def enqueue_mark_read(user_id, params, cursor=0):
+    return NotificationJob.objects.create(job_type='mark_read', user_id=user_id, params=params, cursor=cursor)
+
+
+def enqueue_image_derivatives(model_key, pk, field_name, image_name, discard=()):
+    params = {'model': model_key, 'pk': pk, 'field': field_name, 'name': image_name}
+    if discard:
+        # derivative files of the previous image, deleted once unreferenced
+        params['discard'] = list(discard)
+    return NotificationJob.objects.create(job_type='image_derivatives', params=params)
+
+
+def claim_jobs(limit=10):
+    """
+    Lease up to `limit` runnable jobs. Running jobs whose lease expired (the worker
+    died) are runnable again, SKIP LOCKED keeps concurrent workers apart.
+    """
+    now = timezone.now()
+    with transaction.atomic():
+        jobs = list(
+            NotificationJob.objects.select_for_update(skip_locked=True)
+            .filter(status__in=['pending', 'running'], available_at__lte=now)
+            .order_by('available_at', 'id')[:limit]
+        )
+        for job in jobs:
+            job.status = 'running'
+            job.attempts += 1
+            job.available_at = now + JOB_LEASE
+            job.save(update_fields=['status', 'attempts', 'available_at', 'updated_at'])
+    return jobs
+
+
+def run_job(job, batch_size=None):
+    batch_size = batch_size or FANOUT_BATCH_SIZE
+    handler = JOB_HANDLERS[job.job_type]
+    try:
+        return handler(job, batch_size)
+    except Exception as exc:
+        logger.exception('notification job %s failed', job.pk)
+        job.last_error = repr(exc)
+        if job.attempts >= JOB_MAX_ATTEMPTS:
+            job.status = 'failed'
+        else:
+            # exponential backoff, the cursor keeps the work already done
+            job.status = 'pending'
+            job.available_at = timezone.now() + timedelta(seconds=2 ** job.attempts)
+        job.save(update_fields=['status', 'available_at', 'last_error', 'updated_at'])
+    return job
+
+
+def _walk_followers(job, author_id, batch_size, insert_batch):
+    """
+    Call `insert_batch(follower_ids)` for the author's followers in follower_id order,
+    each batch in the same transaction as the job cursor update.
+    """
+    if job.cursor == 0:
+        job.total = Author.objects.filter(pk=author_id).values_list('follower_count', flat=True).first() or 0
+        job.save(update_fields=['total', 'updated_at'])
+
+    while True:
+        with transaction.atomic():
+            job = NotificationJob.objects.select_for_update().get(pk=job.pk)
+            follower_ids = list(
+                Follower.objects.filter(followed_id=author_id, follower_id__gt=job.cursor)
+                .order_by('follower_id')
+                .values_list('follower_id', flat=True)[:batch_size]
+            )
+            if not follower_ids:
+                job.status = 'done'
+                job.total = max(job.total, job.processed)
+                job.save(update_fields=['status', 'total', 'updated_at'])
+                return job
+            insert_batch(follower_ids)
+            job.cursor = follower_ids[-1]
+            job.processed += len(follower_ids)
+            job.available_at = timezone.now() + JOB_LEASE
+            job.save(update_fields=['cursor', 'processed', 'available_at', 'updated_at'])
+
+
+def _fan_out_story_publish(job, batch_size):
+    story = job.story
+
+    def insert_batch(follower_ids):
+        inbox.notify_many(story.author_id, 'story', [(follower_id, story.pk, None) for follower_id in follower_ids])
+
+    return _walk_followers(job, story.author_id, batch_size, insert_batch)
+
+
+def _fan_out_timeline(job, batch_size):
+    story = job.story
+    if story.status != 'published' or feed.is_read_fanout_author(story.author_id):
+        # high-follower authors are merged into the feed at read time instead
+        job.status = 'done'
+        job.save(update_fields=['status', 'updated_at'])
+        return job
+
+    def insert_batch(follower_ids):
+        TimelineEntry.objects.bulk_create([
+            TimelineEntry(user_id=follower_id, story_id=story.pk, author_id=story.author_id,
+                          published_at=story.published_at or story.created_at)
+            for follower_id in follower_ids
+        ], ignore_conflicts=True)
+
+    return _walk_followers(job, story.author_id, batch_size, insert_batch)
+
+
+def _mark_read(job, batch_size):
+    if not job.total:
+        job.total = inbox.unread_count(job.user_id)
+        job.save(update_fields=['total', 'updated_at'])
+
+    while True:
+        with transaction.atomic():
+            job = NotificationJob.objects.select_for_update().get(pk=job.pk)
+            updated, last_id = inbox.mark_read_batch(job.user_id, job.params, after_id=job.cursor,
+                                                     batch_size=batch_size)
+            if last_id is None:
+                job.status = 'done'
+                job.total = max(job.total, job.processed)
+                job.save(update_fields=['status', 'total', 'updated_at'])
+                return job
+            job.cursor = last_id
+            job.processed += updated
+            job.available_at = timezone.now() + JOB_LEASE
+            job.save(update_fields=['cursor', 'processed', 'available_at', 'updated_at'])
+
+
+def _render_image_derivatives(job, batch_size):
+    job.total = job.processed = images.build_derivatives(job.params)
+    job.status = 'done'
+    job.save(update_fields=['status', 'total', 'processed', 'updated_at'])
+    return job
+
+
+JOB_HANDLERS = {
+    'story_publish': _fan_out_story_publish,
+    'timeline_fanout': _fan_out_timeline,
+    'mark_read': _mark_read,
+    'image_derivatives': _render_image_derivatives,
+}
@@ -0,0 +1,37 @@
+from django.core.management.base import BaseCommand
+
+from api.models import Story
+from api.text import reading_stats
+
+
+class Command(BaseCommand):
+    help = "Compute the stored read time, word count and excerpt of existing stories."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500,
+                            help='Number of stories loaded and updated per batch.')
+        parser.add_argument('--only-missing', action='store_true',
+                            help='Skip stories that already have an excerpt.')
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        stories = Story.objects.all()
+        if options['only_missing']:
+            stories = stories.filter(excerpt='')
+
+        # walk the table in pk ranges, one bulk UPDATE per batch
+        total = 0
+        last_pk = 0
+        while True:
+            batch = list(
+                stories.filter(pk__gt=last_pk).order_by('pk').only('id', 'content')[:batch_size]
+            )
+            if not batch:
+                break
+            for story in batch:
+                story.word_count, story.read_time, story.excerpt = reading_stats(story.content)
+            Story.objects.bulk_update(batch, ['word_count', 'read_time', 'excerpt'])
+            total += len(batch)
+            last_pk = batch[-1].pk
+
+        self.stdout.write(self.style.SUCCESS(f'Updated reading stats of {total} stories.'))
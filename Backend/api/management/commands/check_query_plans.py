@@ -0,0 +1,277 @@
+import json
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.db.models.functions import Lower
+from django.utils import timezone
+
+from api.feed import feed_sources
+from api.images import referencing_rows
+from api.models import (
+    Author, Comment, Follower, Library, LibraryStory, Like, Notification, Story, StoryTag, Tag, TimelineEntry,
+)
+from api.pagination import KeysetPagination
+from api.profiles import LATEST_STORIES
+from api.serializer import StorySummarySerializer
+from api.views import (
+    CommentViewSet, FeedViewSet, FollowerViewSet, LibraryStoryViewset, NotificationViewSet,
+    StoryViewSet, TagViewSet,
+)
+
+PAGE_SIZE = 20
+
+# Nodes a hot query may have on top of its index, see plan_problems().
+NONE = frozenset()
+SORT = frozenset({'Sort'})
+FILTER = frozenset({'Filter'})
+
+
+class _Request:
+    def __init__(self, user, params=None):
+        self.user = user
+        self.query_params = params or {}
+
+
+def _page(queryset, view=None, cursor_values=None):
+    """First (or next, given the cursor values) page of `queryset` as the keyset paginator builds it."""
+    paginator = KeysetPagination()
+    ordering = paginator.get_ordering(None, queryset, view)
+    queryset = queryset.order_by(*ordering)
+    if cursor_values is not None:
+        queryset = queryset.filter(paginator.keyset_filter(ordering, cursor_values))
+    return queryset[:PAGE_SIZE + 1]
+
+
+def _viewset_queryset(viewset_class, action, user, params=None):
+    view = viewset_class()
+    view.action = action
+    view.request = _Request(user, params)
+    view.kwargs = {}
+    view.format_kwarg = None
+    return view, view.get_queryset()
+
+
+def _index_on(model, *columns):
+    """Name of the index on `columns`, for the ones Django names with a hash (FK and unique indexes)."""
+    with connection.cursor() as cursor:
+        constraints = connection.introspection.get_constraints(cursor, model._meta.db_table)
+    return next(name for name, info in constraints.items()
+                if (info['index'] or info['unique']) and info['columns'] == list(columns))
+
+
+def hot_queries(user, story, library, tag):
+    """
+    (label, queryset, expected index, allowed nodes) of the list queries behind the
+    API endpoints, as they reach the database. A sort is only allowed where the order
+    comes from another table or column than the one the index selects on, and is
+    bounded by the rows of one tag, one prefix or one page of threads. The prefix
+    LIKE of the autocomplete is always rechecked on the rows of its range scan.
+    """
+    now = timezone.now()
+    queries = []
+
+    view, queryset = _viewset_queryset(StoryViewSet, 'list', user)
+    queries.append(('stories: list', _page(queryset, view), 'story_created_id_idx', NONE))
+    queries.append(('stories: list, next page', _page(queryset, view, [now, story.pk]), 'story_created_id_idx', NONE))
+    queries.append(('stories: published', _page(Story.objects.filter(status='published')),
+                    'story_status_created_idx', NONE))
+    queries.append(('stories: author published', _page(Story.objects.filter(author=user, status='published')),
+                    'story_author_status_idx', NONE))
+    queries.append(('authors: latest stories', Story.objects.filter(author=user, status='published')
+                    .order_by('-published_at', '-id')[:LATEST_STORIES], 'story_author_published_idx', NONE))
+
+    view = TagViewSet()
+    queries.append(('tags: list', _page(Tag.objects.all(), view), _index_on(Tag, 'name'), NONE))
+    queries.append(('tags: stories', _page(Story.objects.filter(tags=tag, status='published')),
+                    'storytag_tag_story_idx', SORT))
+    queries.append(('tags: autocomplete', Tag.objects.annotate(name_lower=Lower('name'))
+                    .filter(name_lower__startswith=tag.name[:2].lower()).order_by('-story_count', 'name')[:10],
+                    'tag_name_prefix_idx', SORT | FILTER))
+
+    view = CommentViewSet()
+    queries.append(('comments: by story', _page(Comment.objects.filter(story_id=story.pk), view),
+                    'comment_story_created_idx', NONE))
+    queries.append(('comments: thread roots',
+                    _page(Comment.objects.filter(story_id=story.pk, parent__isnull=True), view),
+                    'comment_story_toplevel_idx', NONE))
+    queries.append(('comments: thread replies',
+                    Comment.objects.filter(root_id__in=[1, 2, 3]).order_by('created_at', 'id'),
+                    _index_on(Comment, 'root_id'), SORT))
+
+    queries.append(('likes: by story', _page(Like.objects.filter(story_id=story.pk)),
+                    'like_story_created_idx', NONE))
+
+    view = FollowerViewSet()
+    queries.append(('follower: followers', _page(Follower.objects.filter(followed_id=user.pk), view),
+                    'follower_followed_at_idx', NONE))
+    queries.append(('follower: followings', _page(Follower.objects.filter(follower_id=user.pk), view),
+                    'follower_follower_at_idx', NONE))
+
+    queries.append(('library: by user', _page(Library.objects.filter(user=user)), 'library_user_created_idx', NONE))
+    view = LibraryStoryViewset()
+    queries.append(('library: stories', _page(
+        StorySummarySerializer.setup_queryset(LibraryStory.objects.filter(library=library), prefix='story__'),
+        view,
+    ), 'librarystory_added_idx', NONE))
+
+    view = FeedViewSet()
+    feed_indexes = {'TimelineEntry': 'timeline_user_published_idx', 'Story': 'story_author_published_idx'}
+    for source in feed_sources(user.pk):
+        name = source.model.__name__
+        queries.append((f'feed: {name}', _page(source, view), feed_indexes[name], NONE))
+
+    names = ['covers/derived/a.webp', 'covers/derived/b.jpg']
+    queries.append(('images: covers using a derivative', referencing_rows(Story, 'cover_image', names),
+                    'story_cover_variants_idx', NONE))
+    queries.append(('images: profiles using a derivative', referencing_rows(Author, 'profile_image', names),
+                    'author_image_variants_idx', NONE))
+
+    for label, params, index in [
+        ('all', {}, 'notif_recipient_created_idx'),
+        ('unread', {'is_read': 'false'}, 'notif_recipient_unread_idx'),
+        ('read', {'is_read': 'true'}, 'notif_recipient_read_idx'),
+    ]:
+        view, queryset = _viewset_queryset(NotificationViewSet, 'list', user, params)
+        queries.append((f'notifications: {label}', _page(queryset, view), index, NONE))
+    return queries
+
+
+def _find_scan(node, index, ancestors=()):
+    """The scan node on `index` and the nodes above it, None if the index is not used."""
+    if node.get('Index Name') == index:
+        return node, ancestors
+    for child in node.get('Plans', []):
+        found = _find_scan(child, index, (*ancestors, node))
+        if found:
+            return found
+    return None
+
+
+def plan_problems(plan, index, allowed=NONE):
+    """
+    What is wrong with the JSON `plan` of a query that should be served by `index`
+    alone: the index is not used, or rows read through it are filtered or sorted
+    again, unless `allowed` says so.
+    """
+    found = _find_scan(plan['Plan'], index)
+    if found is None:
+        return [f'{index} is not used']
+    scan, ancestors = found
+    problems = []
+    if 'Filter' in scan and 'Filter' not in allowed:
+        problems.append(f'rows read through {index} are filtered: {scan["Filter"]}')
+    for node in ancestors:
+        if 'Filter' in node and 'Filter' not in allowed:
+            problems.append(f'{node["Node Type"]} above {index} filters: {node["Filter"]}')
+        if 'Sort' in node['Node Type'] and 'Sort' not in allowed:
+            problems.append(f'{node["Node Type"]} above {index}: the index does not give the order')
+    return problems
+
+
+def seed(count):
+    """
+    Insert `count` sample rows per table and ANALYZE, call it inside the rolled back
+    transaction. One story in four is published, as on a site where drafts pile up,
+    so listing the published ones has to go through the status index.
+    """
+    authors = Author.objects.bulk_create([
+        Author(username=f'plan-check-{i}', email=f'plan-check-{i}@example.com') for i in range(count)
+    ])
+    now = timezone.now()
+    stories = Story.objects.bulk_create([
+        Story(author=authors[i % len(authors)], title=f'Plan check {i}', slug=f'plan-check-{i}',
+              content='', status='draft' if i % 4 else 'published',
+              published_at=None if i % 4 else now - timedelta(minutes=i))
+        for i in range(count)
+    ])
+    tags = Tag.objects.bulk_create([Tag(name=f'Plan check {i}', slug=f'plan-check-{i}') for i in range(count)])
+    StoryTag.objects.bulk_create([
+        StoryTag(story=story, tag=tags[i % len(tags)]) for i, story in enumerate(stories)
+    ])
+    libraries = Library.objects.bulk_create([
+        Library(user=author, name='Plan check') for author in authors
+    ])
+    Comment.objects.bulk_create([
+        Comment(story=stories[i % len(stories)], author=authors[i % len(authors)], content='')
+        for i in range(count)
+    ])
+    Like.objects.bulk_create([
+        Like(story=story, user=authors[0]) for story in stories
+    ], ignore_conflicts=True)
+    Follower.objects.bulk_create([
+        Follower(follower=author, followed=authors[0]) for author in authors[1:]
+    ], ignore_conflicts=True)
+    LibraryStory.objects.bulk_create([
+        LibraryStory(library=libraries[0], story=story) for story in stories
+    ], ignore_conflicts=True)
+    Notification.objects.bulk_create([
+        Notification(recipient=authors[i % 10], sender=authors[i % len(authors)], notif_type='like',
+                     is_read=bool(i % 3))
+        for i in range(count * 10)
+    ])
+    TimelineEntry.objects.bulk_create([
+        TimelineEntry(user=authors[i % 10], story=story, author_id=story.author_id, published_at=story.published_at)
+        for i, story in enumerate(stories) if story.published_at
+    ])
+    with connection.cursor() as cursor:
+        cursor.execute('ANALYZE')
+
+
+def sample_rows():
+    user = Author.objects.order_by('pk').first()
+    story = Story.objects.order_by('pk').first()
+    library = Library.objects.order_by('pk').first()
+    tag = Tag.objects.order_by('pk').first()
+    if user is None or story is None or library is None or tag is None:
+        raise CommandError('The database has no authors, stories, libraries or tags, run with --seed N.')
+    return user, story, library, tag
+
+
+def explain_hot_queries(seed_count=0):
+    """
+    `(label, problems, plan)` for every hot query, with sequential scans disabled so
+    the planner shows which index it would use. Everything is rolled back.
+    """
+    results = []
+    with transaction.atomic():
+        if seed_count:
+            seed(seed_count)
+        with connection.cursor() as cursor:
+            cursor.execute('SET LOCAL enable_seqscan = off')
+        for label, queryset, index, allowed in hot_queries(*sample_rows()):
+            plan = json.loads(queryset.explain(format='json'))[0]
+            results.append((label, plan_problems(plan, index, allowed), plan))
+        # leave the database as it was (seed rows, session setting)
+        transaction.set_rollback(True)
+    return results
+
+
+class Command(BaseCommand):
+    help = (
+        "EXPLAIN the list queries of the API and fail unless each one is served by its own index, "
+        "without a filter or a sort on top of it. Sequential scans are disabled for the check."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--seed', type=int, default=0,
+                            help='Insert this many sample rows per table first (rolled back afterwards).')
+        parser.add_argument('--verbose-plans', action='store_true', help='Print every plan.')
+
+    def handle(self, *args, **options):
+        if connection.vendor != 'postgresql':
+            raise CommandError('check_query_plans needs PostgreSQL.')
+
+        failures = []
+        for label, problems, plan in explain_hot_queries(options['seed']):
+            if problems:
+                failures.append(label)
+                self.stdout.write(self.style.ERROR(f'FAIL      {label}: {"; ".join(problems)}'))
+            else:
+                self.stdout.write(f'ok        {label}')
+            if problems or options['verbose_plans']:
+                self.stdout.write(json.dumps(plan['Plan'], indent=2))
+
+        if failures:
+            raise CommandError(f'{len(failures)} queries are not served by their index: {", ".join(failures)}')
+        self.stdout.write(self.style.SUCCESS('All query plans use their indexes.'))
@@ -0,0 +1,42 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from api import inbox
+from api.models import Author
+
+
+class Command(BaseCommand):
+    help = "Collapse old read notifications into one row per story and type, and delete expired ones."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--compact-after', type=int, default=inbox.COMPACT_AFTER_DAYS,
+                            help='Age in days after which read notifications are collapsed.')
+        parser.add_argument('--retention', type=int, default=inbox.RETENTION_DAYS,
+                            help='Age in days after which notifications are deleted.')
+        parser.add_argument('--batch-size', type=int, default=500,
+                            help='Recipients compacted (or rows deleted) per transaction.')
+
+    def handle(self, *args, **options):
+        now = timezone.now()
+        batch_size = options['batch_size']
+
+        compact_cutoff = now - timedelta(days=options['compact_after'])
+        collapsed = 0
+        last_pk = 0
+        # walk the recipients in pk ranges so each transaction stays short
+        while True:
+            pks = list(
+                Author.objects.filter(pk__gt=last_pk).order_by('pk')
+                .values_list('pk', flat=True)[:batch_size]
+            )
+            if not pks:
+                break
+            collapsed += inbox.compact_read_notifications(pks[0], pks[-1], compact_cutoff)
+            last_pk = pks[-1]
+
+        expired = inbox.delete_expired(now - timedelta(days=options['retention']), batch_size=batch_size)
+        self.stdout.write(self.style.SUCCESS(
+            f'Collapsed {collapsed} read notifications and deleted {expired} expired ones.'
+        ))
@@ -0,0 +1,43 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from api.broker import InProcessBroker, get_broker
+from api.images import shutdown_pool
+from api.jobs import claim_jobs, run_job
+
+
+class Command(BaseCommand):
+    help = "Drain the notification outbox (story publish and timeline fan-out, batched mark-read)."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true',
+                            help='Process the currently runnable jobs and exit.')
+        parser.add_argument('--limit', type=int, default=10,
+                            help='Jobs claimed per poll.')
+        parser.add_argument('--batch-size', type=int, default=None,
+                            help='Rows written per transaction.')
+        parser.add_argument('--sleep', type=float, default=2.0,
+                            help='Seconds to wait when the queue is empty.')
+
+    def handle(self, *args, **options):
+        if type(get_broker()) is InProcessBroker:
+            self.stderr.write(self.style.WARNING(
+                'NOTIFICATION_BROKER is the in-process broker: the notifications inserted here '
+                'will not reach the open notification streams of the web processes.'
+            ))
+        try:
+            self._drain(options)
+        finally:
+            shutdown_pool()
+
+    def _drain(self, options):
+        while True:
+            jobs = claim_jobs(options['limit'])
+            for job in jobs:
+                job = run_job(job, batch_size=options['batch_size'])
+                self.stdout.write(f'{job}')
+            if options['once'] and not jobs:
+                return
+            if not jobs:
+                time.sleep(options['sleep'])
@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+
+from api.revocation import purge_expired
+
+
+class Command(BaseCommand):
+    help = "Delete blacklisted refresh tokens that have expired (run it daily)."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=None,
+                            help='Rows deleted per statement.')
+
+    def handle(self, *args, **options):
+        deleted = purge_expired(options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f'Purged {deleted} expired revoked tokens.'))
@@ -0,0 +1,24 @@
+from django.core.management.base import BaseCommand
+
+from api.images import IMAGE_FIELDS
+from api.jobs import enqueue_image_derivatives
+
+
+class Command(BaseCommand):
+    help = "Queue image_derivatives jobs for the existing covers and profile pictures that have no resized copies yet."
+
+    def handle(self, *args, **options):
+        total = 0
+        for model_key, (model, field_name) in IMAGE_FIELDS.items():
+            rows = (
+                model.objects.exclude(**{f'{field_name}__isnull': True}).exclude(**{field_name: ''})
+                .filter(**{f'{field_name}_variants': []})
+                .values_list('pk', field_name)
+                .iterator()
+            )
+            for pk, image_name in rows:
+                enqueue_image_derivatives(model_key, pk, field_name, image_name)
+                total += 1
+        self.stdout.write(self.style.SUCCESS(
+            f'Queued {total} images, run process_notification_jobs to render them.'
+        ))
@@ -0,0 +1,37 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from api.counters import recount_author_counters, recount_story_counters, recount_tag_counters
+from api.models import Author, Story, Tag
+
+
+class Command(BaseCommand):
+    help = "Recompute the denormalized like/comment/follower/unread notification/tag counters to repair drift."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=5000,
+                            help='Number of rows updated per UPDATE statement.')
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        stories = self._recount(Story, recount_story_counters, batch_size)
+        authors = self._recount(Author, recount_author_counters, batch_size)
+        tags = self._recount(Tag, recount_tag_counters, batch_size)
+        self.stdout.write(self.style.SUCCESS(
+            f'Recounted {stories} stories, {authors} authors and {tags} tags.'
+        ))
+
+    def _recount(self, model, recount, batch_size):
+        # walk the table in pk ranges so each UPDATE stays short and locks few rows
+        total = 0
+        last_pk = 0
+        while True:
+            pks = list(
+                model.objects.filter(pk__gt=last_pk).order_by('pk')
+                .values_list('pk', flat=True)[:batch_size]
+            )
+            if not pks:
+                return total
+            with transaction.atomic():
+                total += recount(model.objects.filter(pk__gte=pks[0], pk__lte=pks[-1]))
+            last_pk = pks[-1]
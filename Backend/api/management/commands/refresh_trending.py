@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from api import trending
+
+
+class Command(BaseCommand):
+    help = "Recompute the trending story lists from the likes/comments since the last run (run it every few minutes)."
+
+    def handle(self, *args, **options):
+        scored = trending.refresh()
+        self.stdout.write(self.style.SUCCESS(f'Scored {scored} trending stories.'))
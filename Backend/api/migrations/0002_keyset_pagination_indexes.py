@@ -0,0 +1,45 @@
+# Generated by Django 5.2.4 on 2026-10-18 07:54
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='comment',
+            index=models.Index(fields=['story', 'created_at', 'id'], name='comment_story_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='follower',
+            index=models.Index(fields=['followed', 'followed_at', 'id'], name='follower_followed_at_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='follower',
+            index=models.Index(fields=['follower', 'followed_at', 'id'], name='follower_follower_at_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='library',
+            index=models.Index(fields=['user', 'created_at', 'id'], name='library_user_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='librarystory',
+            index=models.Index(fields=['library', 'added_at', 'id'], name='librarystory_added_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='like',
+            index=models.Index(fields=['story', 'created_at', 'id'], name='like_story_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='notification',
+            index=models.Index(fields=['recipient', 'created_at', 'id'], name='notif_recipient_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='story',
+            index=models.Index(fields=['created_at', 'id'], name='story_created_id_idx'),
+        ),
+    ]
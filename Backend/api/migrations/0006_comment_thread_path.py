@@ -0,0 +1,38 @@
+# Generated by Django 5.2.4 on 2026-10-18 08:00
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def backfill_thread_path(apps, schema_editor):
+    Comment = apps.get_model('api', 'Comment')
+    parents = dict(Comment.objects.filter(parent__isnull=False).values_list('id', 'parent_id'))
+    updates = []
+    for comment_id in parents:
+        depth, node = 0, comment_id
+        while node in parents:
+            node = parents[node]
+            depth += 1
+        updates.append(Comment(id=comment_id, root_id=node, depth=depth))
+    Comment.objects.bulk_update(updates, ['root', 'depth'], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0005_home_feed_timeline'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='comment',
+            name='depth',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='comment',
+            name='root',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='thread_comments', to='api.comment'),
+        ),
+        migrations.RunPython(backfill_thread_path, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,45 @@
+# Generated by Django 5.2.4 on 2026-10-18 08:01
+
+import django.contrib.postgres.indexes
+import django.contrib.postgres.search
+from django.contrib.postgres.aggregates import StringAgg
+from django.contrib.postgres.search import SearchVector
+from django.db import migrations
+from django.db.models import OuterRef, Subquery, TextField
+
+
+def backfill_search_vector(apps, schema_editor):
+    Story = apps.get_model('api', 'Story')
+    Tag = apps.get_model('api', 'Tag')
+    tag_names = (
+        Tag.objects.filter(stories=OuterRef('pk'))
+        .order_by()
+        .values('stories')
+        .annotate(names=StringAgg('name', delimiter=' '))
+        .values('names')
+    )
+    Story.objects.update(search_vector=(
+        SearchVector('title', weight='A', config='english')
+        + SearchVector('content', weight='B', config='english')
+        + SearchVector(Subquery(tag_names, output_field=TextField()), weight='C', config='english')
+    ))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0006_comment_thread_path'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='story',
+            name='search_vector',
+            field=django.contrib.postgres.search.SearchVectorField(editable=False, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='story',
+            index=django.contrib.postgres.indexes.GinIndex(fields=['search_vector'], name='story_search_vector_idx'),
+        ),
+        migrations.RunPython(backfill_search_vector, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 5.2.4 on 2026-10-18 08:12
+
+import django.contrib.postgres.fields
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0010_notification_inbox'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='notification',
+            name='bucket',
+            field=models.DateTimeField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='notification',
+            name='recent_actor_ids',
+            field=django.contrib.postgres.fields.ArrayField(base_field=models.BigIntegerField(), blank=True, default=list, editable=False, size=None),
+        ),
+        migrations.AddConstraint(
+            model_name='notification',
+            constraint=models.UniqueConstraint(condition=models.Q(('bucket__isnull', False), ('is_read', False)), fields=('recipient', 'story', 'notif_type', 'bucket'), name='notif_coalesce_bucket_uniq'),
+        ),
+    ]
@@ -0,0 +1,68 @@
+# Generated by Django 5.2.4 on 2026-10-18 08:25
+
+import django.contrib.postgres.indexes
+import django.db.models.deletion
+import django.db.models.functions.text
+from django.db import migrations, models
+from django.db.models import Count, IntegerField, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def backfill_story_counts(apps, schema_editor):
+    Tag = apps.get_model('api', 'Tag')
+    StoryTag = apps.get_model('api', 'StoryTag')
+    tagged = (
+        StoryTag.objects.filter(tag=OuterRef('pk'))
+        .order_by()
+        .values('tag')
+        .annotate(total=Count('pk'))
+        .values('total')
+    )
+    Tag.objects.update(story_count=Coalesce(Subquery(tagged, output_field=IntegerField()), 0))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0012_trending_scores'),
+    ]
+
+    operations = [
+        # api_story_tags already exists as the implicit join table of Story.tags,
+        # only the migration state learns about the explicit model
+        migrations.SeparateDatabaseAndState(
+            state_operations=[
+                migrations.CreateModel(
+                    name='StoryTag',
+                    fields=[
+                        ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                        ('story', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='api.story')),
+                        ('tag', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='api.tag')),
+                    ],
+                    options={
+                        'db_table': 'api_story_tags',
+                        'unique_together': {('story', 'tag')},
+                    },
+                ),
+                migrations.AlterField(
+                    model_name='story',
+                    name='tags',
+                    field=models.ManyToManyField(blank=True, related_name='stories', through='api.StoryTag', to='api.tag'),
+                ),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='storytag',
+            index=models.Index(fields=['tag', 'story'], name='storytag_tag_story_idx'),
+        ),
+        migrations.AddField(
+            model_name='tag',
+            name='story_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddIndex(
+            model_name='tag',
+            index=models.Index(django.contrib.postgres.indexes.OpClass(django.db.models.functions.text.Lower('name'), name='text_pattern_ops'), name='tag_name_prefix_idx'),
+        ),
+        migrations.RunPython(backfill_story_counts, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 5.2.4 on 2026-10-18 08:30
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0013_story_tags'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='author',
+            name='profile_image_variants',
+            field=models.JSONField(blank=True, default=list, editable=False),
+        ),
+        migrations.AddField(
+            model_name='story',
+            name='cover_image_variants',
+            field=models.JSONField(blank=True, default=list, editable=False),
+        ),
+        migrations.AlterField(
+            model_name='notificationjob',
+            name='job_type',
+            field=models.CharField(choices=[('story_publish', 'Story Published'), ('timeline_fanout', 'Timeline Fan-out'), ('mark_read', 'Mark Notifications Read'), ('image_derivatives', 'Image Derivatives')], max_length=30),
+        ),
+    ]
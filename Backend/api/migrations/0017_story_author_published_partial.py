@@ -0,0 +1,21 @@
+# Generated by Django 5.2.4 on 2026-10-18 09:06
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0016_notification_comment_set_null'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='story',
+            name='story_author_published_idx',
+        ),
+        migrations.AddIndex(
+            model_name='story',
+            index=models.Index(condition=models.Q(('status', 'published')), fields=['author', 'published_at', 'id'], name='story_author_published_idx'),
+        ),
+    ]
@@ -0,0 +1,30 @@
+# Generated by Django 5.2.4 on 2026-10-18 09:15
+
+from django.db import migrations
+from django.db.models import Count, IntegerField, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def recount_published_stories(apps, schema_editor):
+    Tag = apps.get_model('api', 'Tag')
+    StoryTag = apps.get_model('api', 'StoryTag')
+    published = (
+        StoryTag.objects.filter(tag=OuterRef('pk'), story__status='published')
+        .order_by()
+        .values('tag')
+        .annotate(total=Count('pk'))
+        .values('total')
+    )
+    Tag.objects.update(story_count=Coalesce(Subquery(published, output_field=IntegerField()), 0))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0017_story_author_published_partial'),
+    ]
+
+    operations = [
+        # Tag.story_count only counts published stories from now on
+        migrations.RunPython(recount_published_stories, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,35 @@
+# Generated by Django 5.2.4 on 2026-10-18 09:25
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0018_tag_story_count_published'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='NotificationActor',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('actor', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to=settings.AUTH_USER_MODEL)),
+                ('notification', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='actors', to='api.notification')),
+            ],
+            options={
+                'unique_together': {('notification', 'actor')},
+            },
+        ),
+        # coalesced rows only knew their latest few actors, start their sets from those
+        migrations.RunSQL(
+            '''
+            INSERT INTO api_notificationactor (notification_id, actor_id)
+            SELECT id, unnest(recent_actor_ids) FROM api_notification WHERE bucket IS NOT NULL
+            ON CONFLICT DO NOTHING
+            ''',
+            migrations.RunSQL.noop,
+        ),
+    ]
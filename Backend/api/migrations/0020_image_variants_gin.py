@@ -0,0 +1,23 @@
+# Generated by Django 5.2.4 on 2026-10-18 09:34
+
+import django.contrib.postgres.indexes
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0019_notification_actors'),
+        ('auth', '0012_alter_user_first_name_max_length'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='author',
+            index=django.contrib.postgres.indexes.GinIndex(fields=['profile_image_variants'], name='author_image_variants_idx', opclasses=['jsonb_path_ops']),
+        ),
+        migrations.AddIndex(
+            model_name='story',
+            index=django.contrib.postgres.indexes.GinIndex(fields=['cover_image_variants'], name='story_cover_variants_idx', opclasses=['jsonb_path_ops']),
+        ),
+    ]
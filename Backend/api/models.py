@@ -1,20 +1,87 @@
-from django.db import models
+from contextlib import nullcontext
+
+from django.contrib.postgres.fields import ArrayField
+from django.contrib.postgres.indexes import GinIndex, OpClass
+from django.contrib.postgres.search import SearchVectorField
+from django.db import models, transaction
+from django.db.models import DEFERRED, Q
+from django.db.models.fields.files import FieldFile
+from django.db.models.functions import Lower
+from django.dispatch import Signal
 from django.contrib.auth.models import AbstractUser, Group, Permission
+from django.utils import timezone
 from django.utils.text import slugify
 from django.conf import settings
 
+from .text import reading_stats
+
+class MaintainedFieldsMixin:
+    """
+    Columns listed in `maintained_fields` are written only by targeted UPDATEs
+    (counters with atomic F() updates in api/counters.py, the search vector in
+    api/search.py), so a regular save() of a stale instance must not write them back.
+    """
+    maintained_fields = ()
+
+    def save(self, *args, **kwargs):
+        if not self._state.adding and kwargs.get('update_fields') is None:
+            kwargs['update_fields'] = [
+                field.name for field in self._meta.concrete_fields
+                if not field.primary_key and field.name not in self.maintained_fields
+            ]
+        super().save(*args, **kwargs)
+
+
+class LoadedValuesMixin:
+    """
+    Keeps a snapshot of the row as loaded (or last saved), so signal handlers can
+    tell what changed without a SELECT.
+    """
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._loaded_values = dict(
+            zip(field_names, (value for value in values if value is not DEFERRED))
+        )
+        return instance
+
+    def loaded_value(self, field_name, default=None):
+        """Value of `field_name` when the instance was loaded (or last saved)."""
+        return getattr(self, '_loaded_values', {}).get(field_name, default)
+
+    def save(self, *args, **kwargs):
+        super().save(*args, **kwargs)
+        self._loaded_values = {}
+        for field in self._meta.concrete_fields:
+            if field.attname in self.__dict__:
+                value = getattr(self, field.attname)
+                # files are renamed in place (FieldFile.save()), keep the name as a row would hold it
+                self._loaded_values[field.attname] = value.name if isinstance(value, FieldFile) else value
+
+
 # -------------------------------
 # Custom User Model 
 # -------------------------------
-class Author(AbstractUser): 
+class Author(MaintainedFieldsMixin, LoadedValuesMixin, AbstractUser): 
     bio = models.TextField(blank=True)
     profile_image = models.ImageField(upload_to='profiles/', blank=True, null=True)
+    # resized WebP/JPEG copies of profile_image, written by api/images.py
+    profile_image_variants = models.JSONField(default=list, blank=True, editable=False)
 
     gmail = models.EmailField(blank=True, null=True, help_text="Optional Gmail address")
     facebook_url = models.URLField(blank=True, null=True, help_text="Facebook profile link")
 
     created_at = models.DateTimeField(auto_now_add=True)
 
+    # denormalized counters, kept current by api/signals.py
+    follower_count = models.PositiveIntegerField(default=0)
+    following_count = models.PositiveIntegerField(default=0)
+    # unread badge of the notification inbox, kept current by api/signals.py and api/inbox.py
+    unread_notification_count = models.PositiveIntegerField(default=0)
+
+    maintained_fields = ('follower_count', 'following_count', 'unread_notification_count', 'profile_image_variants')
+
     groups = models.ManyToManyField(
         Group,
         related_name='author_set',
@@ -30,14 +97,26 @@ class Author(AbstractUser):
         related_query_name='author',
     )
 
+    class Meta(AbstractUser.Meta):
+        indexes = [
+            # "which rows still use this derivative" before it is deleted (api/images.py)
+            GinIndex(fields=['profile_image_variants'], opclasses=['jsonb_path_ops'],
+                     name='author_image_variants_idx'),
+        ]
+
     def __str__(self):
         return self.username
 
 
 
+# Sent exactly once per draft/archived -> published transition of a Story,
+# from Story.publish() or from the post_save handler in api/signals.py
+story_published = Signal()
+
+
 # Story (Post)
 # -------------------------------
-class Story(models.Model):
+class Story(MaintainedFieldsMixin, LoadedValuesMixin, models.Model):
     STATUS_CHOICES = [
         ('draft', 'Draft'),
         ('published', 'Published'),
@@ -49,16 +128,86 @@ class Story(models.Model):
     content = models.TextField()
     author = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='stories')
     cover_image = models.ImageField(upload_to='covers/', blank=True, null=True)   
+    # resized WebP/JPEG copies of cover_image, written by api/images.py
+    cover_image_variants = models.JSONField(default=list, blank=True, editable=False)
     status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='draft')
     read_time = models.IntegerField(null=True, blank=True) 
-    tags = models.ManyToManyField('Tag', related_name='stories', blank=True)
+    # derived from content in save(), so list endpoints never need the body
+    word_count = models.PositiveIntegerField(default=0, editable=False)
+    excerpt = models.CharField(max_length=300, blank=True, editable=False)
+    tags = models.ManyToManyField('Tag', related_name='stories', blank=True, through='StoryTag')
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
+    published_at = models.DateTimeField(null=True, blank=True)
+
+    # denormalized counters, kept current by api/signals.py
+    like_count = models.PositiveIntegerField(default=0)
+    comment_count = models.PositiveIntegerField(default=0)
+
+    # weighted title/content/tag names tsvector, maintained by api/search.py
+    search_vector = SearchVectorField(null=True, editable=False)
+
+    maintained_fields = ('like_count', 'comment_count', 'search_vector', 'cover_image_variants')
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['created_at', 'id'], name='story_created_id_idx'),
+            models.Index(fields=['status', 'created_at', 'id'], name='story_status_created_idx'),
+            models.Index(fields=['author', 'status', 'created_at', 'id'], name='story_author_status_idx'),
+            # fan-out-on-read part of the feed (stories of followed high-follower authors), follow
+            # backfills and profile pages: published stories only, so drafts are never filtered out
+            models.Index(fields=['author', 'published_at', 'id'], condition=Q(status='published'),
+                         name='story_author_published_idx'),
+            GinIndex(fields=['search_vector'], name='story_search_vector_idx'),
+            # @> lookup of the covers still using a derivative file, see api/images.py
+            GinIndex(fields=['cover_image_variants'], opclasses=['jsonb_path_ops'],
+                     name='story_cover_variants_idx'),
+        ]
 
     def save(self, *args, **kwargs):
         if not self.slug:
             self.slug = slugify(self.title)
-        super().save(*args, **kwargs)
+        self._update_reading_stats(kwargs)
+        # A publish transition is claimed with an UPDATE in pre_save (api/signals.py),
+        # it must be undone if the write of the row fails
+        publishing = (
+            not self._state.adding and self.status == 'published'
+            and self.loaded_value('status') != 'published'
+        )
+        with transaction.atomic(using=kwargs.get('using')) if publishing else nullcontext():
+            super().save(*args, **kwargs)
+
+    def _update_reading_stats(self, save_kwargs):
+        # only when the body was loaded and actually changed (from_db snapshot)
+        update_fields = save_kwargs.get('update_fields')
+        if update_fields is not None and 'content' not in update_fields:
+            return
+        if 'content' not in self.__dict__:
+            return
+        if not self._state.adding and self.loaded_value('content') == self.content:
+            return
+        self.word_count, self.read_time, self.excerpt = reading_stats(self.content)
+        if update_fields is not None:
+            save_kwargs['update_fields'] = {*update_fields, 'word_count', 'read_time', 'excerpt'}
+
+    def publish(self):
+        """
+        Publish with a single `UPDATE ... WHERE status != 'published'`.
+
+        Only the caller whose UPDATE changed the row gets True and triggers
+        `story_published`, so concurrent publishes notify followers once.
+        """
+        now = timezone.now()
+        published = Story.objects.filter(pk=self.pk).exclude(status='published').update(
+            status='published', published_at=now, updated_at=now,
+        ) == 1
+        self.status = 'published'
+        if published:
+            self.published_at = now
+        getattr(self, '_loaded_values', {})['status'] = 'published'
+        if published:
+            story_published.send(sender=Story, story=self)
+        return published
 
     def __str__(self):
         return self.title
@@ -66,9 +215,19 @@ class Story(models.Model):
 
 # Tag
 # -------------------------------
-class Tag(models.Model):
+class Tag(MaintainedFieldsMixin, models.Model):
     name = models.CharField(max_length=50, unique=True)
     slug = models.SlugField(unique=True, blank=True)
+    # number of published stories carrying the tag, kept current by api/signals.py
+    story_count = models.PositiveIntegerField(default=0, editable=False)
+
+    maintained_fields = ('story_count',)
+
+    class Meta:
+        indexes = [
+            # autocomplete: LOWER(name) LIKE 'prefix%' as an index range scan
+            models.Index(OpClass(Lower('name'), name='text_pattern_ops'), name='tag_name_prefix_idx'),
+        ]
 
     def save(self, *args, **kwargs):
         if not self.slug:
@@ -79,6 +238,22 @@ class Tag(models.Model):
         return self.name
     
 
+class StoryTag(models.Model):
+    """The Story.tags join table (the one Django created implicitly), with an index for tag pages."""
+    story = models.ForeignKey(Story, on_delete=models.CASCADE)
+    tag = models.ForeignKey(Tag, on_delete=models.CASCADE)
+
+    class Meta:
+        db_table = 'api_story_tags'
+        unique_together = ('story', 'tag')
+        indexes = [
+            models.Index(fields=['tag', 'story'], name='storytag_tag_story_idx'),
+        ]
+
+    def __str__(self):
+        return f'{self.story_id} - {self.tag_id}'
+
+
 # Comment
 # -------------------------------
 class Comment(models.Model):
@@ -87,6 +262,26 @@ class Comment(models.Model):
     content = models.TextField()
     created_at = models.DateTimeField(auto_now_add=True)
     parent = models.ForeignKey('self', null=True, blank=True, on_delete=models.CASCADE, related_name='replies')
+    # materialized thread position: top-level comment of the thread (null for top-level
+    # comments themselves) and nesting depth, a whole thread is one `root_id IN (..)` query
+    root = models.ForeignKey('self', null=True, blank=True, on_delete=models.CASCADE, related_name='thread_comments')
+    depth = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['story', 'created_at', 'id'], name='comment_story_created_idx'),
+            # comments since the last trending refresh (api/trending.py)
+            models.Index(fields=['created_at'], name='comment_created_idx'),
+            # top-level comments of a story (thread pages), `parent IS NULL` can't drive an ordered scan
+            models.Index(fields=['story', 'created_at', 'id'], condition=Q(parent__isnull=True),
+                         name='comment_story_toplevel_idx'),
+        ]
+
+    def save(self, *args, **kwargs):
+        if self._state.adding and self.parent_id:
+            self.depth = self.parent.depth + 1
+            self.root_id = self.parent.root_id or self.parent_id
+        super().save(*args, **kwargs)
 
     def __str__(self):
         return f'Comment by {self.author} on {self.story}'
@@ -100,6 +295,10 @@ class Like(models.Model):
 
     class Meta:
         unique_together = ('story', 'user')  # prevents multiple likes
+        indexes = [
+            models.Index(fields=['story', 'created_at', 'id'], name='like_story_created_idx'),
+            models.Index(fields=['created_at'], name='like_created_idx'),
+        ]
 
 # Follower (Self-referencing M2M)
 # -------------------------------
@@ -110,6 +309,12 @@ class Follower(models.Model):
 
     class Meta:
         unique_together = ('follower', 'followed')  # prevents duplicate follows
+        indexes = [
+            models.Index(fields=['followed', 'followed_at', 'id'], name='follower_followed_at_idx'),
+            models.Index(fields=['follower', 'followed_at', 'id'], name='follower_follower_at_idx'),
+            # lets the fan-out worker walk a user's followers in follower_id order
+            models.Index(fields=['followed', 'follower'], name='follower_fanout_idx'),
+        ]
 
 
 # Library (Custom Lists)
@@ -121,6 +326,11 @@ class Library(models.Model):
     is_private = models.BooleanField(default=True)
     created_at = models.DateTimeField(auto_now_add=True)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['user', 'created_at', 'id'], name='library_user_created_idx'),
+        ]
+
     def __str__(self):
         return f'{self.name} ({self.user.username})'
 
@@ -134,11 +344,14 @@ class LibraryStory(models.Model): # link the story to a library
 
     class Meta:
         unique_together = ('library', 'story') 
+        indexes = [
+            models.Index(fields=['library', 'added_at', 'id'], name='librarystory_added_idx'),
+        ]
 
 
 # Notification
 # -------------------------------
-class Notification(models.Model):
+class Notification(LoadedValuesMixin, models.Model):
     NOTIF_TYPE_CHOICES = [
         ('like', 'Like'),
         ('comment', 'Comment'),
@@ -150,12 +363,153 @@ class Notification(models.Model):
     sender = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='sent_notifications') 
     notif_type = models.CharField(max_length=20, choices=NOTIF_TYPE_CHOICES)
     story = models.ForeignKey(Story, null=True, blank=True, on_delete=models.CASCADE)
-    comment = models.ForeignKey(Comment, null=True, blank=True, on_delete=models.CASCADE)
+    # latest comment of the row; a coalesced row stands for several, so deleting it must not delete the row
+    comment = models.ForeignKey(Comment, null=True, blank=True, on_delete=models.SET_NULL)
     created_at = models.DateTimeField(auto_now_add=True)
     is_read = models.BooleanField(default=False)
+    # number of distinct people behind the notification ("<sender> and 42 others liked
+    # your story"): the sender plus the NotificationActor rows, see api/inbox.py
+    actor_count = models.PositiveIntegerField(default=1)
+    # coalesced like/comment notifications: start of the time window the row collects
+    # events for, and the latest actors first (api/inbox.py notify())
+    bucket = models.DateTimeField(null=True, blank=True, editable=False)
+    recent_actor_ids = ArrayField(models.BigIntegerField(), default=list, blank=True, editable=False)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['recipient', 'created_at', 'id'], name='notif_recipient_created_idx'),
+            models.Index(fields=['recipient', 'is_read', '-created_at', '-id'], name='notif_recipient_read_idx'),
+            # the unread inbox is a small slice of the table
+            models.Index(fields=['recipient', '-created_at', '-id'], condition=Q(is_read=False),
+                         name='notif_recipient_unread_idx'),
+        ]
+        constraints = [
+            # arbiter of the coalescing upsert, once read a row stops collecting events
+            models.UniqueConstraint(fields=['recipient', 'story', 'notif_type', 'bucket'],
+                                    condition=Q(bucket__isnull=False, is_read=False),
+                                    name='notif_coalesce_bucket_uniq'),
+        ]
 
     def __str__(self):
-        return f'{self.notif_type} from {self.sender} to {self.recipient}' 
-    
+        return f'{self.notif_type} from {self.sender} to {self.recipient}'
+
+
+# Everyone a coalesced or collapsed notification stands for, so each person is
+# counted once in actor_count however many times they act (api/inbox.py)
+# -------------------------------
+class NotificationActor(models.Model):
+    notification = models.ForeignKey(Notification, on_delete=models.CASCADE, related_name='actors')
+    actor = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='+')
 
+    class Meta:
+        unique_together = ('notification', 'actor')
+
+    def __str__(self):
+        return f'{self.actor_id} on notification {self.notification_id}'
+
+
+# NotificationJob (outbox drained by `manage.py process_notification_jobs`)
+# -------------------------------
+class NotificationJob(models.Model):
+    JOB_TYPE_CHOICES = [
+        ('story_publish', 'Story Published'),
+        ('timeline_fanout', 'Timeline Fan-out'),
+        ('mark_read', 'Mark Notifications Read'),
+        ('image_derivatives', 'Image Derivatives'),
+    ]
+    STATUS_CHOICES = [
+        ('pending', 'Pending'),
+        ('running', 'Running'),
+        ('done', 'Done'),
+        ('failed', 'Failed'),
+    ]
+
+    job_type = models.CharField(max_length=30, choices=JOB_TYPE_CHOICES)
+    story = models.ForeignKey(Story, null=True, blank=True, on_delete=models.CASCADE, related_name='notification_jobs')
+    # owner of the inbox for mark_read jobs, and the selection to mark
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, null=True, blank=True, on_delete=models.CASCADE,
+                             related_name='notification_jobs')
+    params = models.JSONField(default=dict, blank=True)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='pending')
+    # id of the last follower notified (last notification marked), batches resume after it on retry
+    cursor = models.BigIntegerField(default=0)
+    processed = models.PositiveIntegerField(default=0)
+    total = models.PositiveIntegerField(default=0)
+    attempts = models.PositiveSmallIntegerField(default=0)
+    last_error = models.TextField(blank=True)
+    # next time a worker may pick the job up (retry backoff / lease of a running job)
+    available_at = models.DateTimeField(default=timezone.now)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'available_at'], name='notifjob_status_available_idx'),
+        ]
+
+    @property
+    def progress(self):
+        if not self.total:
+            return 100 if self.status == 'done' else 0
+        return min(100, round(self.processed * 100 / self.total))
+
+    def __str__(self):
+        return f'{self.job_type} #{self.pk} {self.status} ({self.processed}/{self.total})'
 
+
+# TimelineEntry (materialized home feed, one row per follower and published story)
+# -------------------------------
+class TimelineEntry(models.Model):
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='timeline')
+    story = models.ForeignKey(Story, on_delete=models.CASCADE, related_name='timeline_entries')
+    author = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='+')
+    published_at = models.DateTimeField()
+
+    class Meta:
+        unique_together = ('user', 'story')
+        indexes = [
+            models.Index(fields=['user', 'published_at', 'story'], name='timeline_user_published_idx'),
+            models.Index(fields=['user', 'author'], name='timeline_user_author_idx'),
+        ]
+
+    def __str__(self):
+        return f'{self.story_id} in feed of {self.user_id}'
+
+
+# TrendingScore (precomputed trending lists, refreshed by `manage.py refresh_trending`)
+# -------------------------------
+class TrendingScore(models.Model):
+    # '' for the site-wide list, else the slug of the tag
+    scope = models.CharField(max_length=50, blank=True)
+    story = models.ForeignKey(Story, on_delete=models.CASCADE, related_name='trending_scores')
+    score = models.FloatField()
+
+    class Meta:
+        unique_together = ('scope', 'story')
+        indexes = [
+            models.Index(fields=['scope', '-score'], name='trending_scope_score_idx'),
+        ]
+
+    def __str__(self):
+        return f'{self.story_id} in trending {self.scope or "(all)"}: {self.score:.4f}'
+
+
+class TrendingRun(models.Model):
+    # single row, the likes/comments after `last_run_at` are the next refresh's input
+    last_run_at = models.DateTimeField()
+
+    def __str__(self):
+        return f'trending refreshed at {self.last_run_at}'
+
+
+# RevokedToken (refresh token blacklist, see api/revocation.py)
+# -------------------------------
+class RevokedToken(models.Model):
+    jti = models.CharField(max_length=255, unique=True)
+    expires_at = models.DateTimeField()
+    # day the token expires, purge_revoked_tokens drops whole days at a time
+    expires_on = models.DateField(db_index=True)
+    revoked_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f'{self.jti} (expires {self.expires_at})'
@@ -0,0 +1,219 @@
+import json
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from collections import OrderedDict, namedtuple
+from datetime import date, datetime
+from decimal import Decimal
+
+from django.conf import settings
+from django.core.exceptions import FieldDoesNotExist, ValidationError
+from django.db.models import BooleanField, F, Func, Q, Value
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import CursorPagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+
+Cursor = namedtuple('Cursor', ['values', 'reverse'])
+
+
+class KeysetPagination(CursorPagination):
+    """
+    Keyset (seek) pagination on a unique ordering, `(created_at, id)` by default.
+
+    The cursor holds the ordering values of the last row of the page, so the next
+    page is a plain `WHERE (created_at, id) < (..)` range scan on a composite index
+    and page N costs the same as page 1. Views can override the ordering with a
+    `pagination_ordering` attribute, the last field must make the ordering unique.
+    """
+    ordering = ('-created_at', '-id')
+    page_size_query_param = 'page_size'
+    max_page_size = getattr(settings, 'API_MAX_PAGE_SIZE', 100)
+
+    def get_ordering(self, request, queryset, view):
+        ordering = getattr(view, 'pagination_ordering', None) or self.ordering
+        if isinstance(ordering, str):
+            return (ordering,)
+        return tuple(ordering)
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.page_size = self.get_page_size(request)
+        if not self.page_size:
+            return None
+
+        self.base_url = request.build_absolute_uri()
+        self.ordering = self.get_ordering(request, queryset, view)
+        self.cursor = self.decode_cursor(request, queryset.model)
+
+        reverse = self.cursor is not None and self.cursor.reverse
+        ordering = _invert(self.ordering) if reverse else self.ordering
+        queryset = queryset.order_by(*ordering)
+        if self.cursor is not None:
+            queryset = queryset.filter(self.keyset_filter(ordering, self.cursor.values))
+
+        # One extra row tells us whether there is anything past this page.
+        return self._paginate_results(list(queryset[:self.page_size + 1]), reverse)
+
+    def paginate_querysets(self, querysets, request, view=None):
+        """
+        Keyset-paginate the union of several querysets that expose the same
+        ordering fields (e.g. `values()` rows) sorted in one direction. Each
+        source is range-scanned for at most one page, rows are merged in python.
+        """
+        self.page_size = self.get_page_size(request)
+        self.base_url = request.build_absolute_uri()
+        self.ordering = self.get_ordering(request, querysets[0], view)
+        self.cursor = self.decode_cursor(request, querysets[0].model)
+
+        reverse = self.cursor is not None and self.cursor.reverse
+        ordering = _invert(self.ordering) if reverse else self.ordering
+        rows = {}
+        for queryset in querysets:
+            queryset = queryset.order_by(*ordering)
+            if self.cursor is not None:
+                queryset = queryset.filter(self.keyset_filter(ordering, self.cursor.values))
+            for row in queryset[:self.page_size + 1]:
+                rows.setdefault(tuple(self._position(row)), row)
+        results = [
+            rows[key] for key in sorted(rows, reverse=ordering[0].startswith('-'))
+        ][:self.page_size + 1]
+        return self._paginate_results(results, reverse)
+
+    def _paginate_results(self, results, reverse):
+        has_more = len(results) > self.page_size
+        self.page = results[:self.page_size]
+
+        if reverse:
+            self.page.reverse()
+            self.has_next = True
+            self.has_previous = has_more
+        else:
+            self.has_next = has_more
+            self.has_previous = self.cursor is not None
+        return self.page
+
+    def keyset_filter(self, ordering, values):
+        """
+        Build the "after the cursor" condition. With one direction throughout it
+        is the row comparison `(a, b) < (x, y)`, which Postgres turns into a
+        single index condition on the composite index. Mixed directions can't be
+        a row comparison and fall back to `a >= x AND (a > x OR (a = x AND b > y))`,
+        the redundant leading bound keeps the first column an index condition.
+        """
+        lookups = [
+            (name.lstrip('-'), 'lt' if name.startswith('-') else 'gt')
+            for name in ordering
+        ]
+        directions = {lookup for _, lookup in lookups}
+        if len(directions) == 1:
+            return RowComparison(
+                [field for field, _ in lookups], values,
+                '<' if directions == {'lt'} else '>',
+            )
+        keyset = Q()
+        for i, (field, lookup) in enumerate(lookups):
+            clause = Q(**{f'{field}__{lookup}': values[i]})
+            for (prev_field, _), value in zip(lookups[:i], values[:i]):
+                clause &= Q(**{prev_field: value})
+            keyset |= clause
+        first_field, first_lookup = lookups[0]
+        return Q(**{f'{first_field}__{first_lookup}e': values[0]}) & keyset
+
+    def get_next_link(self):
+        if not self.has_next:
+            return None
+        if not self.page:
+            # An empty page reached by going backwards, restart from the top.
+            return self.encode_cursor(None)
+        return self.encode_cursor(Cursor(values=self._position(self.page[-1]), reverse=False))
+
+    def get_previous_link(self):
+        if not self.has_previous:
+            return None
+        if not self.page:
+            return self.encode_cursor(Cursor(values=self.cursor.values, reverse=True))
+        return self.encode_cursor(Cursor(values=self._position(self.page[0]), reverse=True))
+
+    def decode_cursor(self, request, model=None):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if encoded is None:
+            return None
+        try:
+            payload = json.loads(urlsafe_b64decode(encoded.encode('ascii')).decode('utf-8'))
+            values = payload['v']
+            reverse = bool(payload.get('r', False))
+            if not isinstance(values, list) or len(values) != len(self.ordering):
+                raise ValueError
+            values = [
+                self._to_python(model, name.lstrip('-'), value)
+                for name, value in zip(self.ordering, values)
+            ]
+        except (TypeError, ValueError, KeyError, ValidationError):
+            raise NotFound(self.invalid_cursor_message)
+        return Cursor(values=values, reverse=reverse)
+
+    def encode_cursor(self, cursor):
+        if cursor is None:
+            return remove_query_param(self.base_url, self.cursor_query_param)
+        payload = {'v': [_jsonable(value) for value in cursor.values]}
+        if cursor.reverse:
+            payload['r'] = 1
+        encoded = urlsafe_b64encode(
+            json.dumps(payload, separators=(',', ':')).encode('utf-8')
+        ).decode('ascii')
+        return replace_query_param(self.base_url, self.cursor_query_param, encoded)
+
+    def get_paginated_response(self, data):
+        return Response(OrderedDict([
+            ('next', self.get_next_link()),
+            ('previous', self.get_previous_link()),
+            ('results', data),
+        ]))
+
+    def _position(self, instance):
+        return [
+            instance[name.lstrip('-')] if isinstance(instance, dict) else getattr(instance, name.lstrip('-'))
+            for name in self.ordering
+        ]
+
+    @staticmethod
+    def _to_python(model, field_name, value):
+        # Annotations (e.g. a search rank) are not model fields, keep the JSON value.
+        if model is None:
+            return value
+        try:
+            field = model._meta.get_field(field_name)
+        except FieldDoesNotExist:
+            return value
+        return field.to_python(value)
+
+
+class RowComparison(Func):
+    """`(a, b, ..) <op> (x, y, ..)` over model fields and python values."""
+    output_field = BooleanField()
+
+    def __init__(self, fields, values, operator):
+        super().__init__(*(F(field) for field in fields), *(Value(value) for value in values))
+        self.width = len(fields)
+        self.operator = operator
+
+    def as_sql(self, compiler, connection, **extra_context):
+        sql, params = [], []
+        for expression in self.get_source_expressions():
+            expression_sql, expression_params = compiler.compile(expression)
+            sql.append(expression_sql)
+            params.extend(expression_params)
+        left, right = ', '.join(sql[:self.width]), ', '.join(sql[self.width:])
+        return f'({left}) {self.operator} ({right})', params
+
+
+def _invert(ordering):
+    return tuple(name[1:] if name.startswith('-') else f'-{name}' for name in ordering)
+
+
+def _jsonable(value):
+    # isoformat keeps microseconds, DjangoJSONEncoder would round them away
+    # and break the equality half of the keyset comparison.
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    if isinstance(value, Decimal):
+        return str(value)
+    return value
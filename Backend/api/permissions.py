@@ -11,7 +11,8 @@ class IsAuthorOrReadOnly(permissions.BasePermission):
         if request.method in permissions.SAFE_METHODS:
             return True 
         # Only the author can update or delete
-        return obj.author == request.user
+        # ids only, the JWT request user answers pk without loading the row
+        return obj.author_id == request.user.pk
 
 
 
@@ -24,4 +25,4 @@ class IsOwnerOrReadOnly(permissions.BasePermission):
     def has_object_permission(self,request,view,obj):
         if request.method in permissions.SAFE_METHODS:
             return True 
-        return request.user == obj.user 
+        return obj.user_id == request.user.pk
@@ -0,0 +1,69 @@
+"""
+Author profile pages (`/authors/<username>/`).
+
+A profile is read in two statements: the author row with the stored
+follower/following counters and two correlated subqueries over the published
+stories (count and sum of their like counters, on the (author, status) index),
+then the latest published stories with their tag slugs aggregated in the same
+SELECT. Anonymous reads are cached under the `author:<id>` scope of api/cache.py,
+bumped by follows, publishes, story edits and profile edits. Total likes come
+from the story counters and may lag a like by API_CACHE_TIMEOUT.
+
+The username -> id map kept in the cache lets a cached profile be found
+without a query; it is dropped when the username changes or the author is
+deleted, and expires with the responses (API_CACHE_TIMEOUT) in any case.
+"""
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Count, IntegerField, OuterRef, Subquery, Sum
+from django.db.models.functions import Coalesce
+
+from .cache import CACHE_TIMEOUT, ENABLED as CACHE_ENABLED, invalidate
+from .models import Story
+
+LATEST_STORIES = getattr(settings, 'AUTHOR_PROFILE_LATEST_STORIES', 5)
+
+
+def author_scope(author_id):
+    return f'author:{author_id}'
+
+
+def invalidate_authors(*author_ids):
+    invalidate(*(author_scope(pk) for pk in author_ids))
+
+
+def _id_key(username):
+    return f'api:author-id:{username}'
+
+
+def cached_author_id(username):
+    # like the responses, only kept in a cache every process sees
+    return cache.get(_id_key(username)) if CACHE_ENABLED else None
+
+
+def remember_author_id(username, author_id):
+    if CACHE_ENABLED:
+        cache.set(_id_key(username), author_id, CACHE_TIMEOUT)
+
+
+def forget_author_id(username):
+    cache.delete(_id_key(username))
+
+
+def _published_stories_total(aggregate):
+    subquery = (
+        Story.objects.filter(author=OuterRef('pk'), status='published')
+        .order_by()
+        .values('author')
+        .annotate(total=aggregate)
+        .values('total')
+    )
+    return Coalesce(Subquery(subquery, output_field=IntegerField()), 0)
+
+
+def annotate_author_stats(queryset):
+    """Annotate authors with `story_count` and `total_likes` of their published stories."""
+    return queryset.annotate(
+        story_count=_published_stories_total(Count('pk')),
+        total_likes=_published_stories_total(Sum('like_count')),
+    )
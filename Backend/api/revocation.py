@@ -0,0 +1,178 @@
+"""
+Refresh token blacklist.
+
+Only revoked tokens are stored (RevokedToken, one row per jti until the token
+would have expired anyway), not every token ever issued. Rotation revokes the
+presented refresh token with a single INSERT ... ON CONFLICT DO NOTHING: if the
+row already exists the token was used before (a replay, or two refreshes racing)
+and the refresh is refused, so the database insert is what enforces single use.
+
+Plain checks (`is_revoked`) first ask a Bloom filter of the revoked jtis held in
+process memory: "no" is certain and costs no query, the rare "maybe" is
+confirmed with an index lookup. The filter catches up with rows inserted by
+other processes every REVOCATION_SYNC_SECONDS and is rebuilt from scratch every
+REVOCATION_REBUILD_SECONDS, which also forgets the purged rows. Rebuilds scan
+the whole table in a background thread while the previous filter (or, before
+the first one, the index) keeps answering, so no refresh waits for them.
+"""
+import hashlib
+import logging
+import math
+import threading
+import time
+from datetime import datetime, timezone as dt_timezone
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.utils import timezone
+
+from .models import RevokedToken
+
+BLOOM_CAPACITY = getattr(settings, 'REVOCATION_BLOOM_CAPACITY', 1_000_000)
+BLOOM_ERROR_RATE = getattr(settings, 'REVOCATION_BLOOM_ERROR_RATE', 0.001)
+SYNC_SECONDS = getattr(settings, 'REVOCATION_SYNC_SECONDS', 30)
+REBUILD_SECONDS = getattr(settings, 'REVOCATION_REBUILD_SECONDS', 3600)
+PURGE_BATCH_SIZE = getattr(settings, 'REVOCATION_PURGE_BATCH_SIZE', 5000)
+
+logger = logging.getLogger(__name__)
+
+
+class BloomFilter:
+    def __init__(self, capacity=BLOOM_CAPACITY, error_rate=BLOOM_ERROR_RATE):
+        self.size = max(int(-capacity * math.log(error_rate) / math.log(2) ** 2), 8)
+        self.hashes = max(round(self.size / capacity * math.log(2)), 1)
+        self.bits = bytearray((self.size + 7) // 8)
+
+    def _positions(self, key):
+        # double hashing: k positions from the two halves of one digest
+        digest = hashlib.blake2b(key.encode(), digest_size=16).digest()
+        first, second = int.from_bytes(digest[:8], 'little'), int.from_bytes(digest[8:], 'little') | 1
+        return ((first + i * second) % self.size for i in range(self.hashes))
+
+    def add(self, key):
+        for position in self._positions(key):
+            self.bits[position >> 3] |= 1 << (position & 7)
+
+    def __contains__(self, key):
+        return all(self.bits[position >> 3] & (1 << (position & 7)) for position in self._positions(key))
+
+
+class RevocationFilter:
+    """The process-wide Bloom filter of revoked jtis and its sync state."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._bloom = None
+        self._last_id = 0
+        self._synced_at = 0.0
+        self._built_at = 0.0
+        self._rebuilding = False
+        self._added_while_rebuilding = []
+
+    def _load(self, bloom, after_id):
+        rows = RevokedToken.objects.filter(pk__gt=after_id).order_by('pk').values_list('pk', 'jti')
+        last_id = after_id
+        for last_id, jti in rows.iterator(chunk_size=10000):
+            bloom.add(jti)
+        return last_id
+
+    def rebuild(self):
+        """Build a new filter from the whole table and swap it in, the current one answers meanwhile."""
+        bloom = BloomFilter()
+        last_id = self._load(bloom, 0)
+        with self._lock:
+            for jti in self._added_while_rebuilding:
+                bloom.add(jti)
+            self._added_while_rebuilding = []
+            self._bloom, self._last_id = bloom, last_id
+            self._built_at = self._synced_at = time.monotonic()
+            self._rebuilding = False
+
+    def _rebuild_in_background(self):
+        try:
+            self.rebuild()
+        except Exception:
+            logger.exception('revoked token filter rebuild failed')
+            with self._lock:
+                self._rebuilding = False
+                self._built_at = time.monotonic()
+        finally:
+            connection.close()
+
+    def sync(self):
+        now = time.monotonic()
+        with self._lock:
+            if self._rebuilding:
+                return
+            if self._bloom is None or now - self._built_at >= REBUILD_SECONDS:
+                # full scans never run in a request: a thread builds the new filter,
+                # ids can commit out of order and the rebuild picks up any row an increment skipped
+                self._rebuilding = True
+                threading.Thread(target=self._rebuild_in_background, daemon=True).start()
+                return
+            if now - self._synced_at < SYNC_SECONDS:
+                return
+            self._synced_at = now
+            after_id, bloom = self._last_id, self._bloom
+        # only the rows revoked since the last sync, read outside the lock
+        last_id = self._load(bloom, after_id)
+        with self._lock:
+            self._last_id = max(self._last_id, last_id)
+
+    def add(self, jti):
+        with self._lock:
+            if self._bloom is not None:
+                self._bloom.add(jti)
+            if self._rebuilding:
+                self._added_while_rebuilding.append(jti)
+
+    def might_contain(self, jti):
+        self.sync()
+        bloom = self._bloom
+        # until the first build is in, every check is answered by the jti index
+        return bloom is None or jti in bloom
+
+
+_filter = RevocationFilter()
+
+
+def _expiry(exp):
+    return datetime.fromtimestamp(exp, tz=dt_timezone.utc)
+
+
+def revoke(jti, exp):
+    """Blacklist the token `jti` (expiring at the `exp` timestamp), False if it already was."""
+    expires_at = _expiry(exp)
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f'INSERT INTO {RevokedToken._meta.db_table} (jti, expires_at, expires_on, revoked_at) '
+            f'VALUES (%s, %s, %s, %s) ON CONFLICT (jti) DO NOTHING RETURNING id',
+            [jti, expires_at, expires_at.date(), timezone.now()],
+        )
+        inserted = cursor.fetchone() is not None
+    transaction.on_commit(lambda: _filter.add(jti))
+    return inserted
+
+
+def is_revoked(jti):
+    if not _filter.might_contain(jti):
+        return False
+    return RevokedToken.objects.filter(jti=jti).exists()
+
+
+def purge_expired(batch_size=None):
+    """Delete the rows of tokens that expired before today in batches, returns the count."""
+    batch_size = batch_size or PURGE_BATCH_SIZE
+    today = timezone.now().date()
+    total = 0
+    while True:
+        # whole expired days, read through the expires_on index
+        ids = list(
+            RevokedToken.objects.filter(expires_on__lt=today)
+            .order_by('expires_on')
+            .values_list('pk', flat=True)[:batch_size]
+        )
+        if not ids:
+            return total
+        deleted, _ = RevokedToken.objects.filter(pk__in=ids).delete()
+        total += deleted
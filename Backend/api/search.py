@@ -0,0 +1,59 @@
+"""
+PostgreSQL full-text search over stories.
+
+`Story.search_vector` stores a weighted tsvector of the title (A), the content (B)
+and the tag names (C). It is rebuilt with one UPDATE per changed story from the
+signal handlers in api/signals.py, and the GIN index on it serves `@@` lookups.
+"""
+from django.conf import settings
+from django.contrib.postgres.aggregates import StringAgg
+from django.contrib.postgres.search import SearchHeadline, SearchQuery, SearchRank, SearchVector
+from django.db.models import F, FloatField, OuterRef, QuerySet, Subquery, TextField
+from django.db.models.functions import Cast
+
+from .models import Story, Tag
+
+SEARCH_CONFIG = getattr(settings, 'SEARCH_CONFIG', 'english')
+
+
+def story_search_vector():
+    tag_names = (
+        Tag.objects.filter(stories=OuterRef('pk'))
+        .order_by()
+        .values('stories')
+        .annotate(names=StringAgg('name', delimiter=' '))
+        .values('names')
+    )
+    return (
+        SearchVector('title', weight='A', config=SEARCH_CONFIG)
+        + SearchVector('content', weight='B', config=SEARCH_CONFIG)
+        + SearchVector(Subquery(tag_names, output_field=TextField()), weight='C', config=SEARCH_CONFIG)
+    )
+
+
+def update_search_vector(stories):
+    """Recompute the stored vector for a queryset of stories or a list of story ids."""
+    if not isinstance(stories, QuerySet):
+        stories = Story.objects.filter(pk__in=list(stories))
+    return stories.update(search_vector=story_search_vector())
+
+
+def search_stories(text, queryset=None):
+    """
+    Published stories matching `text` (websearch syntax), annotated with a float8
+    `rank` (exact through the JSON cursor) and a highlighted `headline` snippet.
+    """
+    if queryset is None:
+        queryset = Story.objects.all()
+    query = SearchQuery(text, search_type='websearch', config=SEARCH_CONFIG)
+    return (
+        queryset.filter(status='published', search_vector=query)
+        .annotate(
+            rank=Cast(SearchRank(F('search_vector'), query), FloatField()),
+            headline=SearchHeadline(
+                'content', query, config=SEARCH_CONFIG,
+                start_sel='<mark>', stop_sel='</mark>',
+                max_words=35, min_words=15, max_fragments=2,
+            ),
+        )
+    )
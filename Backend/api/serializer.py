@@ -1,9 +1,26 @@
-from ast import Module
-from dataclasses import fields
-from nt import read
-from pyexpat import model
+from django.contrib.postgres.expressions import ArraySubquery
+from django.core.files.storage import default_storage
+from django.db import transaction
+from django.db.models import OuterRef, Prefetch
 from rest_framework import serializers
-from .models import Author,Story,Tag,Like, Comment,Follower ,Library,LibraryStory, Notification
+from . import images, inbox, profiles
+from .models import Author,Story,StoryTag,Tag,Like, Comment,Follower ,Library,LibraryStory, Notification
+
+class SrcsetField(serializers.Field):
+    """`{format: srcset}` of the resized copies of an image (the `<field>_variants` column, see api/images.py)."""
+
+    def __init__(self, **kwargs):
+        kwargs['read_only'] = True
+        super().__init__(**kwargs)
+
+    def to_representation(self, variants):
+        request = self.context.get('request')
+        url = (lambda name: request.build_absolute_uri(default_storage.url(name))) if request else None
+        return {
+            image_format: images.srcset(variants, image_format, url)
+            for image_format in images.FORMATS
+            if any(variant['format'] == image_format for variant in variants)
+        }
 
 class AuthorSerializer(serializers.ModelSerializer):
     password = serializers.CharField(write_only=True)
@@ -15,10 +32,132 @@ class AuthorSerializer(serializers.ModelSerializer):
 
 
 class StorySerializer(serializers.ModelSerializer):
+    cover_srcset = SrcsetField(source='cover_image_variants')
+    # declared: DRF maps an m2m with a custom through model (StoryTag) to a read-only field
+    tags = serializers.PrimaryKeyRelatedField(many=True, queryset=Tag.objects.all(), required=False)
+
+    class Meta:
+        model = Story
+        exclude = ['search_vector', 'cover_image_variants']
+        read_only_fields = ['author', 'read_time', 'like_count', 'comment_count'] 
+
+    def create(self, validated_data):
+        tags = validated_data.pop('tags', None)
+        story = super().create(validated_data)
+        if tags is not None:
+            story.tags.set(tags)
+        return story
+
+    def update(self, instance, validated_data):
+        tags = validated_data.pop('tags', None)
+        story = super().update(instance, validated_data)
+        if tags is not None:
+            story.tags.set(tags)
+        return story
+
+class AuthorSummarySerializer(serializers.ModelSerializer):
+    profile_srcset = SrcsetField(source='profile_image_variants')
+
+    class Meta:
+        model = Author
+        fields = ('id', 'username', 'profile_image', 'profile_srcset')
+
+def _model_field(serializer_class, name):
+    # declared fields may read another column (`source`)
+    declared = serializer_class._declared_fields.get(name)
+    return getattr(declared, 'source', None) or name
+
+class StorySummarySerializer(serializers.ModelSerializer):
+    """
+    Story card for list endpoints: no `content`, only the stored excerpt. Use
+    `setup_queryset` so the body is never fetched and tags cost one query per page.
+    """
+    author = AuthorSummarySerializer(read_only=True)
+    tags = serializers.SlugRelatedField(many=True, read_only=True, slug_field='slug')
+    cover_srcset = SrcsetField(source='cover_image_variants')
+
     class Meta:
         model = Story
-        fields = '__all__' 
-        read_only_fields = ['author'] 
+        fields = ('id', 'title', 'slug', 'author', 'excerpt', 'cover_image', 'cover_srcset', 'status', 'read_time', 'word_count',
+                  'tags', 'like_count', 'comment_count', 'published_at', 'created_at')
+
+    @classmethod
+    def setup_queryset(cls, queryset, prefix=''):
+        """Restrict `queryset` (of stories, or of rows with a story FK when `prefix` is e.g. 'story__') to the summary columns."""
+        story_fields = [_model_field(cls, name) for name in cls.Meta.fields if name not in ('author', 'tags')]
+        author_fields = [f'author__{_model_field(AuthorSummarySerializer, name)}'
+                         for name in AuthorSummarySerializer.Meta.fields]
+        queryset = queryset.select_related(f'{prefix}author').prefetch_related(
+            Prefetch(f'{prefix}tags', queryset=Tag.objects.only('id', 'slug'))
+        )
+        if prefix:
+            return queryset.defer(f'{prefix}content', f'{prefix}search_vector')
+        return queryset.only(*story_fields, *author_fields)
+
+class ViewerStateMixin(serializers.Serializer):
+    """Flags of the requesting user, annotated by toggles.annotate_viewer_state."""
+    liked_by_me = serializers.BooleanField(read_only=True)
+    saved_in_my_library = serializers.BooleanField(read_only=True)
+    author_followed_by_me = serializers.BooleanField(read_only=True)
+
+    viewer_state_fields = ('liked_by_me', 'saved_in_my_library', 'author_followed_by_me')
+
+class StoryViewerStateSerializer(ViewerStateMixin, StorySerializer):
+    pass
+
+class StorySummaryViewerStateSerializer(ViewerStateMixin, StorySummarySerializer):
+    class Meta(StorySummarySerializer.Meta):
+        fields = StorySummarySerializer.Meta.fields + ViewerStateMixin.viewer_state_fields
+
+class StorySearchResultSerializer(StorySummarySerializer):
+    rank = serializers.FloatField(read_only=True)
+    headline = serializers.CharField(read_only=True)
+
+    class Meta(StorySummarySerializer.Meta):
+        fields = StorySummarySerializer.Meta.fields + ('rank', 'headline')
+
+class StoryTrendingSerializer(StorySummarySerializer):
+    score = serializers.FloatField(read_only=True)
+
+    class Meta(StorySummarySerializer.Meta):
+        fields = StorySummarySerializer.Meta.fields + ('score',)
+
+class AuthorProfileStorySerializer(StorySummarySerializer):
+    """Story card of a profile page: the author is the profile itself, tags come as slugs."""
+    author = None
+    tags = serializers.ListField(child=serializers.CharField(), source='tag_slugs', read_only=True)
+
+    class Meta(StorySummarySerializer.Meta):
+        fields = tuple(name for name in StorySummarySerializer.Meta.fields if name != 'author')
+
+    @classmethod
+    def setup_queryset(cls, queryset):
+        """Summary columns plus the tag slugs aggregated in the same SELECT (no author join, no tag prefetch)."""
+        story_fields = [_model_field(cls, name) for name in cls.Meta.fields if name != 'tags']
+        return queryset.only(*story_fields).annotate(tag_slugs=ArraySubquery(
+            StoryTag.objects.filter(story=OuterRef('pk')).order_by('tag__slug').values('tag__slug')
+        ))
+
+class AuthorProfileSerializer(serializers.ModelSerializer):
+    """Public profile page, built from the two queries described in api/profiles.py."""
+    profile_srcset = SrcsetField(source='profile_image_variants')
+    story_count = serializers.IntegerField(read_only=True)
+    total_likes = serializers.IntegerField(read_only=True)
+    latest_stories = AuthorProfileStorySerializer(many=True, read_only=True)
+
+    computed_fields = ('story_count', 'total_likes', 'latest_stories')
+
+    class Meta:
+        model = Author
+        fields = ('id', 'username', 'first_name', 'last_name', 'bio', 'profile_image', 'profile_srcset',
+                  'facebook_url', 'created_at', 'follower_count', 'following_count',
+                  'story_count', 'total_likes', 'latest_stories')
+
+    @classmethod
+    def setup_queryset(cls, queryset):
+        """Profile columns and the story/like totals in one statement."""
+        author_fields = [_model_field(cls, name) for name in cls.Meta.fields if name not in cls.computed_fields]
+        return profiles.annotate_author_stats(queryset.only(*author_fields))
 
 class TagSerializer(serializers.ModelSerializer):
     class Meta:
@@ -35,7 +174,7 @@ class CommentSerializer(serializers.ModelSerializer):
     class Meta:
         model = Comment
         fields = '__all__'
-        read_only_fields = ['author', 'created_at']
+        read_only_fields = ['author', 'created_at', 'root', 'depth']
 
 class FollowerSerializer(serializers.ModelSerializer):
     class Meta:
@@ -43,7 +182,7 @@ class FollowerSerializer(serializers.ModelSerializer):
         fields = '__all__'
         read_only_fields = ['follower', 'followed_at']  
     def create(self, validated_data):
-        validated_data['follower'] = self.context['request'].user
+        validated_data['follower_id'] = self.context['request'].user.pk
         return super().create(validated_data)
 
 
@@ -63,4 +202,17 @@ class NotificationSerializer(serializers.ModelSerializer):
     class Meta:
         model = Notification
         fields = '__all__'
-        read_only_fields = ['recipient', 'sender', 'created_at']
+        read_only_fields = ['recipient', 'sender', 'created_at', 'actor_count']
+
+    def update(self, instance, validated_data):
+        # the read flag goes through a conditional UPDATE that keeps the unread badge
+        # exact under concurrent requests, the other fields are saved without it
+        is_read = validated_data.pop('is_read', None)
+        with transaction.atomic():
+            if validated_data:
+                for attr, value in validated_data.items():
+                    setattr(instance, attr, value)
+                instance.save(update_fields=list(validated_data))
+            if is_read is not None:
+                inbox.set_read(instance, is_read)
+        return instance
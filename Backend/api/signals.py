@@ -1,47 +1,69 @@
-from django.db.models.signals import post_save, pre_save
+from django.db.models.signals import m2m_changed, post_delete, post_save, pre_delete, pre_save
 from django.dispatch import receiver
 from django.contrib.auth import get_user_model
+from django.utils import timezone
 
-from .models import Story, Like, Comment, Follower, Notification
+from .counters import adjust_counter
+from .feed import backfill_timeline, drop_from_timeline, drop_story
+from .broker import notification_event, publish_after_commit
+from .inbox import notify
+from .images import queue_derivatives, queue_discard
+from .profiles import forget_author_id, invalidate_authors
+from .jobs import enqueue_story_publish, enqueue_timeline_fanout
+from .models import Author, Story, StoryTag, Tag, Like, Comment, Follower, Notification, story_published
+from .search import update_search_vector
+from .cache import invalidate
 
 
 @receiver(pre_save, sender=Story)
-def mark_publish_transition(sender, instance: Story, **kwargs):
-    # For updates, determine if status is transitioning to 'published'
-    if instance.pk:
-        try:
-            previous = Story.objects.get(pk=instance.pk)
-            instance._status_changed_to_published = (
-                previous.status != 'published' and instance.status == 'published'
-            )
-        except Story.DoesNotExist:
-            instance._status_changed_to_published = instance.status == 'published'
-    else:
+def mark_publish_transition(sender, instance: Story, update_fields=None, **kwargs):
+    instance._status_changed_to_published = False
+    if instance.status != 'published':
+        return
+    if update_fields is not None and 'status' not in update_fields:
+        return
+    now = timezone.now()
+    if instance._state.adding:
         # On create, it's considered a publish if created directly as published
-        instance._status_changed_to_published = instance.status == 'published'
+        instance._status_changed_to_published = True
+        instance.published_at = now
+        return
+    # The previous status comes from the from_db snapshot, no extra SELECT per save
+    if instance.loaded_value('status') == 'published':
+        return
+    # Claim the transition with a conditional UPDATE: when two requests publish the
+    # same draft concurrently only one of them matches the row and notifies. Story.save()
+    # runs in a transaction, a failed save rolls the claim back with it
+    instance._status_changed_to_published = Story.objects.filter(pk=instance.pk).exclude(
+        status='published'
+    ).update(status='published', published_at=now) == 1
+    if instance._status_changed_to_published:
+        instance.published_at = now
 
 
 def _notify_followers_of_story_publish(story: Story) -> None:
-    author = story.author
-    follower_qs = Follower.objects.filter(followed=author).select_related('follower')
-    notifications = [
-        Notification(
-            recipient=relation.follower,
-            sender=author,
-            notif_type='story',
-            story=story,
-        )
-        for relation in follower_qs
-    ]
-    if notifications:
-        Notification.objects.bulk_create(notifications, ignore_conflicts=True)
+    # Only queue the fan-out here, `manage.py process_notification_jobs` inserts
+    # the notifications in batches outside of the request (see api/jobs.py)
+    enqueue_story_publish(story)
 
 
 @receiver(post_save, sender=Story)
-def create_notifications_on_story_publish(sender, instance: Story, created: bool, **kwargs):
-    # Notify when a story is created as published, or when an existing story transitions to published
+def send_story_published(sender, instance: Story, created: bool, **kwargs):
+    # Fire when a story is created as published, or when an existing story transitions to published
     if getattr(instance, '_status_changed_to_published', False):
-        _notify_followers_of_story_publish(instance)
+        instance._status_changed_to_published = False
+        story_published.send(sender=Story, story=instance)
+
+
+@receiver(story_published)
+def create_notifications_on_story_publish(sender, story: Story, **kwargs):
+    _notify_followers_of_story_publish(story)
+
+
+@receiver(story_published)
+def add_story_to_follower_timelines(sender, story: Story, **kwargs):
+    # fan-out on write into the followers' feeds, done by the outbox worker as well
+    enqueue_timeline_fanout(story)
 
 
 @receiver(post_save, sender=Like)
@@ -53,12 +75,7 @@ def create_notification_on_like(sender, instance: Like, created: bool, **kwargs)
     recipient = story.author
     if recipient == sender_user:
         return
-    Notification.objects.create(
-        recipient=recipient,
-        sender=sender_user,
-        notif_type='like',
-        story=story,
-    )
+    notify(recipient.pk, sender_user.pk, 'like', story.pk)
 
 
 @receiver(post_save, sender=Comment)
@@ -70,11 +87,274 @@ def create_notification_on_comment(sender, instance: Comment, created: bool, **k
     recipient = story.author
     if recipient == sender_user:
         return
-    Notification.objects.create(
-        recipient=recipient,
-        sender=sender_user,
-        notif_type='comment',
-        story=story,
-        comment=instance,
-    )
+    notify(recipient.pk, sender_user.pk, 'comment', story.pk, comment_id=instance.pk)
+
+
+# Unread notification badge, bulk paths and the API read flag adjust it themselves
+# (api/inbox.py, api/jobs.py)
+@receiver(post_save, sender=Notification)
+def update_unread_count_on_notification_save(sender, instance: Notification, created: bool, **kwargs):
+    if created:
+        delta = 0 if instance.is_read else 1
+    else:
+        was_read = instance.loaded_value('is_read')
+        if was_read is None or was_read == instance.is_read:
+            return
+        delta = 1 if was_read else -1
+    adjust_counter(Author, instance.recipient_id, 'unread_notification_count', delta)
+
+
+@receiver(post_save, sender=Notification)
+def stream_new_notification(sender, instance: Notification, created: bool, **kwargs):
+    if created:
+        publish_after_commit([(instance.recipient_id, notification_event(
+            instance.pk, instance.notif_type, instance.sender_id, instance.story_id, instance.comment_id,
+            instance.created_at, instance.actor_count,
+        ))])
+
+
+@receiver(post_delete, sender=Notification)
+def update_unread_count_on_notification_delete(sender, instance: Notification, **kwargs):
+    if not instance.is_read:
+        adjust_counter(Author, instance.recipient_id, 'unread_notification_count', -1)
+
+
+# Denormalized counters: one atomic UPDATE ... SET x = x + 1 per event
+@receiver(post_save, sender=Like)
+def increment_like_count(sender, instance: Like, created: bool, **kwargs):
+    if created:
+        adjust_counter(Story, instance.story_id, 'like_count', 1)
+
+
+@receiver(post_delete, sender=Like)
+def decrement_like_count(sender, instance: Like, **kwargs):
+    adjust_counter(Story, instance.story_id, 'like_count', -1)
+
+
+@receiver(post_save, sender=Comment)
+def increment_comment_count(sender, instance: Comment, created: bool, **kwargs):
+    if created:
+        adjust_counter(Story, instance.story_id, 'comment_count', 1)
+
+
+@receiver(post_delete, sender=Comment)
+def decrement_comment_count(sender, instance: Comment, **kwargs):
+    adjust_counter(Story, instance.story_id, 'comment_count', -1)
+
+
+@receiver(post_save, sender=Follower)
+def increment_follow_counts(sender, instance: Follower, created: bool, **kwargs):
+    if created:
+        adjust_counter(Author, instance.followed_id, 'follower_count', 1)
+        adjust_counter(Author, instance.follower_id, 'following_count', 1)
+
+
+@receiver(post_delete, sender=Follower)
+def decrement_follow_counts(sender, instance: Follower, **kwargs):
+    adjust_counter(Author, instance.followed_id, 'follower_count', -1)
+    adjust_counter(Author, instance.follower_id, 'following_count', -1)
+
+
+# Tag.story_count counts published stories: tagging moves it only for a published
+# story, publishing and unpublishing move it for every tag of the story. post_add
+# only reports the rows actually inserted, removals are counted from the rows that
+# exist before the DELETE (same transaction). Autocomplete shows the counts.
+def _adjust_tag_counts(tag_ids, delta):
+    if adjust_counter(Tag, list(tag_ids), 'story_count', delta):
+        invalidate('tags')
+
+
+def _tag_ids_of(story_id):
+    return StoryTag.objects.filter(story_id=story_id).values_list('tag_id', flat=True)
+
+
+@receiver(m2m_changed, sender=Story.tags.through)
+def update_tag_story_counts(sender, instance, action, reverse, pk_set, **kwargs):
+    if not reverse and instance.status != 'published':
+        return
+    if action == 'post_add':
+        if reverse:
+            added = Story.objects.filter(pk__in=pk_set, status='published').count()
+            _adjust_tag_counts([instance.pk], added)
+        else:
+            _adjust_tag_counts(pk_set, 1)
+    elif action == 'pre_remove':
+        if reverse:
+            removed = StoryTag.objects.filter(tag_id=instance.pk, story_id__in=pk_set,
+                                              story__status='published').count()
+            _adjust_tag_counts([instance.pk], -removed)
+        else:
+            _adjust_tag_counts(
+                StoryTag.objects.filter(story_id=instance.pk, tag_id__in=pk_set).values_list('tag_id', flat=True), -1,
+            )
+    elif action == 'pre_clear':
+        if reverse:
+            if Tag.objects.filter(pk=instance.pk).update(story_count=0):
+                invalidate('tags')
+        else:
+            _adjust_tag_counts(_tag_ids_of(instance.pk), -1)
+
+
+@receiver(story_published)
+def increment_tag_story_counts_on_publish(sender, story: Story, **kwargs):
+    # a story created as published has no tags yet, they are counted by post_add
+    _adjust_tag_counts(_tag_ids_of(story.pk), 1)
+
+
+@receiver(post_save, sender=Story)
+def decrement_tag_story_counts_on_unpublish(sender, instance: Story, created: bool, update_fields=None, **kwargs):
+    if created or (update_fields is not None and 'status' not in update_fields):
+        return
+    if instance.loaded_value('status') == 'published' and instance.status != 'published':
+        _adjust_tag_counts(_tag_ids_of(instance.pk), -1)
+
+
+@receiver(pre_delete, sender=Story)
+def decrement_tag_story_counts(sender, instance: Story, **kwargs):
+    # the join rows go with the story through the cascade, which sends no m2m_changed
+    if instance.status == 'published':
+        _adjust_tag_counts(_tag_ids_of(instance.pk), -1)
+
+
+# Home feed timelines follow the follow graph
+@receiver(post_save, sender=Follower)
+def backfill_timeline_on_follow(sender, instance: Follower, created: bool, **kwargs):
+    if created:
+        backfill_timeline(instance.follower_id, instance.followed_id)
+
+
+@receiver(post_delete, sender=Follower)
+def clear_timeline_on_unfollow(sender, instance: Follower, **kwargs):
+    drop_from_timeline(instance.follower_id, instance.followed_id)
+
+
+@receiver(post_save, sender=Story)
+def clear_timelines_on_unpublish(sender, instance: Story, created: bool, update_fields=None, **kwargs):
+    if created or (update_fields is not None and 'status' not in update_fields):
+        return
+    if instance.loaded_value('status') == 'published' and instance.status != 'published':
+        drop_story(instance.pk)
+
+
+# Full-text search vector (api/search.py), rebuilt only for stories whose text changed
+@receiver(post_save, sender=Story)
+def update_story_search_vector(sender, instance: Story, created: bool, update_fields=None, **kwargs):
+    if update_fields is not None and not {'title', 'content'} & set(update_fields):
+        return
+    if created or any(
+        instance.loaded_value(name) != getattr(instance, name) for name in ('title', 'content')
+    ):
+        update_search_vector([instance.pk])
+
+
+@receiver(m2m_changed, sender=Story.tags.through)
+def update_search_vector_on_tags_change(sender, instance, action, reverse, pk_set, **kwargs):
+    if action == 'pre_clear' and reverse:
+        # tag.stories.clear(): remember the stories before the rows are gone
+        instance._cleared_story_ids = list(instance.stories.values_list('pk', flat=True))
+    elif action in ('post_add', 'post_remove'):
+        update_search_vector(pk_set if reverse else [instance.pk])
+    elif action == 'post_clear':
+        update_search_vector(getattr(instance, '_cleared_story_ids', []) if reverse else [instance.pk])
+
+
+@receiver(post_save, sender=Tag)
+def update_search_vector_on_tag_rename(sender, instance: Tag, created: bool, **kwargs):
+    if not created:
+        update_search_vector(Story.objects.filter(tags=instance))
+
+
+# Responsive image derivatives (api/images.py), queued when a new image is saved
+def _image_changed(instance, field_name, created, update_fields):
+    if update_fields is not None and field_name not in update_fields:
+        return False
+    if field_name not in instance.__dict__:
+        # deferred, so not assigned either
+        return False
+    name = getattr(instance, field_name).name or ''
+    if created:
+        return bool(name)
+    return (instance.loaded_value(field_name) or '') != name
+
+
+@receiver(post_save, sender=Story)
+def queue_cover_image_derivatives(sender, instance: Story, created: bool, update_fields=None, **kwargs):
+    if _image_changed(instance, 'cover_image', created, update_fields):
+        queue_derivatives(instance, 'cover_image')
+
+
+@receiver(post_save, sender=Author)
+def queue_profile_image_derivatives(sender, instance: Author, created: bool, update_fields=None, **kwargs):
+    if _image_changed(instance, 'profile_image', created, update_fields):
+        queue_derivatives(instance, 'profile_image')
+
+
+@receiver(post_delete, sender=Story)
+def discard_cover_image_derivatives(sender, instance: Story, **kwargs):
+    queue_discard(instance, 'cover_image')
+
+
+@receiver(post_delete, sender=Author)
+def discard_profile_image_derivatives(sender, instance: Author, **kwargs):
+    queue_discard(instance, 'profile_image')
+
+
+# Response cache (api/cache.py): bump the versions of whatever the change shows up in
+@receiver(post_save, sender=Story)
+@receiver(post_delete, sender=Story)
+def invalidate_story_cache(sender, instance: Story, **kwargs):
+    invalidate(f'story:{instance.pk}', 'stories')
+    invalidate_authors(instance.author_id)
+
+
+@receiver(story_published)
+def invalidate_story_cache_on_publish(sender, story: Story, **kwargs):
+    # Story.publish() is a queryset UPDATE, no post_save
+    invalidate(f'story:{story.pk}', 'stories')
+    invalidate_authors(story.author_id)
+
+
+@receiver(m2m_changed, sender=Story.tags.through)
+def invalidate_story_cache_on_tags_change(sender, instance, action, reverse, pk_set, **kwargs):
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+    story_ids = (pk_set or getattr(instance, '_cleared_story_ids', [])) if reverse else [instance.pk]
+    invalidate(*[f'story:{story_id}' for story_id in story_ids], 'stories')
+
+
+# detail and list pages show the counters
+@receiver(post_save, sender=Like)
+@receiver(post_delete, sender=Like)
+@receiver(post_save, sender=Comment)
+@receiver(post_delete, sender=Comment)
+def invalidate_story_counts_cache(sender, instance, **kwargs):
+    invalidate(f'story:{instance.story_id}', f'story-counts:{instance.story_id}', 'stories')
+
+
+@receiver(post_save, sender=Tag)
+@receiver(post_delete, sender=Tag)
+def invalidate_tag_cache(sender, instance: Tag, **kwargs):
+    invalidate('tags')
+
+
+# profile pages (api/profiles.py) show both counters of a follow
+@receiver(post_save, sender=Follower)
+@receiver(post_delete, sender=Follower)
+def invalidate_profile_cache_on_follow(sender, instance: Follower, **kwargs):
+    invalidate_authors(instance.followed_id, instance.follower_id)
+
+
+@receiver(post_save, sender=Author)
+def invalidate_profile_cache(sender, instance: Author, created: bool, **kwargs):
+    if created:
+        return
+    old_username = instance.loaded_value('username')
+    if old_username is not None and old_username != instance.username:
+        forget_author_id(old_username)
+    invalidate_authors(instance.pk)
+
 
+@receiver(post_delete, sender=Author)
+def invalidate_profile_cache_on_delete(sender, instance: Author, **kwargs):
+    forget_author_id(instance.username)
+    invalidate_authors(instance.pk)
@@ -0,0 +1,46 @@
+"""
+Content-addressed file storage.
+
+Uploads are stored as `<upload_to>/<sha256 of the bytes><extension>`: the same
+picture uploaded twice (by the same or another author) is written once and both
+rows point at it. The name doubles as a strong validator, the media view uses
+the hash as ETag and lets clients cache such files forever.
+"""
+import hashlib
+import os
+import posixpath
+import re
+
+from django.core.files.storage import FileSystemStorage
+
+HASHED_NAME = re.compile(r'^[0-9a-f]{64}$')
+
+
+def content_hash(content):
+    """SHA-256 hex digest of a Django File, read in chunks and rewound afterwards."""
+    digest = hashlib.sha256()
+    if hasattr(content, 'seek'):
+        content.seek(0)
+    for chunk in content.chunks():
+        digest.update(chunk)
+    if hasattr(content, 'seek'):
+        content.seek(0)
+    return digest.hexdigest()
+
+
+def hash_of_name(name):
+    """The content hash a stored name carries, or None for names from before this storage."""
+    stem = os.path.splitext(posixpath.basename(name))[0]
+    return stem if HASHED_NAME.match(stem) else None
+
+
+class ContentAddressedStorage(FileSystemStorage):
+    def _save(self, name, content):
+        # only the directory and extension of the proposed name are kept
+        directory = posixpath.dirname(name)
+        extension = os.path.splitext(name)[1].lower()
+        name = posixpath.join(directory, f'{content_hash(content)}{extension}')
+        if self.exists(name):
+            return name
+        # a concurrent upload of the same bytes makes the parent pick a suffixed name, a harmless copy
+        return super()._save(name, content)
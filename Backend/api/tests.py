@@ -1,3 +1,590 @@
-from django.test import TestCase
+from django.test import TestCase, TransactionTestCase
+from rest_framework.test import APITestCase
 
-# Create your tests here.
+from .models import Author, Story, Tag
+
+
+class StoryTagsTests(APITestCase):
+    def setUp(self):
+        self.author = Author.objects.create_user('alice', 'alice@example.com', 'pw')
+        self.client.force_authenticate(self.author)
+        self.poetry = Tag.objects.create(name='Poetry', slug='poetry')
+        self.essays = Tag.objects.create(name='Essays', slug='essays')
+
+    def test_story_created_with_tags_keeps_them(self):
+        response = self.client.post('/api/stories/', {
+            'title': 'Tagged', 'content': 'a few words', 'tags': [self.poetry.pk, self.essays.pk],
+            'status': 'published',
+        }, format='json')
+        self.assertEqual(response.status_code, 201, response.data)
+        story = Story.objects.get(pk=response.data['id'])
+        self.assertCountEqual(story.tags.values_list('slug', flat=True), ['poetry', 'essays'])
+        self.poetry.refresh_from_db()
+        self.assertEqual(self.poetry.story_count, 1)
+
+    def test_update_replaces_tags_and_omitting_them_keeps_them(self):
+        story = Story.objects.create(title='Tagged', content='words', author=self.author)
+        story.tags.add(self.poetry)
+        response = self.client.patch(f'/api/stories/{story.pk}/', {'tags': [self.essays.pk]}, format='json')
+        self.assertEqual(response.status_code, 200, response.data)
+        self.assertEqual(list(story.tags.values_list('slug', flat=True)), ['essays'])
+        response = self.client.patch(f'/api/stories/{story.pk}/', {'title': 'Renamed'}, format='json')
+        self.assertEqual(response.status_code, 200, response.data)
+        self.assertEqual(list(story.tags.values_list('slug', flat=True)), ['essays'])
+
+
+    def test_story_count_follows_the_published_stories(self):
+        story = Story.objects.create(title='Draft', content='words', author=self.author)
+        story.tags.add(self.poetry)
+        self.poetry.refresh_from_db()
+        self.assertEqual(self.poetry.story_count, 0)
+        story.publish()
+        self.poetry.refresh_from_db()
+        self.assertEqual(self.poetry.story_count, 1)
+        story.tags.add(self.essays)
+        story.status = 'archived'
+        story.save()
+        self.poetry.refresh_from_db()
+        self.essays.refresh_from_db()
+        self.assertEqual((self.poetry.story_count, self.essays.story_count), (0, 0))
+        story.status = 'published'
+        story.save()
+        story.delete()
+        self.poetry.refresh_from_db()
+        self.assertEqual(self.poetry.story_count, 0)
+
+    def test_autocomplete_sees_new_counts(self):
+        self.client.force_authenticate(None)
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.get('/api/tags/autocomplete/?q=po&limit=0')
+        self.assertEqual([tag['story_count'] for tag in response.data['results']], [0])
+        with self.captureOnCommitCallbacks(execute=True):
+            Story.objects.create(title='Poem', content='words', author=self.author, status='published').tags.add(
+                self.poetry)
+        response = self.client.get('/api/tags/autocomplete/?q=po')
+        self.assertEqual([tag['story_count'] for tag in response.data['results']], [1])
+
+class ClaimsAuthenticationTests(APITestCase):
+    def setUp(self):
+        self.author = Author.objects.create_user('alice', 'alice@example.com', 'pw')
+
+    def _access_token(self, user_id, is_staff=False):
+        from .authentication import BlogRefreshToken
+        token = BlogRefreshToken()
+        token['user_id'] = user_id
+        token['username'] = 'ghost'
+        token['is_staff'] = is_staff
+        return str(token.access_token)
+
+    def _login(self):
+        return self.client.post('/api/token/', {'username': 'alice', 'password': 'pw'}, format='json').data
+
+    def test_read_is_served_from_the_claims(self):
+        self.client.credentials(HTTP_AUTHORIZATION=f"Bearer {self._login()['access']}")
+        with self.assertNumQueries(1):
+            # the story list only, no user row
+            self.assertEqual(self.client.get('/api/stories/').status_code, 200)
+
+    def test_staff_claim_of_a_missing_user_grants_nothing(self):
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {self._access_token(999, is_staff=True)}')
+        response = self.client.post('/api/tags/', {'name': 'Poetry', 'slug': 'poetry'}, format='json')
+        self.assertEqual(response.status_code, 401)
+
+    def test_writes_of_a_deactivated_user_are_refused(self):
+        self.client.credentials(HTTP_AUTHORIZATION=f"Bearer {self._login()['access']}")
+        Author.objects.filter(pk=self.author.pk).update(is_active=False)
+        response = self.client.post('/api/stories/', {'title': 'Late', 'content': 'words'}, format='json')
+        self.assertEqual(response.status_code, 401)
+        self.assertFalse(Story.objects.exists())
+
+    def test_demoted_user_loses_admin_writes(self):
+        Author.objects.filter(pk=self.author.pk).update(is_staff=True)
+        tokens = self._login()
+        Author.objects.filter(pk=self.author.pk).update(is_staff=False)
+        self.client.credentials(HTTP_AUTHORIZATION=f"Bearer {tokens['access']}")
+        response = self.client.post('/api/tags/', {'name': 'Poetry', 'slug': 'poetry'}, format='json')
+        self.assertEqual(response.status_code, 403)
+
+    def test_refresh_rereads_the_user(self):
+        refresh = self._login()['refresh']
+        Author.objects.filter(pk=self.author.pk).update(is_active=False)
+        response = self.client.post('/api/token/refresh/', {'refresh': refresh}, format='json')
+        self.assertEqual(response.status_code, 401)
+
+
+class FeedTests(APITestCase):
+    def setUp(self):
+        from .models import Follower
+        self.author = Author.objects.create_user('alice', 'alice@example.com', 'pw')
+        self.reader = Author.objects.create_user('bob', 'bob@example.com', 'pw')
+        Follower.objects.create(follower=self.reader, followed=self.author)
+        self.client.force_authenticate(self.reader)
+
+    def _feed_titles(self):
+        response = self.client.get('/api/feed/')
+        self.assertEqual(response.status_code, 200)
+        return [story['title'] for story in response.data['results']]
+
+    def test_unpublished_story_leaves_the_feed(self):
+        from .models import TimelineEntry
+        story = Story.objects.create(title='Visible', content='words', author=self.author, status='published')
+        TimelineEntry.objects.create(user=self.reader, story=story, author=self.author, published_at=story.published_at)
+        self.assertEqual(self._feed_titles(), ['Visible'])
+        story.status = 'archived'
+        story.save()
+        self.assertFalse(TimelineEntry.objects.filter(story=story).exists())
+        self.assertEqual(self._feed_titles(), [])
+
+    def test_feed_skips_unpublished_rows_not_dropped_yet(self):
+        from .models import TimelineEntry
+        story = Story.objects.create(title='Draft', content='words', author=self.author, status='published')
+        TimelineEntry.objects.create(user=self.reader, story=story, author=self.author, published_at=story.published_at)
+        Story.objects.filter(pk=story.pk).update(status='draft')
+        self.assertEqual(self._feed_titles(), [])
+
+
+class CoalescedNotificationTests(TestCase):
+    def setUp(self):
+        from . import inbox
+        self._window = inbox.COALESCE_WINDOW
+        inbox.COALESCE_WINDOW = 3600
+        self.author = Author.objects.create_user('alice', 'alice@example.com', 'pw')
+        self.story = Story.objects.create(title='Story', content='words', author=self.author, status='published')
+
+    def tearDown(self):
+        from . import inbox
+        inbox.COALESCE_WINDOW = self._window
+
+    def test_deleting_the_latest_comment_keeps_the_coalesced_row(self):
+        from .models import Comment, Notification
+        for name in ('bob', 'carol'):
+            commenter = Author.objects.create_user(name, f'{name}@example.com', 'pw')
+            comment = Comment.objects.create(story=self.story, author=commenter, content='hi')
+        notification = Notification.objects.get(recipient=self.author, notif_type='comment')
+        self.assertEqual((notification.actor_count, notification.comment_id), (2, comment.pk))
+        comment.delete()
+        notification.refresh_from_db()
+        self.assertEqual((notification.actor_count, notification.comment_id), (2, None))
+        self.author.refresh_from_db()
+        self.assertEqual(self.author.unread_notification_count, 1)
+
+
+    def test_repeat_actors_are_counted_once(self):
+        from datetime import timedelta
+        from django.utils import timezone
+        from . import inbox
+        from .models import Notification
+        fans = [Author.objects.create_user(name, f'{name}@example.com', 'pw') for name in 'bcdef']
+        for fan in [*fans, fans[0], fans[1]]:
+            inbox.notify(self.author.pk, fan.pk, 'like', self.story.pk)
+        notification = Notification.objects.get(recipient=self.author)
+        self.assertEqual(notification.actor_count, 5)
+
+        # a later notification from someone already counted, collapsed with it once read
+        notification.is_read = True
+        notification.save()
+        later = Notification.objects.create(recipient=self.author, sender=fans[0], notif_type='like',
+                                            story=self.story, is_read=True)
+        Notification.objects.filter(pk=later.pk).update(bucket=timezone.now())
+        inbox.compact_read_notifications(self.author.pk, self.author.pk, timezone.now() + timedelta(days=1))
+        self.assertEqual(Notification.objects.get(recipient=self.author).actor_count, 5)
+
+class TrendingLimitTests(APITestCase):
+    def test_limit_is_validated_and_clamped(self):
+        self.assertEqual(self.client.get('/api/stories/trending/?limit=abc').status_code, 400)
+        self.assertEqual(self.client.get('/api/stories/trending/?limit=-5').status_code, 200)
+        self.assertEqual(self.client.get('/api/stories/trending/?limit=0').status_code, 200)
+
+
+class AuthorProfileCacheTests(APITestCase):
+    def test_deleted_author_is_not_served_and_the_username_can_be_reused(self):
+        author = Author.objects.create_user('alice', 'alice@example.com', 'pw')
+        self.assertEqual(self.client.get('/api/authors/alice/').data['id'], author.pk)
+        with self.captureOnCommitCallbacks(execute=True):
+            author.delete()
+        self.assertEqual(self.client.get('/api/authors/alice/').status_code, 404)
+        newcomer = Author.objects.create_user('alice', 'alice2@example.com', 'pw')
+        self.assertEqual(self.client.get('/api/authors/alice/').data['id'], newcomer.pk)
+
+
+class BloomFilterTests(TestCase):
+    def test_no_false_negatives_and_few_false_positives(self):
+        from .revocation import BloomFilter
+        bloom = BloomFilter(capacity=1000, error_rate=0.01)
+        added = [f'jti-{n}' for n in range(1000)]
+        for key in added:
+            bloom.add(key)
+        self.assertTrue(all(key in bloom for key in added))
+        false_positives = sum(f'other-{n}' in bloom for n in range(10000))
+        self.assertLess(false_positives, 300)
+
+
+class RevocationTests(APITestCase):
+    def setUp(self):
+        from . import revocation
+        self.revocation = revocation
+        self.filter = revocation.RevocationFilter()
+        self._filter, revocation._filter = revocation._filter, self.filter
+
+    def tearDown(self):
+        self.revocation._filter = self._filter
+
+    def test_second_revoke_returns_false(self):
+        self.assertTrue(self.revocation.revoke('jti-1', 2_000_000_000))
+        self.assertFalse(self.revocation.revoke('jti-1', 2_000_000_000))
+
+    def test_cold_filter_answers_from_the_index_without_scanning(self):
+        from unittest import mock
+        self.revocation.revoke('jti-1', 2_000_000_000)
+        with mock.patch('threading.Thread') as thread:
+            self.assertTrue(self.revocation.is_revoked('jti-1'))
+            self.assertFalse(self.revocation.is_revoked('jti-2'))
+        # one background rebuild started, the checks did not wait for it
+        self.assertEqual(thread.return_value.start.call_count, 1)
+
+    def test_built_filter_skips_the_query_for_unknown_tokens(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.revocation.revoke('jti-1', 2_000_000_000)
+        self.filter.rebuild()
+        with self.assertNumQueries(0):
+            self.assertFalse(self.revocation.is_revoked('jti-2'))
+        self.assertTrue(self.revocation.is_revoked('jti-1'))
+
+    def test_revocations_during_a_rebuild_reach_the_new_filter(self):
+        self.filter._rebuilding = True
+        self.filter.add('jti-late')
+        self.filter.rebuild()
+        self.assertTrue(self.filter.might_contain('jti-late'))
+
+    def test_reused_refresh_token_is_refused(self):
+        Author.objects.create_user('alice', 'alice@example.com', 'pw')
+        refresh = self.client.post('/api/token/', {'username': 'alice', 'password': 'pw'}, format='json').data['refresh']
+        self.assertEqual(self.client.post('/api/token/refresh/', {'refresh': refresh}, format='json').status_code, 200)
+        self.assertEqual(self.client.post('/api/token/refresh/', {'refresh': refresh}, format='json').status_code, 401)
+
+
+class ByteRangeTests(TestCase):
+    def byte_range(self, header, size=1000):
+        from .views import _byte_range
+        return _byte_range(header, size)
+
+    def test_bounded_range(self):
+        self.assertEqual(self.byte_range('bytes=0-99'), (0, 99))
+        self.assertEqual(self.byte_range('bytes=900-5000'), (900, 999))
+
+    def test_open_ended_range(self):
+        self.assertEqual(self.byte_range('bytes=100-'), (100, 999))
+
+    def test_suffix_range(self):
+        self.assertEqual(self.byte_range('bytes=-100'), (900, 999))
+        self.assertEqual(self.byte_range('bytes=-5000'), (0, 999))
+
+    def test_reversed_or_malformed_range_sends_the_whole_file(self):
+        self.assertIsNone(self.byte_range('bytes=500-100'))
+        self.assertIsNone(self.byte_range('bytes=-'))
+        self.assertIsNone(self.byte_range('items=0-10'))
+        self.assertIsNone(self.byte_range('bytes=0-10,20-30'))
+
+    def test_unsatisfiable_range(self):
+        with self.assertRaises(ValueError):
+            self.byte_range('bytes=1000-')
+        with self.assertRaises(ValueError):
+            self.byte_range('bytes=-0')
+
+    def test_any_range_of_an_empty_file_is_unsatisfiable(self):
+        for header in ('bytes=-10', 'bytes=0-', 'bytes=0-0'):
+            with self.assertRaises(ValueError):
+                self.byte_range(header, size=0)
+
+
+class ImageDerivativeCleanupTests(TestCase):
+    def setUp(self):
+        import tempfile
+        from django.test import override_settings
+        media = override_settings(MEDIA_ROOT=tempfile.mkdtemp())
+        media.enable()
+        self.addCleanup(media.disable)
+        from .images import shutdown_pool
+        self.addCleanup(shutdown_pool)
+        self.author = Author.objects.create_user('alice', 'alice@example.com', 'pw')
+
+    def _jpeg(self, color):
+        import io
+        from PIL import Image
+        output = io.BytesIO()
+        Image.new('RGB', (400, 300), color).save(output, 'JPEG')
+        return output.getvalue()
+
+    def _run_jobs(self):
+        from .jobs import claim_jobs, run_job
+        for job in claim_jobs():
+            run_job(job)
+
+    def _cover(self, story, color):
+        from django.core.files.base import ContentFile
+        story.cover_image.save('cover.jpg', ContentFile(self._jpeg(color)))
+        self._run_jobs()
+        story.refresh_from_db()
+        return [variant['name'] for variant in story.cover_image_variants]
+
+    def test_replaced_and_deleted_covers_leave_no_unused_copies(self):
+        from django.core.files.storage import default_storage
+        story = Story.objects.create(title='One', content='words', author=self.author)
+        twin = Story.objects.create(title='Two', content='words', author=self.author)
+        red = self._cover(story, 'red')
+        self.assertEqual(self._cover(twin, 'red'), red)
+        blue = self._cover(story, 'blue')
+        # still used by the twin
+        self.assertTrue(all(default_storage.exists(name) for name in red))
+        self._cover(twin, 'green')
+        self.assertFalse(any(default_storage.exists(name) for name in red))
+        story.delete()
+        self._run_jobs()
+        self.assertFalse(any(default_storage.exists(name) for name in blue))
+
+
+class ImageDerivativeLockTests(TransactionTestCase):
+    def test_discard_waits_for_a_render_reusing_the_file(self):
+        import threading
+        from unittest import mock
+        from django.db import connection, transaction
+        from . import images
+        story = Story.objects.create(title='One', content='words',
+                                     author=Author.objects.create_user('alice', 'alice@example.com', 'pw'))
+        name = 'covers/derived/shared.webp'
+        locked, release = threading.Event(), threading.Event()
+
+        def render():
+            # what _render() does between storing the file and recording it
+            with transaction.atomic():
+                images._lock_names([name])
+                locked.set()
+                release.wait(10)
+                Story.objects.filter(pk=story.pk).update(
+                    cover_image_variants=[{'name': name, 'width': 320, 'format': 'webp'}],
+                )
+            connection.close()
+
+        thread = threading.Thread(target=render)
+        thread.start()
+        self.assertTrue(locked.wait(10))
+        threading.Timer(0.2, release.set).start()
+        with mock.patch.object(images.default_storage, 'delete') as delete:
+            self.assertEqual(images.discard_unreferenced(Story, 'cover_image', [name]), 0)
+        thread.join()
+        delete.assert_not_called()
+
+
+class NonNumericIdTests(APITestCase):
+    def setUp(self):
+        self.client.force_authenticate(Author.objects.create_user('alice', 'alice@example.com', 'pw'))
+
+    def test_non_numeric_ids_are_not_found(self):
+        self.assertEqual(self.client.put('/api/follower/user/abc/follow/').status_code, 404)
+        self.assertEqual(self.client.put('/api/stories/abc/like/').status_code, 404)
+        self.assertEqual(self.client.get('/api/stories/abc/').status_code, 404)
+        self.assertEqual(self.client.get('/api/follower/user/abc/followers/count/').status_code, 404)
+        self.assertEqual(self.client.get('/api/comments/story/abc/count/').status_code, 404)
+        self.assertEqual(self.client.get('/api/likes/story/abc/').status_code, 404)
+        self.assertEqual(self.client.get('/api/library-story/library/abc/get-all-stories/').status_code, 404)
+        self.assertEqual(self.client.post('/api/library-story/library/abc/bulk/').status_code, 404)
+
+
+class QueryPlanTests(TestCase):
+    def test_hot_queries_are_served_by_their_indexes(self):
+        from .management.commands.check_query_plans import explain_hot_queries
+        for label, problems, _ in explain_hot_queries(seed_count=2000):
+            with self.subTest(label):
+                self.assertEqual(problems, [])
+
+    def test_missing_index_is_reported(self):
+        from django.db import connection
+        from .management.commands.check_query_plans import explain_hot_queries
+        with connection.cursor() as cursor:
+            cursor.execute('DROP INDEX notif_recipient_unread_idx')
+        results = {label: problems for label, problems, _ in explain_hot_queries(seed_count=200)}
+        self.assertEqual(results['notifications: unread'], ['notif_recipient_unread_idx is not used'])
+
+
+class KeysetPaginationTests(APITestCase):
+    def test_pages_follow_each_other_without_gaps(self):
+        author = Author.objects.create_user('alice', 'alice@example.com', 'pw')
+        for i in range(5):
+            Story.objects.create(title=f'Story {i}', content='words', author=author)
+        seen, url = [], '/api/stories/?page_size=2'
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200, response.data)
+            seen += [story['id'] for story in response.data['results']]
+            url = response.data['next']
+        self.assertEqual(seen, list(Story.objects.order_by('-created_at', '-id').values_list('pk', flat=True)))
+
+
+class PublishTransitionTests(TestCase):
+    def test_failed_save_rolls_back_the_publish_claim(self):
+        from django.db import DataError
+        from .models import NotificationJob
+        author = Author.objects.create_user('alice', 'alice@example.com', 'pw')
+        story = Story.objects.create(title='Draft', content='words', author=author)
+        story.status = 'published'
+        story.title = 'x' * 300
+        with self.assertRaises(DataError):
+            story.save()
+        story.refresh_from_db()
+        self.assertEqual(story.status, 'draft')
+        self.assertIsNone(story.published_at)
+
+        story.status = 'published'
+        story.save()
+        self.assertTrue(NotificationJob.objects.filter(story=story).exists())
+
+
+class InboxUpkeepTests(APITestCase):
+    def setUp(self):
+        from datetime import timedelta
+        from django.utils import timezone
+        from .models import Notification
+        self.author = Author.objects.create_user('alice', 'alice@example.com', 'pw')
+        self.story = Story.objects.create(title='Story', content='words', author=self.author, status='published')
+        fans = [Author.objects.create_user(name, f'{name}@example.com', 'pw') for name in ('bob', 'carol', 'dave')]
+        self.old = timezone.now() - timedelta(days=400)
+        self.notifications = [
+            Notification.objects.create(recipient=self.author, sender=fan, notif_type='like',
+                                        story=self.story, is_read=is_read)
+            for fan, is_read in zip(fans, (True, True, False))
+        ]
+        Notification.objects.filter(recipient=self.author).update(created_at=self.old)
+
+    def test_compaction_keeps_the_newest_read_row_with_the_total(self):
+        from datetime import timedelta
+        from . import inbox
+        from .models import Notification
+        removed = inbox.compact_read_notifications(self.author.pk, self.author.pk, self.old + timedelta(days=1))
+        self.assertEqual(removed, 1)
+        kept = Notification.objects.get(recipient=self.author, is_read=True)
+        self.assertEqual((kept.pk, kept.actor_count), (self.notifications[1].pk, 2))
+        self.assertTrue(Notification.objects.filter(pk=self.notifications[2].pk).exists())
+
+    def test_expired_unread_rows_give_their_badge_back(self):
+        from datetime import timedelta
+        from . import inbox
+        self.author.refresh_from_db()
+        self.assertEqual(self.author.unread_notification_count, 1)
+        self.assertEqual(inbox.delete_expired(self.old + timedelta(days=1), batch_size=2), 3)
+        self.author.refresh_from_db()
+        self.assertEqual(self.author.unread_notification_count, 0)
+
+    def test_marking_read_twice_moves_the_badge_once(self):
+        self.client.force_authenticate(self.author)
+        unread = self.notifications[2]
+        for _ in range(2):
+            response = self.client.patch(f'/api/notifications/{unread.pk}/', {'is_read': True}, format='json')
+            self.assertEqual(response.status_code, 200, response.data)
+            self.assertTrue(response.data['is_read'])
+        self.author.refresh_from_db()
+        self.assertEqual(self.author.unread_notification_count, 0)
+
+
+class BulkWriteTests(APITestCase):
+    def setUp(self):
+        self.author = Author.objects.create_user('alice', 'alice@example.com', 'pw')
+        self.fan = Author.objects.create_user('bob', 'bob@example.com', 'pw')
+        self.stories = [
+            Story.objects.create(title=f'Story {i}', content='words', author=self.author, status='published')
+            for i in range(2)
+        ]
+
+    def test_only_new_likes_move_the_counters(self):
+        from .bulk import like_stories
+        from .models import Like, Notification
+        Like.objects.create(story=self.stories[0], user=self.fan)
+        self.assertEqual(like_stories(self.fan.pk, [story.pk for story in self.stories]), 1)
+        self.assertEqual(like_stories(self.fan.pk, [story.pk for story in self.stories]), 0)
+        for story in self.stories:
+            story.refresh_from_db()
+            self.assertEqual(story.like_count, 1)
+        self.assertEqual(Notification.objects.filter(recipient=self.author, notif_type='like').count(), 2)
+
+    def test_follow_and_library_count_new_rows_only(self):
+        from .bulk import add_to_library, follow_authors
+        from .models import Library
+        self.assertEqual(follow_authors(self.fan.pk, [self.author.pk]), 1)
+        self.assertEqual(follow_authors(self.fan.pk, [self.author.pk]), 0)
+        self.author.refresh_from_db()
+        self.assertEqual(self.author.follower_count, 1)
+        library = Library.objects.create(user=self.fan, name='Saved')
+        self.assertEqual(add_to_library(library.pk, [self.stories[0].pk]), 1)
+        self.assertEqual(add_to_library(library.pk, [story.pk for story in self.stories]), 1)
+
+
+class NotificationStreamTests(APITestCase):
+    def setUp(self):
+        self.author = Author.objects.create_user('alice', 'alice@example.com', 'pw')
+
+    def test_stream_takes_a_ticket_not_the_access_token(self):
+        from .authentication import BlogRefreshToken
+        access = str(BlogRefreshToken.for_user(self.author).access_token)
+        self.assertEqual(self.client.get(f'/api/notifications/stream/?token={access}').status_code, 401)
+        self.assertEqual(self.client.get(f'/api/notifications/stream/?ticket={access}').status_code, 401)
+
+        self.client.force_authenticate(self.author)
+        response = self.client.post('/api/notifications/stream-ticket/')
+        self.assertEqual(response.status_code, 200, response.data)
+        self.client.force_authenticate(None)
+        response = self.client.get(f'/api/notifications/stream/?ticket={response.data["ticket"]}')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+
+    def test_expired_ticket_is_refused(self):
+        from unittest import mock
+        from . import authentication
+        ticket = authentication.stream_ticket(self.author.pk)
+        with mock.patch.object(authentication, 'STREAM_TICKET_MAX_AGE', -1):
+            self.assertEqual(self.client.get(f'/api/notifications/stream/?ticket={ticket}').status_code, 401)
+
+
+class PostgresBrokerTests(TransactionTestCase):
+    def test_notify_reaches_the_subscribers_of_another_connection(self):
+        import asyncio
+        from asgiref.sync import sync_to_async
+        from .broker import PostgresBroker
+
+        broker = PostgresBroker()
+
+        async def receive():
+            subscription = broker.subscribe(7)
+            self.assertTrue(await asyncio.to_thread(broker.listening.wait, 10))
+            # published from a thread with its own connection, like the job worker
+            await sync_to_async(broker.publish, thread_sensitive=False)(7, {'id': 1})
+            return await subscription.get(timeout=10)
+
+        try:
+            self.assertEqual(asyncio.run(receive()), {'id': 1})
+        finally:
+            broker.stop()
+
+
+class ResponseCacheTests(APITestCase):
+    def setUp(self):
+        self.author = Author.objects.create_user('alice', 'alice@example.com', 'pw')
+        self.story = Story.objects.create(title='Story', content='words', author=self.author, status='published')
+
+    def _like_count(self):
+        response = self.client.get('/api/stories/')
+        return next(story['like_count'] for story in response.data['results'] if story['id'] == self.story.pk)
+
+    def test_list_pages_show_new_likes(self):
+        from .toggles import set_like
+        self.assertEqual(self._like_count(), 0)
+        with self.captureOnCommitCallbacks(execute=True):
+            set_like(Author.objects.create_user('bob', 'bob@example.com', 'pw').pk, self.story, True)
+        self.assertEqual(self._like_count(), 1)
+
+    def test_process_local_cache_is_not_used_outside_debug(self):
+        from unittest import mock
+        from . import cache
+        with mock.patch.object(cache, 'ENABLED', False):
+            response = self.client.get('/api/stories/')
+            self.assertEqual(response.status_code, 200)
+            self.assertNotIn('ETag', response)
+            self.assertEqual([warning.id for warning in cache.check_shared_cache(None)], ['api.W001'])
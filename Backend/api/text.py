@@ -0,0 +1,41 @@
+import html
+import math
+import re
+
+WORDS_PER_MINUTE = 200
+EXCERPT_LENGTH = 280
+
+# a markup tag or a run of non-space characters
+_TOKEN_RE = re.compile(r'<[^>]*>|[^\s<]+')
+
+
+def reading_stats(content):
+    """
+    Word count, read time in minutes and a plain-text excerpt of `content`.
+
+    Single pass over the tokens of the text, no intermediate copies: markup tags
+    are skipped, every token with a letter or digit is a word and the excerpt
+    takes whole words until EXCERPT_LENGTH is reached.
+    """
+    word_count = 0
+    excerpt = []
+    excerpt_length = 0
+    excerpt_full = False
+    for match in _TOKEN_RE.finditer(content or ''):
+        token = match.group()
+        if token.startswith('<'):
+            continue
+        token = html.unescape(token)
+        if any(char.isalnum() for char in token):
+            word_count += 1
+        if not excerpt_full:
+            if excerpt_length + len(token) + len(excerpt) > EXCERPT_LENGTH:
+                excerpt_full = True
+            else:
+                excerpt.append(token)
+                excerpt_length += len(token)
+    read_time = math.ceil(word_count / WORDS_PER_MINUTE) if word_count else 0
+    excerpt = ' '.join(excerpt)
+    if excerpt_full:
+        excerpt += '…'
+    return word_count, read_time, excerpt
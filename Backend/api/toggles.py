@@ -0,0 +1,98 @@
+"""
+Idempotent like/follow toggles.
+
+PUT and DELETE on a like or follow run a single INSERT ... ON CONFLICT DO NOTHING
+or DELETE, both with RETURNING, so repeating a request never raises a duplicate
+key error and tells whether anything changed. Only an actual change moves the
+counter (UPDATE ... RETURNING gives the new value back) and does the work of the
+signal handlers in api/signals.py, which raw statements don't trigger.
+
+The lookups at the bottom answer the matching "did I like/save/follow" questions
+for a whole page at once.
+"""
+from django.db import connection, transaction
+from django.db.models import Exists, OuterRef
+from django.utils import timezone
+
+from .cache import invalidate
+from .counters import adjust_counter, adjust_counter_returning
+from .feed import backfill_timeline, drop_from_timeline
+from .inbox import notify
+from .models import Author, Follower, Like, LibraryStory, Story
+from .profiles import invalidate_authors
+
+
+def _execute_returning(sql, params):
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+        return cursor.fetchone() is not None
+
+
+def set_like(user_id, story, liked):
+    """Like (`liked=True`) or unlike `story`, returns `(liked, like_count)`."""
+    table = Like._meta.db_table
+    with transaction.atomic():
+        if liked:
+            changed = _execute_returning(
+                f'INSERT INTO {table} (story_id, user_id, created_at) VALUES (%s, %s, %s) '
+                f'ON CONFLICT (story_id, user_id) DO NOTHING RETURNING id',
+                [story.pk, user_id, timezone.now()],
+            )
+        else:
+            changed = _execute_returning(
+                f'DELETE FROM {table} WHERE story_id = %s AND user_id = %s RETURNING id',
+                [story.pk, user_id],
+            )
+        if not changed:
+            return liked, story.like_count
+        like_count = adjust_counter_returning(Story, story.pk, 'like_count', 1 if liked else -1)
+        if liked and story.author_id != user_id:
+            notify(story.author_id, user_id, 'like', story.pk)
+        invalidate(f'story:{story.pk}', f'story-counts:{story.pk}', 'stories')
+    return liked, like_count
+
+
+def set_follow(user_id, author, following):
+    """Follow (`following=True`) or unfollow `author`, returns `(following, follower_count)`."""
+    table = Follower._meta.db_table
+    with transaction.atomic():
+        if following:
+            changed = _execute_returning(
+                f'INSERT INTO {table} (follower_id, followed_id, followed_at) VALUES (%s, %s, %s) '
+                f'ON CONFLICT (follower_id, followed_id) DO NOTHING RETURNING id',
+                [user_id, author.pk, timezone.now()],
+            )
+        else:
+            changed = _execute_returning(
+                f'DELETE FROM {table} WHERE follower_id = %s AND followed_id = %s RETURNING id',
+                [user_id, author.pk],
+            )
+        if not changed:
+            return following, author.follower_count
+        delta = 1 if following else -1
+        follower_count = adjust_counter_returning(Author, author.pk, 'follower_count', delta)
+        adjust_counter(Author, user_id, 'following_count', delta)
+        invalidate_authors(author.pk, user_id)
+        if following:
+            backfill_timeline(user_id, author.pk)
+        else:
+            drop_from_timeline(user_id, author.pk)
+    return following, follower_count
+
+
+def liked_story_ids(user_id, story_ids):
+    """The ids among `story_ids` the user liked, one index lookup on (story, user)."""
+    return set(Like.objects.filter(user_id=user_id, story_id__in=story_ids).values_list('story_id', flat=True))
+
+
+def annotate_viewer_state(queryset, user_id):
+    """
+    Annotate stories with `liked_by_me`, `saved_in_my_library` and
+    `author_followed_by_me`: EXISTS subqueries on the unique (story, user),
+    library entry and (follower, followed) indexes, in the same statement.
+    """
+    return queryset.annotate(
+        liked_by_me=Exists(Like.objects.filter(story=OuterRef('pk'), user_id=user_id)),
+        saved_in_my_library=Exists(LibraryStory.objects.filter(story=OuterRef('pk'), library__user_id=user_id)),
+        author_followed_by_me=Exists(Follower.objects.filter(followed=OuterRef('author_id'), follower_id=user_id)),
+    )
@@ -0,0 +1,81 @@
+"""
+Trending stories.
+
+Scores use the Hacker News decay: `points / (age_in_hours + 2) ** GRAVITY`, with
+points from the stored like/comment counters. `manage.py refresh_trending` keeps
+the TOP_K best stories site-wide and per tag in TrendingScore. Each run only
+re-scores the stories already in the table and the ones liked or commented on
+since the previous run (two range scans on created_at), never the whole
+Like/Comment tables. `/api/stories/trending/` reads the table and nothing else.
+"""
+from collections import defaultdict
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from .cache import invalidate
+from .models import Comment, Like, Story, TrendingRun, TrendingScore
+
+GRAVITY = getattr(settings, 'TRENDING_GRAVITY', 1.8)
+COMMENT_WEIGHT = getattr(settings, 'TRENDING_COMMENT_WEIGHT', 2)
+TOP_K = getattr(settings, 'TRENDING_TOP_K', 100)
+MAX_AGE = timedelta(days=getattr(settings, 'TRENDING_MAX_AGE_DAYS', 7))
+
+
+def hn_score(like_count, comment_count, published_at, now):
+    points = like_count + COMMENT_WEIGHT * comment_count
+    age_hours = max((now - published_at).total_seconds() / 3600, 0)
+    return points / (age_hours + 2) ** GRAVITY
+
+
+def _active_story_ids(since):
+    return (
+        set(Like.objects.filter(created_at__gte=since).values_list('story_id', flat=True).distinct())
+        | set(Comment.objects.filter(created_at__gte=since).values_list('story_id', flat=True).distinct())
+    )
+
+
+def refresh(now=None):
+    """Re-score the candidates and rewrite the trending lists, returns the number of stories scored."""
+    now = now or timezone.now()
+    with transaction.atomic():
+        run = TrendingRun.objects.select_for_update().filter(pk=1).first()
+        # a minute of overlap catches likes committed just after the previous run read its input
+        since = run.last_run_at - timedelta(minutes=1) if run else now - MAX_AGE
+        candidates = _active_story_ids(since) | set(TrendingScore.objects.values_list('story_id', flat=True))
+
+        stories = (
+            Story.objects.filter(pk__in=candidates, status='published', published_at__gte=now - MAX_AGE)
+            .values_list('id', 'like_count', 'comment_count', 'published_at')
+        )
+        scores = {
+            story_id: hn_score(like_count, comment_count, published_at, now)
+            for story_id, like_count, comment_count, published_at in stories
+            if like_count or comment_count
+        }
+        by_scope = defaultdict(list, {'': list(scores)})
+        for story_id, slug in Story.tags.through.objects.filter(story_id__in=scores).values_list(
+            'story_id', 'tag__slug'
+        ):
+            by_scope[slug].append(story_id)
+
+        TrendingScore.objects.all().delete()
+        TrendingScore.objects.bulk_create([
+            TrendingScore(scope=scope, story_id=story_id, score=scores[story_id])
+            for scope, story_ids in by_scope.items()
+            for story_id in sorted(story_ids, key=scores.__getitem__, reverse=True)[:TOP_K]
+        ])
+        TrendingRun.objects.update_or_create(pk=1, defaults={'last_run_at': now})
+        invalidate('trending')
+    return len(scores)
+
+
+def trending_story_ids(scope='', limit=TOP_K):
+    """`(story_id, score)` of the best stories of `scope` ('' or a tag slug), best first."""
+    return list(
+        TrendingScore.objects.filter(scope=scope)
+        .order_by('-score', 'story_id')
+        .values_list('story_id', 'score')[:limit]
+    )
@@ -1,6 +1,7 @@
 from django.urls import path, include 
 from rest_framework.routers import DefaultRouter
 from .views import (
+    AuthorViewSet,
     LibraryViewset,
     StoryViewSet,
     TagViewSet,
@@ -15,11 +16,15 @@ from .views import (
     FollowerViewSet,
     # library-story 
     LibraryStoryViewset,
-    NotificationViewSet
+    NotificationViewSet,
+    FeedViewSet,
+    notification_stream,
 )
 
 router = DefaultRouter()
+router.register(r'authors', AuthorViewSet, basename='author')
 router.register(r'comments', CommentViewSet, basename='comment')
+router.register(r'feed', FeedViewSet, basename='feed')
 router.register(r'follower', FollowerViewSet, basename='follower')
 router.register(r'library', LibraryViewset, basename='library') 
 router.register(r'library-story',LibraryStoryViewset, basename='library-story')
@@ -31,6 +36,9 @@ router.register(r'likes', LikeViewSet, basename='like')
 urlpatterns = [ 
     path('csrf-token/', get_csrf_token, name='csrf-token'),  
 
+    # Server-Sent Events, before the router so `stream` is not taken for a notification id
+    path('notifications/stream/', notification_stream, name='notification-stream'),
+
     # Router
     path('', include(router.urls)), 
 
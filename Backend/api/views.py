@@ -1,4 +1,8 @@
 #from crypt import methods
+import json
+import mimetypes
+import os
+import re
 import select
 import stat
 from django.shortcuts import render
@@ -15,7 +19,19 @@ from rest_framework.generics import (
     DestroyAPIView
 )
 from .models import Author, Story, Tag, Like, Comment, Follower, Library, LibraryStory,Notification
-from .serializer import LibraryStorySerializer, StorySerializer, TagSerializer, LikeSerializer, CommentSerializer, FollowerSerializer, LibrarySerializer, NotificationSerializer
+from .feed import feed_sources
+from .search import search_stories
+from . import profiles, trending
+from .cache import cached_response, is_cacheable
+from . import inbox
+from .broker import get_broker
+from .storage import hash_of_name
+from .bulk import (
+    add_to_library, follow_authors, like_stories, parse_ids, remove_from_library, unfollow_authors,
+    unlike_stories,
+)
+from .toggles import annotate_viewer_state, liked_story_ids, set_follow, set_like
+from .serializer import LibraryStorySerializer, StorySerializer, StorySummarySerializer, StorySearchResultSerializer, AuthorProfileSerializer, AuthorProfileStorySerializer, StoryViewerStateSerializer, StorySummaryViewerStateSerializer, StoryTrendingSerializer, TagSerializer, LikeSerializer, CommentSerializer, FollowerSerializer, LibrarySerializer, NotificationSerializer
 from rest_framework.permissions import IsAuthenticated,IsAuthenticatedOrReadOnly,IsAdminUser 
 from .permissions import IsAuthorOrReadOnly, IsOwnerOrReadOnly 
 
@@ -23,14 +39,28 @@ from .permissions import IsAuthorOrReadOnly, IsOwnerOrReadOnly
 from django.middleware.csrf import get_token
 from django.http import JsonResponse
 from django.views.decorators.csrf import ensure_csrf_cookie
-from django.views.decorators.http import require_http_methods
+from django.views.decorators.http import require_GET, require_http_methods
+from django.http import (
+    FileResponse, Http404, HttpResponse, HttpResponseNotModified, StreamingHttpResponse,
+)
+from django.core.exceptions import SuspiciousFileOperation
+from django.utils._os import safe_join
+from django.utils.http import http_date, parse_http_date_safe
+from django.conf import settings
+from asgiref.sync import sync_to_async
+from rest_framework.exceptions import AuthenticationFailed, NotAuthenticated
 
 from rest_framework import status, viewsets
 from rest_framework.generics import ListAPIView, CreateAPIView, DestroyAPIView
 from rest_framework.permissions import IsAuthenticated
 from django.shortcuts import get_object_or_404
+from django.db.models import Q
+from django.db.models.functions import Lower
 from rest_framework.decorators import action
-from rest_framework_simplejwt.tokens import RefreshToken
+from rest_framework.authentication import SessionAuthentication
+from .authentication import (
+    STREAM_TICKET_MAX_AGE, BlogRefreshToken, ClaimsJWTAuthentication, stream_ticket, stream_ticket_user,
+)
 from django.contrib.auth import get_user_model
 
 
@@ -50,9 +80,101 @@ class StoryViewSet(viewsets.ModelViewSet):
     queryset = Story.objects.all()
     serializer_class = StorySerializer
     permission_classes = [IsAuthenticatedOrReadOnly, IsAuthorOrReadOnly]
+    # ids only: anything else is a 404 from the router, not a ValueError in the pk lookup
+    lookup_value_regex = r'\d+'
+
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        if self.action == 'list':
+            # list pages never read the story body
+            queryset = StorySummarySerializer.setup_queryset(queryset)
+        if self._include_viewer_state():
+            queryset = annotate_viewer_state(queryset, self.request.user.pk)
+        return queryset
+
+    def get_serializer_class(self):
+        if self.action == 'list':
+            return StorySummaryViewerStateSerializer if self._include_viewer_state() else StorySummarySerializer
+        if self.action == 'retrieve' and self._include_viewer_state():
+            return StoryViewerStateSerializer
+        return super().get_serializer_class()
+
+    def _include_viewer_state(self):
+        # opt-in `?include=viewer_state`, only meaningful (and never cached) for a logged-in user
+        return (
+            self.action in ('list', 'retrieve')
+            and self.request.user.is_authenticated
+            and 'viewer_state' in self.request.query_params.get('include', '').split(',')
+        )
 
     def perform_create(self, serializer):
-        serializer.save(author=self.request.user)
+        serializer.save(author_id=self.request.user.pk)
+
+    # anonymous reads are served from the versioned cache (api/cache.py)
+    def list(self, request, *args, **kwargs):
+        build = super().list
+        if not is_cacheable(request):
+            return build(request, *args, **kwargs)
+        return cached_response(request, 'stories', lambda: build(request, *args, **kwargs).data)
+
+    def retrieve(self, request, *args, **kwargs):
+        build = super().retrieve
+        if not is_cacheable(request):
+            return build(request, *args, **kwargs)
+        return cached_response(request, f"story:{kwargs['pk']}", lambda: build(request, *args, **kwargs).data)
+
+    @action(detail=True, methods=['post'])
+    def publish(self, request, pk=None):
+        # conditional UPDATE, followers are notified only by the request that published
+        story = self.get_object()
+        published = story.publish()
+        return Response({'id': story.id, 'status': story.status, 'published': published})
+
+    @action(detail=True, methods=['put', 'delete'], permission_classes=[IsAuthenticated])
+    def like(self, request, pk=None):
+        """Idempotent like (PUT) / unlike (DELETE), returns the new state and like count."""
+        story = get_object_or_404(Story.objects.only('id', 'author_id', 'like_count'), pk=pk)
+        liked, like_count = set_like(request.user.pk, story, request.method == 'PUT')
+        return Response({'story_id': story.pk, 'liked': liked, 'like_count': like_count})
+
+    @action(detail=False, methods=['get'], permission_classes=[permissions.AllowAny])
+    def trending(self, request):
+        """Top stories by time-decayed likes/comments, site-wide or `?tag=<slug>`, from the precomputed table."""
+        scope = request.query_params.get('tag', '')
+        try:
+            limit = int(request.query_params.get('limit', self.paginator.page_size))
+        except ValueError:
+            return Response({'detail': 'limit must be an integer'}, status=status.HTTP_400_BAD_REQUEST)
+        limit = max(1, min(limit, trending.TOP_K))
+
+        def build():
+            ranked = trending.trending_story_ids(scope, limit)
+            stories = StorySummarySerializer.setup_queryset(Story.objects.all()).in_bulk([pk for pk, _ in ranked])
+            results = []
+            for story_id, score in ranked:
+                if story_id in stories:
+                    stories[story_id].score = score
+                    results.append(stories[story_id])
+            return {'results': StoryTrendingSerializer(results, many=True, context={'request': request}).data}
+
+        if not is_cacheable(request):
+            return Response(build())
+        return cached_response(request, 'trending', build)
+
+    @action(detail=False, methods=['get'], serializer_class=StorySearchResultSerializer)
+    def search(self, request):
+        """ full-text search on published stories, ranked (title > content > tags) and keyset paginated on the rank """
+        text = request.query_params.get('q', '').strip()
+        if not text:
+            return Response({'detail': 'q is required'}, status=status.HTTP_400_BAD_REQUEST)
+        queryset = StorySummarySerializer.setup_queryset(search_stories(text))
+        self.pagination_ordering = ('-rank', '-id')
+        page = self.paginate_queryset(queryset)
+        if page is not None:
+            serializer = self.get_serializer(page, many=True)
+            return self.get_paginated_response(serializer.data)
+        serializer = self.get_serializer(queryset, many=True)
+        return Response(serializer.data)
 
 # Tag views 
 
@@ -60,6 +182,73 @@ class TagViewSet(viewsets.ModelViewSet):
     queryset = Tag.objects.all()
     serializer_class = TagSerializer
     permission_classes = [IsAdminUser]
+    pagination_ordering = ('name',)
+
+    def get_permissions(self):
+        # anyone can browse tags, only admins edit them
+        if self.action in ['list', 'retrieve', 'stories', 'autocomplete']:
+            return [permissions.AllowAny()]
+        return super().get_permissions()
+
+    def list(self, request, *args, **kwargs):
+        build = super().list
+        if not is_cacheable(request):
+            return build(request, *args, **kwargs)
+        return cached_response(request, 'tags', lambda: build(request, *args, **kwargs).data)
+
+    @action(detail=False, methods=['get'], url_path=r'(?P<slug>[^/.]+)/stories')
+    def stories(self, request, slug=None):
+        """ published stories of a tag, newest first, through the (tag, story) index of the join table """
+        tag = get_object_or_404(Tag.objects.only('id'), slug=slug)
+
+        def build():
+            queryset = StorySummarySerializer.setup_queryset(
+                Story.objects.filter(tags=tag, status='published')
+            )
+            self.pagination_ordering = ('-created_at', '-id')
+            page = self.paginate_queryset(queryset)
+            serializer = StorySummarySerializer(page, many=True, context=self.get_serializer_context())
+            return self.get_paginated_response(serializer.data)
+
+        if not is_cacheable(request):
+            return build()
+        return cached_response(request, 'stories', lambda: build().data)
+
+    @action(detail=False, methods=['get'])
+    def autocomplete(self, request):
+        """ `?q=<prefix>`: up to `limit` (10) tags whose name starts with the prefix, most used first """
+        prefix = request.query_params.get('q', '').strip().lower()
+        if not prefix:
+            return Response({'detail': 'q is required'}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            limit = max(1, min(int(request.query_params.get('limit', 10)), 50))
+        except ValueError:
+            return Response({'detail': 'limit must be an integer'}, status=status.HTTP_400_BAD_REQUEST)
+
+        def build():
+            # LOWER(name) LIKE 'prefix%' is a range scan of tag_name_prefix_idx
+            tags = (
+                Tag.objects.annotate(name_lower=Lower('name'))
+                .filter(name_lower__startswith=prefix)
+                .order_by('-story_count', 'name')
+                .values('id', 'name', 'slug', 'story_count')[:limit]
+            )
+            return {'results': list(tags)}
+
+        # the answer is the same for every user, so it is cached for logged-in authors too
+        return cached_response(request, 'tags', build)
+
+
+def _bulk_response(request, key, create, delete):
+    # shared by the bulk actions: validate the id list, then run the create or delete path
+    try:
+        ids = parse_ids(request.data, key)
+        if request.method == 'DELETE':
+            return Response({'deleted': delete(ids)})
+        return Response({'created': create(ids)}, status=status.HTTP_201_CREATED)
+    except ValueError as exc:
+        return Response({'detail': str(exc)}, status=status.HTTP_400_BAD_REQUEST)
+
 
 # Like Views
 
@@ -75,9 +264,25 @@ class LikeViewSet(viewsets.ModelViewSet):
 
     def perform_create(self, serializer):
         # For direct POST /likes/ with body { story: id }
-        serializer.save(user=self.request.user) 
+        serializer.save(user_id=self.request.user.pk)
+
+    @action(detail=False, methods=['post', 'delete'], url_path='bulk')
+    def bulk(self, request):
+        """Like (POST) or unlike (DELETE) a list of stories: `{"story_ids": [..]}`."""
+        return _bulk_response(request, 'story_ids', lambda ids: like_stories(request.user.pk, ids),
+                              lambda ids: unlike_stories(request.user.pk, ids))
+
+    @action(detail=False, methods=['get'], url_path='mine')
+    def mine(self, request):
+        """Which of `?story_ids=1,2,3` the user liked, for a whole list page in one query."""
+        try:
+            story_ids = parse_ids({'story_ids': request.query_params.get('story_ids', '').split(',')}, 'story_ids')
+        except ValueError as exc:
+            return Response({'detail': str(exc)}, status=status.HTTP_400_BAD_REQUEST)
+        liked = liked_story_ids(request.user.pk, story_ids)
+        return Response({'liked': [pk for pk in story_ids if pk in liked]})
 
-    @action(detail=False, methods=['get'], url_path='story/(?P<story_id>[^/.]+)')
+    @action(detail=False, methods=['get'], url_path=r'story/(?P<story_id>\d+)')
     def list_by_story(self, request, story_id=None):
         queryset = Like.objects.filter(story_id=story_id)
         page = self.paginate_queryset(queryset)
@@ -87,10 +292,14 @@ class LikeViewSet(viewsets.ModelViewSet):
         serializer = self.get_serializer(queryset, many=True)
         return Response(serializer.data)
 
-    @action(detail=False, methods=['get'], url_path='story/(?P<story_id>[^/.]+)/count')
+    @action(detail=False, methods=['get'], url_path=r'story/(?P<story_id>\d+)/count')
     def count_by_story(self, request, story_id=None):
-        count = Like.objects.filter(story_id=story_id).count()
-        return Response({'story_id': int(story_id), 'like_count': count})
+        def build():
+            count = Story.objects.filter(pk=story_id).values_list('like_count', flat=True).first()
+            return {'story_id': int(story_id), 'like_count': count or 0}
+        if not is_cacheable(request):
+            return Response(build())
+        return cached_response(request, f'story-counts:{story_id}', build)
 
 # Comment ViewSet
 class CommentViewSet(viewsets.ModelViewSet):
@@ -99,9 +308,9 @@ class CommentViewSet(viewsets.ModelViewSet):
     permission_classes = [IsAuthenticatedOrReadOnly, IsAuthorOrReadOnly]
 
     def perform_create(self, serializer):
-        serializer.save(author=self.request.user) 
+        serializer.save(author_id=self.request.user.pk)
 
-    @action(detail=False, methods=['get'], url_path='story/(?P<story_id>[^/.]+)', permission_classes=[permissions.AllowAny])
+    @action(detail=False, methods=['get'], url_path=r'story/(?P<story_id>\d+)', permission_classes=[permissions.AllowAny])
     def list_by_story(self, request, story_id=None):
         queryset = Comment.objects.filter(story_id=story_id)
         page = self.paginate_queryset(queryset)
@@ -111,10 +320,47 @@ class CommentViewSet(viewsets.ModelViewSet):
         serializer = self.get_serializer(queryset, many=True)
         return Response(serializer.data)
 
-    @action(detail=False, methods=['get'], url_path='story/(?P<story_id>[^/.]+)/count', permission_classes=[permissions.AllowAny])
+    @action(detail=False, methods=['get'], url_path=r'story/(?P<story_id>\d+)/count', permission_classes=[permissions.AllowAny])
     def count_by_story(self, request, story_id=None):
-        count = Comment.objects.filter(story_id=story_id).count()
-        return Response({'story_id': int(story_id), 'comment_count': count})
+        def build():
+            count = Story.objects.filter(pk=story_id).values_list('comment_count', flat=True).first()
+            return {'story_id': int(story_id), 'comment_count': count or 0}
+        if not is_cacheable(request):
+            return Response(build())
+        return cached_response(request, f'story-counts:{story_id}', build)
+
+    @action(detail=False, methods=['get'], url_path=r'story/(?P<story_id>\d+)/tree', permission_classes=[permissions.AllowAny])
+    def tree(self, request, story_id=None):
+        """
+        Nested threads of a story: a page of top-level comments plus all their replies
+        (up to ?depth=N levels) fetched with a single `root_id IN (..)` query.
+        """
+        try:
+            max_depth = int(request.query_params.get('depth', 0)) or None
+        except ValueError:
+            return Response({'detail': 'depth must be an integer'}, status=status.HTTP_400_BAD_REQUEST)
+
+        threads = Comment.objects.filter(story_id=story_id, parent__isnull=True)
+        page = self.paginate_queryset(threads)
+        roots = page if page is not None else list(threads)
+
+        replies = Comment.objects.filter(root_id__in=[comment.id for comment in roots]).order_by('created_at', 'id')
+        if max_depth is not None:
+            replies = replies.filter(depth__lte=max_depth)
+
+        # O(n) assembly: index every node by id, then attach each reply to its parent
+        nodes = {}
+        for comment in [*roots, *replies]:
+            nodes[comment.id] = dict(self.get_serializer(comment).data, replies=[])
+        for comment in replies:
+            parent = nodes.get(comment.parent_id)
+            if parent is not None:
+                parent['replies'].append(nodes[comment.id])
+        data = [nodes[comment.id] for comment in roots]
+
+        if page is not None:
+            return self.get_paginated_response(data)
+        return Response(data)
 
     @action(detail=True, methods=['post'], permission_classes=[IsAuthenticated])
     def reply(self, request, pk=None):
@@ -124,7 +370,7 @@ class CommentViewSet(viewsets.ModelViewSet):
             return Response({'detail': 'content is required'}, status=status.HTTP_400_BAD_REQUEST)
         reply_comment = Comment.objects.create(
             story=parent_comment.story,
-            author=request.user,
+            author_id=request.user.pk,
             content=content,
             parent=parent_comment,
         ) 
@@ -134,10 +380,11 @@ class CommentViewSet(viewsets.ModelViewSet):
 # Exchange authenticated session (e.g., after Google login) for JWT tokens
 @method_decorator(csrf_exempt, name='dispatch')
 class SessionToJWTView(APIView): 
+    authentication_classes = [SessionAuthentication]
     permission_classes = [IsAuthenticated]
 
     def post(self, request):
-        refresh_token = RefreshToken.for_user(request.user)
+        refresh_token = BlogRefreshToken.for_user(request.user)
         return Response({
             'refresh': str(refresh_token),
             'access': str(refresh_token.access_token),
@@ -151,38 +398,91 @@ class FollowerViewSet(viewsets.ModelViewSet):
     queryset = Follower.objects.all()
     serializer_class = FollowerSerializer 
     permission_classes = [IsAuthenticatedOrReadOnly]
+    pagination_ordering = ('-followed_at', '-id')
 
     
-    @action(detail=False,methods=["get"],url_path="user/(?P<user_id>[^/.]+)/followers",permission_classes=[IsAuthenticated])
+    @action(detail=False, methods=['post', 'delete'], url_path='bulk', permission_classes=[IsAuthenticated])
+    def bulk(self, request):
+        """Follow (POST) or unfollow (DELETE) a list of users: `{"user_ids": [..]}`."""
+        return _bulk_response(request, 'user_ids', lambda ids: follow_authors(request.user.pk, ids),
+                              lambda ids: unfollow_authors(request.user.pk, ids))
+
+    @action(detail=False, methods=['put', 'delete'], url_path=r'user/(?P<user_id>\d+)/follow',
+            permission_classes=[IsAuthenticated])
+    def follow(self, request, user_id=None):
+        """Idempotent follow (PUT) / unfollow (DELETE), returns the new state and follower count."""
+        author = get_object_or_404(Author.objects.only('id', 'follower_count'), pk=user_id)
+        if author.pk == request.user.pk:
+            return Response({'detail': 'you cannot follow yourself'}, status=status.HTTP_400_BAD_REQUEST)
+        following, follower_count = set_follow(request.user.pk, author, request.method == 'PUT')
+        return Response({'user_id': author.pk, 'following': following, 'follower_count': follower_count})
+
+    @action(detail=False,methods=["get"],url_path=r"user/(?P<user_id>\d+)/followers",permission_classes=[IsAuthenticated])
     def list_followers(self,request,user_id=None):
         queryset = Follower.objects.filter(followed_id = user_id).select_related('follower','followed') 
         page = self.paginate_queryset(queryset)
         if page is not None :
             serializer = self.get_serializer(page,many = True)
-            return Response(serializer.data)
+            return self.get_paginated_response(serializer.data)
         serializer = self.get_serializer(queryset,many = True)
         return Response(serializer.data) 
 
-    @action(detail=False,methods=["get"],url_path="user/(?P<user_id>[^/.]+)/followings",permission_classes=[IsAuthenticated])
+    @action(detail=False,methods=["get"],url_path=r"user/(?P<user_id>\d+)/followings",permission_classes=[IsAuthenticated])
     def list_followings(self,request,user_id=None):
         queryset = Follower.objects.filter(follower_id = user_id).select_related('follower','followed') 
         page = self.paginate_queryset(queryset)
         if page is not None :
             serializer = self.get_serializer(page,many = True)
-            return Response(serializer.data)
+            return self.get_paginated_response(serializer.data)
         serializer = self.get_serializer(queryset,many = True)
         return Response(serializer.data)
 
-    @action(detail=False,methods=["get"],url_path="user/(?P<user_id>[^/.]+)/followers/count",permission_classes=[IsAuthenticated])
+    @action(detail=False,methods=["get"],url_path=r"user/(?P<user_id>\d+)/followers/count",permission_classes=[IsAuthenticated])
     def count_followers(self,request,user_id=None):
-        count = Follower.objects.filter(followed_id=user_id).count()
+        count = Author.objects.filter(pk=user_id).values_list('follower_count', flat=True).first() or 0
         return Response({"User Id": int(user_id), "Number of followers": count})
     
-    @action(detail=False,methods=["get"],url_path="user/(?P<user_id>[^/.]+)/followings/count",permission_classes=[IsAuthenticated])
+    @action(detail=False,methods=["get"],url_path=r"user/(?P<user_id>\d+)/followings/count",permission_classes=[IsAuthenticated])
     def count_followings(self,request,user_id=None):
-        count = Follower.objects.filter(follower_id=user_id).count()
+        count = Author.objects.filter(pk=user_id).values_list('following_count', flat=True).first() or 0
         return Response({"User Id": int(user_id), "Number of followings": count})  
 
+# Author profile views
+
+class AuthorViewSet(viewsets.GenericViewSet):
+    queryset = Author.objects.all()
+    serializer_class = AuthorProfileSerializer
+    permission_classes = [permissions.AllowAny]
+    lookup_field = 'username'
+    lookup_value_regex = r'[\w.@+-]+'
+
+    def retrieve(self, request, username=None):
+        """ profile, follower/following/story/like counts and latest published stories, in two queries (api/profiles.py) """
+        profile_queryset = AuthorProfileSerializer.setup_queryset(Author.objects.all())
+        author_id = profiles.cached_author_id(username)
+        author = None
+        if author_id is None:
+            author = get_object_or_404(profile_queryset, username=username)
+            author_id = author.pk
+            profiles.remember_author_id(username, author_id)
+
+        def build():
+            profile = author
+            if profile is None:
+                profile = profile_queryset.filter(pk=author_id, username=username).first()
+                if profile is None:
+                    # renamed since the id was remembered
+                    profiles.forget_author_id(username)
+                    raise Http404
+            profile.latest_stories = AuthorProfileStorySerializer.setup_queryset(
+                Story.objects.filter(author_id=profile.pk, status='published')
+            ).order_by('-published_at', '-id')[:profiles.LATEST_STORIES]
+            return self.get_serializer(profile).data
+
+        if not is_cacheable(request):
+            return Response(build())
+        return cached_response(request, profiles.author_scope(author_id), build)
+
 """ create library ,update , get a user libraries if they are public ,make a lib public,delete lib """ 
 
 class LibraryViewset(viewsets.ModelViewSet):
@@ -191,14 +491,13 @@ class LibraryViewset(viewsets.ModelViewSet):
     permission_classes=[IsAuthenticatedOrReadOnly,IsOwnerOrReadOnly]
 
     def perform_create(self,serializer):
-        serializer.save(user=self.request.user)  
+        serializer.save(user_id=self.request.user.pk)
     
-    @action(detail=False, methods=['get'], url_path ="user/(?P<user_id>[^/.]+)/libraries", permission_classes=[IsAuthenticated,IsOwnerOrReadOnly])
+    @action(detail=False, methods=['get'], url_path =r"user/(?P<user_id>\d+)/libraries", permission_classes=[IsAuthenticated,IsOwnerOrReadOnly])
     def user_libs(self,request, user_id=None):
-        logged_user = request.user
         User = get_user_model()
-        target_user = get_object_or_404(User,id=user_id)
-        if logged_user == target_user:
+        target_user = get_object_or_404(User.objects.only('id'), id=user_id)
+        if target_user.pk == request.user.pk:
             queryset = Library.objects.filter(user=target_user)
         else:
             queryset = Library.objects.filter(user=target_user, is_private=False)
@@ -215,32 +514,59 @@ class LibraryStoryViewset(viewsets.ModelViewSet):
     queryset = LibraryStory.objects.all()
     serializer_class = LibraryStorySerializer
     permission_classes = [IsAuthenticated]
+    pagination_ordering = ('-added_at', '-id')
+
+
+    @action(detail=False, methods=['post', 'delete'], url_path=r'library/(?P<lib_id>\d+)/bulk')
+    def bulk(self, request, lib_id=None):
+        """Add (POST) or remove (DELETE) a list of stories of your library: `{"story_ids": [..]}`."""
+        library = get_object_or_404(Library, id=lib_id)
+        if library.user_id != request.user.pk:
+            return Response({"detail": "you don't have the permission to modify this library"},
+                            status=status.HTTP_403_FORBIDDEN)
+        return _bulk_response(request, 'story_ids', lambda ids: add_to_library(library.pk, ids),
+                              lambda ids: remove_from_library(library.pk, ids))
+
+    @action(detail=False, methods=['get'], url_path=r'library/(?P<lib_id>\d+)/get-all-stories')
+    def get_all_stories(self, request, lib_id=None):
+        """
+        Stories of a library, most recently added first, keyset paginated on the
+        entries in SQL. The privacy check is part of the page query, the library
+        row itself is only read when the page comes back empty (404 / 403 / empty).
+        """
+        visible = Q(library__is_private=False) | Q(library__user_id=request.user.pk)
+        entries = StorySummarySerializer.setup_queryset(
+            LibraryStory.objects.filter(visible, library_id=lib_id), prefix='story__'
+        )
+        page = self.paginate_queryset(entries)
+
+        if not page:
+            library = get_object_or_404(Library.objects.only('id', 'user_id', 'is_private'), id=lib_id)
+            if library.is_private and library.user_id != request.user.pk:
+                return Response({"detail": "you don't have the permission to access this library"},
+                                status=status.HTTP_403_FORBIDDEN)
+
+        serializer = StorySummarySerializer([entry.story for entry in page], many=True,
+                                            context=self.get_serializer_context())
+        return self.get_paginated_response(serializer.data)
+
+
+"""home feed of the authenticated user, newest published stories of the authors they follow """
+class FeedViewSet(viewsets.GenericViewSet):
+    serializer_class = StorySummarySerializer
+    permission_classes = [IsAuthenticated]
+    pagination_ordering = ('-published_at', '-story_id')
 
-
-    @action(detail=False,methods=['get'],url_path='library/(?P<lib_id>[^/.]+)/get-all-stories')
-    def get_all_stories(self,request,lib_id=None):
-        try:
-            library = get_object_or_404(Library, id=lib_id)
-
-            if library.is_private and library.user != request.user :
-                return Response({"detail":"you don't have the permission to access this library"},status=status.HTTP_403_FORBIDDEN)
-            
-            library_stories = LibraryStory.objects.filter(library=library).select_related('story','story__author')
-
-            stories = [lib_story.story for lib_story in library_stories]
-
-            serialiser = StorySerializer(stories, many=True)
-
-            page = self.paginate_queryset(stories)
-
-            if page is not None :
-                serialiser = StorySerializer(page, many =True)
-                return self.paginated_response(serialiser.data)
-            
-            return Response(serialiser.data)
-
-        except ValueError:
-            return Response({"detail":"Invalide libraru ID"},status=status.HTTP_200_successful) 
+    def list(self, request):
+        # timeline rows (fan-out on write) merged with stories of followed big authors (fan-out on read)
+        rows = self.paginator.paginate_querysets(feed_sources(request.user.pk), request, view=self)
+        # a story unpublished since it was fanned out is skipped until its rows are dropped
+        stories = StorySummarySerializer.setup_queryset(Story.objects.filter(status='published')).in_bulk(
+            [row['story_id'] for row in rows]
+        )
+        page = [stories[row['story_id']] for row in rows if row['story_id'] in stories]
+        serializer = self.get_serializer(page, many=True)
+        return self.paginator.get_paginated_response(serializer.data)
 
 
 """each time a new notification type is added a new notification row will be added to Notification, return all notifation filtred by authenticated user
@@ -251,7 +577,7 @@ class NotificationViewSet(viewsets.ModelViewSet):
     permission_classes = [IsAuthenticated]
 
     def get_queryset(self):
-        queryset = super().get_queryset().filter(recipient=self.request.user)
+        queryset = super().get_queryset().filter(recipient_id=self.request.user.pk)
         notif_type = self.request.query_params.get('type')
         is_read = self.request.query_params.get('is_read')
         if notif_type:
@@ -267,8 +593,190 @@ class NotificationViewSet(viewsets.ModelViewSet):
         # Creation is handled by signals; disallow manual creation via API
         return Response({'detail': 'Creation is handled automatically'}, status=status.HTTP_405_METHOD_NOT_ALLOWED)
 
+    @action(detail=False, methods=['post'], url_path='stream-ticket')
+    def stream_ticket(self, request):
+        """A short-lived ticket for `GET /api/notifications/stream/?ticket=`, EventSource can't send headers."""
+        return Response({'ticket': stream_ticket(request.user.pk), 'expires_in': STREAM_TICKET_MAX_AGE})
+
+    @action(detail=False, methods=['get'])
+    def unread_count(self, request):
+        return Response({'unread_count': inbox.unread_count(request.user.pk)})
+
+    @action(detail=False, methods=['post'])
+    def mark_read(self, request):
+        """
+        Mark notifications read by `ids`, id `ranges` ([[first, last], ..]), `up_to`
+        a timestamp and/or `type`. Large selections finish in the background (202 + job id).
+        """
+        try:
+            params = inbox.parse_selection(request.data)
+        except (TypeError, ValueError) as exc:
+            return Response({'detail': str(exc)}, status=status.HTTP_400_BAD_REQUEST)
+        return self._mark_read_response(*inbox.mark_read(request.user.pk, params))
+
     @action(detail=False, methods=['post'])
     def mark_all_read(self, request):
-        updated = self.get_queryset().update(is_read=True)
-        return Response({'updated': updated})
+        params = inbox.parse_selection({'type': request.query_params.get('type')})
+        return self._mark_read_response(*inbox.mark_read(request.user.pk, params))
+
+    def _mark_read_response(self, updated, job):
+        if job is None:
+            return Response({'updated': updated, 'unread_count': inbox.unread_count(self.request.user.pk)})
+        return Response({'updated': updated, 'job': job.pk}, status=status.HTTP_202_ACCEPTED)
+
+
+# seconds between keep-alive comments on an idle stream (proxies drop silent connections)
+STREAM_HEARTBEAT = getattr(settings, 'NOTIFICATION_STREAM_HEARTBEAT', 15)
+
+
+def _stream_user(request):
+    # EventSource can't send headers, browsers pass a stream ticket as ?ticket= instead
+    header = request.headers.get('Authorization', '')
+    if header.startswith('Bearer '):
+        authenticator = ClaimsJWTAuthentication()
+        return authenticator.get_user(authenticator.get_validated_token(header[len('Bearer '):]))
+    ticket = request.GET.get('ticket')
+    if not ticket:
+        raise NotAuthenticated()
+    return stream_ticket_user(ticket)
+
 
+@require_GET
+async def notification_stream(request):
+    """
+    Server-Sent Events stream of the user's new notifications: an `unread_count`
+    event on connect, then one `notification` event per new or coalesced row.
+    Async, so an idle connection waits on the broker without holding a thread
+    (serve it with an ASGI server). Authenticated by the `Authorization` header
+    or a `?ticket=` from `POST /api/notifications/stream-ticket/`.
+    """
+    try:
+        user = await sync_to_async(_stream_user)(request)
+    except (AuthenticationFailed, NotAuthenticated) as exc:
+        # simplejwt's InvalidToken carries a dict detail
+        detail = exc.detail.get('detail', '') if isinstance(exc.detail, dict) else exc.detail
+        return JsonResponse({'detail': str(detail)}, status=401)
+
+    response = StreamingHttpResponse(_notification_events(user.pk), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'
+    return response
+
+
+async def _notification_events(user_id):
+    broker = get_broker()
+    subscription = broker.subscribe(user_id)
+    try:
+        # read after subscribing so nothing published in between is missed
+        unread_count = await sync_to_async(inbox.unread_count)(user_id)
+        yield f'retry: 5000\nevent: unread_count\ndata: {json.dumps({"unread_count": unread_count})}\n\n'
+        while True:
+            event = await subscription.get(timeout=STREAM_HEARTBEAT)
+            if event is None:
+                yield ': keep-alive\n\n'
+            else:
+                yield f'id: {event["id"]}\nevent: notification\ndata: {json.dumps(event)}\n\n'
+    finally:
+        broker.unsubscribe(subscription)
+
+
+# Media files (MEDIA_ROOT), streamed from disk with Range and conditional GET support
+
+MEDIA_CHUNK_SIZE = 64 * 1024
+MEDIA_CACHE_MAX_AGE = getattr(settings, 'MEDIA_CACHE_MAX_AGE', 3600)
+_BYTE_RANGE = re.compile(r'^bytes=(\d*)-(\d*)$')
+
+
+def _byte_range(header, size):
+    """
+    `(first, last)` of a single `Range: bytes=...` spec. None when the whole file
+    should be sent (no, several or malformed ranges), ValueError when unsatisfiable.
+    """
+    match = _BYTE_RANGE.match(header.strip())
+    if not match or match.groups() == ('', ''):
+        return None
+    if size == 0:
+        # no byte of an empty file can be served
+        raise ValueError('empty file')
+    first, last = match.groups()
+    if not first:
+        # suffix range, the last N bytes
+        if int(last) == 0:
+            raise ValueError('empty suffix range')
+        return max(size - int(last), 0), size - 1
+    first = int(first)
+    if last and int(last) < first:
+        return None
+    if first >= size:
+        raise ValueError('range starts after the end of the file')
+    return first, min(int(last), size - 1) if last else size - 1
+
+
+def _read_range(path, first, length):
+    with open(path, 'rb') as media_file:
+        media_file.seek(first)
+        while length > 0:
+            chunk = media_file.read(min(MEDIA_CHUNK_SIZE, length))
+            if not chunk:
+                return
+            length -= len(chunk)
+            yield chunk
+
+
+@require_http_methods(['GET', 'HEAD'])
+def serve_media(request, path):
+    """
+    Stream a file of MEDIA_ROOT. Content-addressed names (api/storage.py) use their
+    hash as strong ETag and are cacheable forever, other files get a mtime/size
+    validator. Conditional requests get 304, `Range` requests 206/416; the file is
+    read in chunks (or handed to the server's sendfile), never loaded whole.
+    """
+    try:
+        full_path = safe_join(settings.MEDIA_ROOT, path)
+        stat_result = os.stat(full_path)
+    except (SuspiciousFileOperation, OSError):
+        raise Http404('media file not found')
+    if not stat.S_ISREG(stat_result.st_mode):
+        raise Http404('media file not found')
+
+    size = stat_result.st_size
+    digest = hash_of_name(path)
+    etag = f'"{digest}"' if digest else f'"{stat_result.st_mtime_ns:x}-{size:x}"'
+    headers = {
+        'ETag': etag,
+        'Last-Modified': http_date(stat_result.st_mtime),
+        'Accept-Ranges': 'bytes',
+        'Cache-Control': 'public, max-age=31536000, immutable' if digest else f'public, max-age={MEDIA_CACHE_MAX_AGE}',
+    }
+
+    if_none_match = request.headers.get('If-None-Match')
+    if if_none_match is not None:
+        tags = {tag.strip().removeprefix('W/') for tag in if_none_match.split(',')}
+        not_modified = etag in tags or '*' in tags
+    else:
+        since = parse_http_date_safe(request.headers.get('If-Modified-Since', ''))
+        not_modified = since is not None and int(stat_result.st_mtime) <= since
+    if not_modified:
+        return HttpResponseNotModified(headers=headers)
+
+    content_type = mimetypes.guess_type(full_path)[0] or 'application/octet-stream'
+    byte_range = None
+    range_header = request.headers.get('Range')
+    # If-Range: only answer the range if the client's copy is still current; an
+    # HTTP-date validator is never taken as a match, the whole file is sent then
+    if range_header and request.headers.get('If-Range', etag) == etag:
+        try:
+            byte_range = _byte_range(range_header, size)
+        except ValueError:
+            return HttpResponse(status=416, headers={**headers, 'Content-Range': f'bytes */{size}'})
+
+    if byte_range is None:
+        response = FileResponse(open(full_path, 'rb'), content_type=content_type, headers=headers)
+    else:
+        first, last = byte_range
+        response = StreamingHttpResponse(
+            _read_range(full_path, first, last - first + 1), status=206, content_type=content_type,
+            headers={**headers, 'Content-Range': f'bytes {first}-{last}/{size}'},
+        )
+        response['Content-Length'] = str(last - first + 1)
+    return response
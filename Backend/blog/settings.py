@@ -38,6 +38,7 @@ INSTALLED_APPS = [
     'django.contrib.messages',
     'django.contrib.staticfiles',
     #added 
+    'django.contrib.postgres',
     'django.contrib.sites',
     'rest_framework',
     'drf_yasg',
@@ -65,19 +66,56 @@ REST_FRAMEWORK = {
     'rest_framework.permissions.IsAuthenticated',
     ],
 
+    # JWT first: a Bearer request never reads the session, and its user comes from
+    # the token claims (api/authentication.py); session-only endpoints set their own
     'DEFAULT_AUTHENTICATION_CLASSES': [
+    'api.authentication.ClaimsJWTAuthentication',
     'rest_framework.authentication.SessionAuthentication',
-    'rest_framework_simplejwt.authentication.JWTAuthentication',   
     ],
+
+    # keyset pagination on (created_at, id) for every list endpoint, see api/pagination.py
+    'DEFAULT_PAGINATION_CLASS': 'api.pagination.KeysetPagination',
+    'PAGE_SIZE': int(os.getenv("API_PAGE_SIZE", 20)),
+}
+
+# upper bound for ?page_size= on paginated endpoints
+API_MAX_PAGE_SIZE = int(os.getenv("API_MAX_PAGE_SIZE", 100))
+
+# Cache (local memory by default, point CACHE_BACKEND/CACHE_LOCATION at e.g. redis in production)
+CACHES = {
+    'default': {
+        'BACKEND': os.getenv("CACHE_BACKEND", 'django.core.cache.backends.locmem.LocMemCache'),
+        'LOCATION': os.getenv("CACHE_LOCATION", 'blog-cache'),
+    }
 }
+# seconds a cached public response is kept, see api/cache.py
+API_CACHE_TIMEOUT = int(os.getenv("API_CACHE_TIMEOUT", 300))
+
+# authors with more followers than this are merged into /api/feed/ at read time
+# instead of being copied into every follower's timeline
+FEED_FANOUT_THRESHOLD = int(os.getenv("FEED_FANOUT_THRESHOLD", 10000))
+
+# seconds during which likes/comments on a story coalesce into one unread notification, 0 = one row per event
+NOTIFICATION_COALESCE_WINDOW = int(os.getenv("NOTIFICATION_COALESCE_WINDOW", 3600))
+# pub/sub behind /api/notifications/stream/: Postgres LISTEN/NOTIFY reaches the streams of every
+# process, the in-process broker only those of the publishing one (not the job worker's events)
+NOTIFICATION_BROKER = os.getenv("NOTIFICATION_BROKER", "api.broker.PostgresBroker")
+# seconds a ticket from POST /api/notifications/stream-ticket/ can open the stream
+NOTIFICATION_STREAM_TICKET_MAX_AGE = int(os.getenv("NOTIFICATION_STREAM_TICKET_MAX_AGE", 30))
 
 from datetime import timedelta 
 
 SIMPLE_JWT = {
-    'ACCESS_TOKEN_LIFETIME': timedelta(minutes=60),
+    # also how long a deleted or deactivated user can keep reading (api/authentication.py)
+    'ACCESS_TOKEN_LIFETIME': timedelta(minutes=15),
     'REFRESH_TOKEN_LIFETIME': timedelta(days=7),
     'ROTATE_REFRESH_TOKENS': True,
     'BLACKLIST_AFTER_ROTATION': True,
+    # adds the username/is_staff claims the request user of a read is built from
+    'TOKEN_OBTAIN_SERIALIZER': 'api.authentication.BlogTokenObtainPairSerializer',
+    # single-use refresh tokens checked against the blacklist of api/revocation.py
+    'TOKEN_REFRESH_SERIALIZER': 'api.authentication.BlogTokenRefreshSerializer',
+    'TOKEN_BLACKLIST_SERIALIZER': 'api.authentication.BlogTokenBlacklistSerializer',
 }
 
 SOCIALACCOUNT_PROVIDERS = {
@@ -235,6 +273,18 @@ USE_TZ = True
 
 STATIC_URL = 'static/'
 
+# Uploaded files (covers, profile pictures and their resized copies), served by api.views.serve_media
+MEDIA_URL = os.getenv("MEDIA_URL", "/media/")
+MEDIA_ROOT = os.getenv("MEDIA_ROOT", str(BASE_DIR / "media"))
+# seconds clients may cache media whose name is not a content hash (hashed names are immutable)
+MEDIA_CACHE_MAX_AGE = int(os.getenv("MEDIA_CACHE_MAX_AGE", 3600))
+
+STORAGES = {
+    # files are named after the SHA-256 of their content, identical uploads share one file
+    'default': {'BACKEND': 'api.storage.ContentAddressedStorage'},
+    'staticfiles': {'BACKEND': 'django.contrib.staticfiles.storage.StaticFilesStorage'},
+}
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/5.2/ref/settings/#default-auto-field
 
@@ -14,6 +14,9 @@ Including another URLconf
     1. Import the include() function: from django.urls import include, path
     2. Add a URL to urlpatterns:  path('blog/', include('blog.urls'))
 """
+import re
+
+from django.conf import settings
 from django.contrib import admin
 from django.urls import path,include,re_path 
 from django.contrib.auth import views as auth_views
@@ -24,7 +27,9 @@ from rest_framework_simplejwt.views import (
     TokenObtainPairView,
     TokenRefreshView,
     TokenVerifyView,
+    TokenBlacklistView,
 ) 
+from api.views import serve_media
 
 schema_view = get_schema_view(
    openapi.Info(
@@ -55,6 +60,7 @@ urlpatterns = [
     path('api/token/', TokenObtainPairView.as_view(), name='token_obtain_pair'),  # Login
     path('api/token/refresh/', TokenRefreshView.as_view(), name='token_refresh'),  # Refresh
     path('api/token/verify/', TokenVerifyView.as_view(), name='token_verify'),    # Verify if token is valid 
+    path('api/token/blacklist/', TokenBlacklistView.as_view(), name='token_blacklist'),  # Logout (revoke refresh token)
 
     path('api/auth/social/', include('allauth.socialaccount.urls')),
 
@@ -63,6 +69,9 @@ urlpatterns = [
     path('swagger/', schema_view.with_ui('swagger', cache_timeout=0), name='schema-swagger-ui'),
     path('redoc/', schema_view.with_ui('redoc', cache_timeout=0), name='schema-redoc'),
 
+    # uploaded files, streamed with Range/ETag support (api.views.serve_media)
+    re_path(rf'^{re.escape(settings.MEDIA_URL.lstrip("/"))}(?P<path>.+)$', serve_media, name='media'),
+
 ]
 
 